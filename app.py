@@ -1,18 +1,67 @@
 # Fastapi
-from typing import List
-from fastapi import FastAPI
+import asyncio
+import os
+from contextlib import asynccontextmanager, suppress
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
 from complex_agent.complex_agent import ComplexAgent
+from complex_agent.tools import aget_price_stats
 
 # Custom modules
+from infoparser.crud_auto import DataBase, init_db
+from infoparser.facets import FACETS_COLLECTION, rebuild_facets
+from infoparser.indexes import apply_indexes
+from infoparser.price_stats import claim_rebuild, rebuild_price_stats
 from infoparser.schemas import SimpleAutoDB
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# The price cells and the facet catalog are recomputed from scratch this often, they are kept up to date
+# incrementally in between
+PRICE_STATS_REBUILD_HOURS = float(os.getenv("PRICE_STATS_REBUILD_HOURS", "6"))
+# How often each worker checks whether the rebuild is due
+PRICE_STATS_CHECK_SECONDS = 300
+
+
+async def rebuild_aggregates_periodically(db) -> None:
+    # Every uvicorn worker runs this loop, the lease in autos_metadata lets only one of them rebuild
+    while True:
+        try:
+            if await claim_rebuild(db, PRICE_STATS_REBUILD_HOURS * 3600):
+                # Fixes the drift of concurrent incremental updates and the order of the cached catalogs
+                await rebuild_facets(db)
+                await rebuild_price_stats(db)
+        except Exception:
+            logger.exception("Failed to rebuild the facet catalog and price statistics")
+        await asyncio.sleep(min(PRICE_STATS_CHECK_SECONDS, PRICE_STATS_REBUILD_HOURS * 3600))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The process-wide Mongo client, every init_db() of the requests reuses it
+    autos_crud = await init_db()
+    # Indexes are created once here instead of on every request
+    await apply_indexes(autos_crud.db)
+    # First start after the catalog was introduced
+    if not await autos_crud.db[FACETS_COLLECTION].find_one({}, {"_id": 1}):
+        await rebuild_facets(autos_crud.db)
+    # In the background, the first rebuild of a large collection must not hold the startup
+    rebuild_task = asyncio.create_task(rebuild_aggregates_periodically(autos_crud.db))
+    yield
+    rebuild_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await rebuild_task
+    DataBase.close()
+
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -74,3 +123,24 @@ async def ask_question(question_body: CarInfoAsk):
     )
 
     return CarInfoAnswer(answer=answer, conversation_id=question_body.conversation_id)
+
+
+@app.get("/price-stats")
+async def price_stats(marca: str, modelo: Optional[str] = None, year: Optional[str] = None, version: Optional[str] = None):
+    """Price statistics in ARS and USD of the cars of a marca, optionally narrowed by modelo, year and version."""
+    atributos = {
+        "marca": [marca],
+        "modelo": [modelo] if modelo else [],
+        "year": [year] if year else [],
+        "version": [version] if version else [],
+    }
+    stats = await aget_price_stats(atributos)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No hay autos con esos atributos")
+    return stats
+
+
+@app.get("/metrics/mongo-pool")
+async def mongo_pool_metrics():
+    """Connections open and in use, checkouts and checkout waits of the shared Mongo client."""
+    return DataBase.pool_stats()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the HTML extraction backends over saved Autocosmos pages.
+
+The corpus directory holds listing pages as listing_*.html and detail pages as detail_*.html.
+Use --download to save a fresh sample from the live site first.
+"""
+
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from bs4 import BeautifulSoup
+
+from scraper.autocosmos import AutocosmosScraper
+from scraper.extraction import EXTRACTORS, get_extractor
+
+
+async def download_corpus(corpus: Path, pages: int, details: int) -> None:
+    scraper = AutocosmosScraper()
+    await scraper.open_session()
+    try:
+        corpus.mkdir(parents=True, exist_ok=True)
+        detail_count = 0
+        for index in range(1, pages + 1):
+            url = f"{scraper.base_url}/auto/usado?seccion=precio-final&pidx={index}"
+            html = await scraper._fetch(url)
+            (corpus / f"listing_{index}.html").write_text(html)
+            links, _ = scraper.extractor.parse_listing(html)
+            for link in links[:details]:
+                detail_count += 1
+                html = await scraper._fetch(scraper.normalize_url(link))
+                (corpus / f"detail_{detail_count}.html").write_text(html)
+    finally:
+        await scraper.close_session()
+
+
+def article_text(html: Optional[str]) -> Optional[str]:
+    """Whitespace-collapsed text of an extracted article, backends serialize the markup differently."""
+    if html is None:
+        return None
+    return " ".join(BeautifulSoup(html, "html.parser").get_text(" ").split())
+
+
+def timeit(func: Callable[[str], object], pages: List[str], repeat: int) -> float:
+    """Returns the mean milliseconds per page."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            func(page)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark HTML extraction backends")
+    parser.add_argument("corpus", type=Path, help="Directory with listing_*.html and detail_*.html pages")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Passes over the corpus per backend")
+    parser.add_argument("--download", action="store_true", help="Save a fresh sample of pages into the corpus first")
+    parser.add_argument("--pages", type=int, default=2, help="Listing pages to download")
+    parser.add_argument("--details", type=int, default=10, help="Detail pages to download per listing page")
+    args = parser.parse_args()
+
+    if args.download:
+        asyncio.run(download_corpus(args.corpus, args.pages, args.details))
+
+    listings = [path.read_text() for path in sorted(args.corpus.glob("listing_*.html"))]
+    details = [path.read_text() for path in sorted(args.corpus.glob("detail_*.html"))]
+    if not listings or not details:
+        parser.error(f"No listing_*.html or detail_*.html pages in {args.corpus}")
+    print(f"{len(listings)} listing pages, {len(details)} detail pages, {args.repeat} passes")
+
+    reference = get_extractor("bs4")
+    expected_listings = [reference.parse_listing(page) for page in listings]
+    expected_articles = [article_text(reference.article(page)) for page in details]
+    expected_sanitized = [article_text(reference.sanitized_article(page)) for page in details]
+
+    print(f"{'backend':<10} {'listing ms':>11} {'detail ms':>10}  matches bs4")
+    for name in EXTRACTORS:
+        try:
+            extractor = get_extractor(name)
+        except ValueError as error:
+            print(f"{name:<10} skipped: {error}")
+            continue
+        listing_ms = timeit(extractor.parse_listing, listings, args.repeat)
+        detail_ms = timeit(extractor.article, details, args.repeat)
+        matches = (
+            [extractor.parse_listing(page) for page in listings] == expected_listings
+            and [article_text(extractor.article(page)) for page in details] == expected_articles
+            and [article_text(extractor.sanitized_article(page)) for page in details] == expected_sanitized
+        )
+        print(f"{name:<10} {listing_ms:>11.2f} {detail_ms:>10.2f}  {matches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Throughput benchmark of a scraper against the local replay stand-in.
+
+Record a corpus first with `python -m scraper.replay record <corpus>`. The benchmark crawls the
+whole corpus and reports pages/s, bytes/s, parse time and insert time. With --baseline it fails
+when pages/s drops more than --tolerance below a previous result saved with --save.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+from infoparser.crud_auto import DB_NAME, AutoDataBaseCRUD, DataBase, init_db
+from scraper.checkpoint import CrawlCheckpoint
+from scraper.ratelimit import configure_host
+from scraper.registry import available_scrapers, get_scraper_class
+from scraper.replay import MemoryRawSink, ReplayCorpus, add_server_arguments, make_replay_app, start_replay_server
+
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    corpus = ReplayCorpus.load(args.corpus)
+    app = make_replay_app(corpus, args.latency, args.jitter, args.error_rate, seed=args.seed)
+    runner = await start_replay_server(app)
+    host, port = runner.addresses[0][:2]
+    # The limiter starts wide open, we measure the scraper and not the limiter ramp up
+    configure_host(
+        f"{host}:{port}", rate=args.max_rate, max_rate=args.max_rate, initial_concurrency=args.concurrency
+    )
+
+    if args.mongo:
+        # A separate database, the benchmark never touches the real autos_raw
+        await init_db()
+        crud = AutoDataBaseCRUD(DataBase.get_database(f"{DB_NAME}_bench"))
+        await crud.autos_raw_collection.drop()
+    else:
+        crud = MemoryRawSink(insert_delay=args.insert_delay)
+
+    scraper = get_scraper_class(args.site)(concurrency=args.concurrency, incremental=False, max_retries=args.max_retries)
+    scraper.base_url = f"http://{host}:{port}"
+    scraper.retry_backoff = 0.1
+    try:
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            scraper.checkpoint = CrawlCheckpoint(Path(checkpoint_dir) / "bench.json")
+            await scraper.run(1, crud=crud)
+    finally:
+        await runner.cleanup()
+        if args.mongo:
+            await crud.autos_raw_collection.drop()
+
+    stats = scraper.stats
+    return {
+        "site": args.site,
+        "concurrency": args.concurrency,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "pages": stats.listing_pages + stats.detail_pages,
+        "inserted": stats.inserted,
+        "failed": stats.failed,
+        "elapsed_seconds": round(stats.elapsed, 3),
+        "pages_per_second": round(stats.pages_per_second, 2),
+        "bytes_per_second": round(stats.bytes_per_second),
+        "parse_seconds": round(stats.parse_seconds, 3),
+        "insert_seconds": round(stats.insert_seconds, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark a scraper against the replay stand-in")
+    parser.add_argument("corpus", type=Path, help="Corpus directory recorded with scraper.replay")
+    parser.add_argument("-s", "--site", choices=available_scrapers(), default="autocosmos")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--max-rate", type=float, default=1000.0, help="Limiter rate for the stand-in host")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--mongo", action="store_true", help="Insert into a scratch Mongo database instead of memory")
+    parser.add_argument("--insert-delay", type=float, default=0.0, help="Simulated insert latency without --mongo")
+    parser.add_argument("--save", type=Path, help="Write the result as JSON")
+    parser.add_argument("--baseline", type=Path, help="Previous result to compare pages/s against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed pages/s drop vs the baseline (default: 0.2)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(benchmark(args))
+    print(json.dumps(result, indent=2))
+    if args.save:
+        args.save.write_text(json.dumps(result, indent=2))
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        floor = baseline["pages_per_second"] * (1 - args.tolerance)
+        if result["pages_per_second"] < floor:
+            print(f"Regression: {result['pages_per_second']} pages/s < {floor:.2f} (baseline {baseline['pages_per_second']})")
+            sys.exit(1)
+        print(f"OK: {result['pages_per_second']} pages/s >= {floor:.2f}")
+
+
+if __name__ == "__main__":
+    main()
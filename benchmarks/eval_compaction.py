@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Offline evaluation of the compact article text the parser sends to the LLM instead of HTML.
+
+For every detail_*.html page of the corpus (see bench_extraction.py --download) it reports the
+prompt tokens of the stored article HTML and of its compact text, and checks that every text
+fragment and microdata value of the article survives compaction.
+
+With --llm it also extracts a SimpleAuto from both inputs and compares the fields. Extractions are
+saved in the corpus (extractions.json) and reused, so later runs compare them without the API.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from bs4 import BeautifulSoup
+
+from infoparser.compact import SKIP_TAGS, compact_article
+from infoparser.llm_budget import count_tokens
+from infoparser.microdata import read_microdata
+from infoparser.parser_agent import MODEL, CarParserAgent, parse_with_llm
+from infoparser.schemas import SimpleAuto
+from scraper.extraction import get_extractor
+
+EXTRACTIONS_FILE = "extractions.json"
+# Free text, the model words it differently between any two runs
+UNCOMPARED_FIELDS = {"other_info"}
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def missing_fragments(article: str, compact: str) -> List[str]:
+    """Text and microdata values of the article that are not in its compact text."""
+    soup = BeautifulSoup(article, "html.parser")
+    for tag in soup.find_all(SKIP_TAGS):
+        tag.decompose()
+    fragments = [normalize(text) for text in soup.stripped_strings]
+    fragments += [normalize(value) for value in read_microdata(article).values()]
+    compact = normalize(compact)
+    return [fragment for fragment in fragments if fragment and fragment not in compact]
+
+
+def load_articles(corpus: Path) -> Dict[str, str]:
+    extractor = get_extractor()
+    articles = {}
+    for path in sorted(corpus.glob("detail_*.html")):
+        article = extractor.sanitized_article(path.read_text())
+        if article is not None:
+            articles[path.name] = article
+    return articles
+
+
+async def extract(articles: Dict[str, str], saved: dict) -> dict:
+    """SimpleAuto extractions from the HTML and the compact text of each article, reusing saved ones."""
+    agent = CarParserAgent(use_cache=False)
+    for name, article in articles.items():
+        for kind, content in (("html", article), ("compact", compact_article(article))):
+            key = f"{name}:{kind}:{MODEL}"
+            if key not in saved:
+                car = await parse_with_llm(agent.base_prompt, content, SimpleAuto)
+                saved[key] = car.model_dump(mode="json") if car is not None else None
+    return saved
+
+
+def compare(html_car: Optional[dict], compact_car: Optional[dict]) -> List[str]:
+    if html_car is None or compact_car is None:
+        return ["<no extraction>"] if html_car != compact_car else []
+    return [
+        field for field in SimpleAuto.model_fields
+        if field not in UNCOMPARED_FIELDS and html_car.get(field) != compact_car.get(field)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Evaluate the compact article text against the HTML")
+    parser.add_argument("corpus", type=Path, help="Directory with detail_*.html pages")
+    parser.add_argument("--llm", action="store_true", help="Also compare LLM extractions, calls the API for unsaved ones")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the missing fragments and differing fields")
+    args = parser.parse_args()
+
+    articles = load_articles(args.corpus)
+    if not articles:
+        parser.error(f"No detail_*.html pages with an article in {args.corpus}")
+
+    ok = True
+    html_total = compact_total = 0
+    print(f"{'page':<20} {'html tok':>9} {'compact tok':>12} {'saved':>6}  missing")
+    for name, article in articles.items():
+        compact = compact_article(article)
+        html_tokens, compact_tokens = count_tokens(MODEL, article), count_tokens(MODEL, compact)
+        html_total += html_tokens
+        compact_total += compact_tokens
+        missing = missing_fragments(article, compact)
+        ok = ok and not missing
+        print(f"{name:<20} {html_tokens:>9} {compact_tokens:>12} {1 - compact_tokens / html_tokens:>6.0%}  {len(missing)}")
+        if args.verbose:
+            for fragment in missing:
+                print(f"    missing: {fragment!r}")
+    print(f"{'total':<20} {html_total:>9} {compact_total:>12} {1 - compact_total / html_total:>6.0%}")
+
+    if args.llm:
+        extractions_path = args.corpus / EXTRACTIONS_FILE
+        saved = json.loads(extractions_path.read_text()) if extractions_path.exists() else {}
+        saved = asyncio.run(extract(articles, saved))
+        extractions_path.write_text(json.dumps(saved, indent=2, ensure_ascii=False))
+        same = 0
+        for name in articles:
+            differing = compare(saved[f"{name}:html:{MODEL}"], saved[f"{name}:compact:{MODEL}"])
+            same += not differing
+            if differing and args.verbose:
+                print(f"{name}: {', '.join(differing)} differ")
+        ok = ok and same == len(articles)
+        print(f"LLM extractions: {same}/{len(articles)} pages with the same fields ({MODEL})")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
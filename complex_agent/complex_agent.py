@@ -16,7 +16,7 @@ import json
 from complex_agent.tools import aget_car_attributes, aget_price_range
 from langchain_openai import ChatOpenAI
 
-from infoparser.crud_auto import MongoDBChatMessageHistory
+from infoparser.chat_history import MongoDBChatMessageHistory
 
 logger = logging.getLogger(__name__)
 
@@ -1,7 +1,11 @@
-from typing import Any, List, Literal, Tuple, Dict
-from infoparser.crud_auto import init_db, AutoDataBaseCRUD
+from typing import Any, List, Literal, Optional, Tuple, Dict
+from infoparser.crud_auto import PRICE_PERCENTILES, init_db, AutoDataBaseCRUD
+from infoparser.price_stats import expand_spellings, get_price_cells, summarize_cells
 from scraper.dolar import get_dolar_blue_value
 from infoparser.schemas import DolarValues
+from logger import setup_logger
+
+logger = setup_logger(__name__)
 
 
 async def aget_car_attributes(
@@ -54,19 +58,73 @@ async def aget_car_attributes(
             attributes[value] = {"possible_values": []}  # Corrected from key to value
 
     db: AutoDataBaseCRUD = await init_db()
-    # Paso 2: Por cada atributo detectado, buscar en la base de datos todos los posibles valores para ese atributo
+    # Paso 2: Buscar los posibles valores de todos los atributos en el catálogo de facetas
+    values = await db.get_fields_unique_values(list(attributes.keys()))
     for key in attributes.keys():
-        values = await db.get_field_unique_values(key)
         attributes[key][
             "possible_values"
-        ] = values  # Corrected typo from posible_values to possible_values
+        ] = values[key]  # Corrected typo from posible_values to possible_values
 
     return attributes
 
+def _price_range_result(stats: dict, blue: float) -> dict:
+    result = {}
+    for moneda, rate in (("ars", 1.0), ("usd", blue)):
+        for extreme in ("min", "max"):
+            car = stats[extreme]
+            result[f"{extreme}_price_value_{moneda}"] = car["value"] / rate
+            result[f"{extreme}_price_currency_{moneda}"] = moneda.upper()
+            result[f"{extreme}_price_car_id_{moneda}"] = car["id"]
+            result[f"{extreme}_price_car_url_{moneda}"] = car["url"]
+        result[f"mean_price_{moneda}"] = stats["mean"] / rate
+        result[f"median_price_{moneda}"] = stats["median"] / rate
+        for p, value in stats["percentiles"].items():
+            result[f"p{int(p * 100)}_price_{moneda}"] = value / rate
+    result["count"] = stats["count"]
+    return result
+
+
+async def aget_price_stats(atributos: Dict[str, List[Any]]) -> Optional[dict]:
+    """
+    Price statistics of the cars matching any of the values of every attribute, None if no car matches.
+    Questions by marca, modelo, year and version are answered from the precomputed price cells
+    (infoparser.price_stats), other filters are aggregated over autos. Both match marca, modelo,
+    year and version values ignoring case and surrounding spaces.
+    """
+    db: AutoDataBaseCRUD = await init_db()
+    try:
+        cells = await get_price_cells(db.db, atributos)
+    except LookupError:
+        cells = None
+    # No cells can also mean they aren't built yet, the aggregation has the last word
+    if cells:
+        blue = float((await get_dolar_blue_value()).blue)
+        stats = summarize_cells(cells, blue, PRICE_PERCENTILES)
+        if stats:
+            return _price_range_result(stats, blue)
+
+    # Build a mongo filter based on OR conditions for each attribute and AND conditions for all attributes
+    filter = {"ignore": False}
+    for key, values in (await expand_spellings(db.db, atributos)).items():
+        if len(values) == 0:
+            continue
+        filter[key] = {"$in": values}
+    logger.debug(f"Price range filter: {filter}")
+
+    # Dolar price:
+    dolar_values: DolarValues = await get_dolar_blue_value()
+    blue = float(dolar_values.blue)
+
+    # Mongo converts USD to ARS and computes the statistics, only the result comes back
+    stats = await db.get_price_stats(filter, blue)
+    return _price_range_result(stats, blue) if stats else None
+
+
 async def aget_price_range(atributos: dict) -> Tuple[float, float]:
     """
     Given a list of attributes and possible values for each attribute, return the price range
-    of cars that match any of those values for those attributes.
+    of cars that match any of those values for those attributes, in ARS and USD: min and max with
+    the id and url of their car, mean, median, percentiles 10/25/75/90 and the number of cars.
     For example:
     attributes = {
         "atributos": {
@@ -83,76 +141,7 @@ async def aget_price_range(atributos: dict) -> Tuple[float, float]:
         if field not in atributos:
             atributos[field] = []  # Default to an empty list if the field is missing
 
-    # Build a mongo filter based on OR conditions for each attribute and AND conditions for all attributes
-    filter = {"ignore": False}
-    for key, values in atributos.items():
-        if len(values) == 0:
-            continue
-        filter[key] = {"$in": values}
-
-    if not filter:
-        return 0.0, 0.0
-
-    db: AutoDataBaseCRUD = await init_db()
-    print("-" * 20)
-    print(filter)
-    print("-" * 20)
-    cars = await db.get_cars_by_filter(filter)
-    original_prices = [
-        {"value": car.precio, "moneda": car.moneda, "id": car.id, "url": car.url} for car in cars
-    ]
-
-    if not original_prices:
+    result = await aget_price_stats(atributos)
+    if result is None:
         return 0.0, 0.0  # Return a default range if no prices are found
-
-    # Dolar price:
-    dolar_values: DolarValues = await get_dolar_blue_value()
-
-    prices_ars = []
-    prices_usd = []
-    # For price dict in prices, if moneda is USD, convert to ARS using dolar_values.blue
-    for price_dict in original_prices:
-        if price_dict["moneda"] == "USD":
-            prices_usd.append(price_dict)
-            converted_price_dict = price_dict.copy()
-            converted_price_dict["moneda"] = "ARS"
-            converted_price_dict["value"] = price_dict["value"] * float(
-                dolar_values.blue
-            )
-            prices_ars.append(converted_price_dict)
-        elif price_dict["moneda"] == "ARS":
-            prices_ars.append(price_dict)
-            converted_price_dict = price_dict.copy()
-            converted_price_dict["moneda"] = "USD"
-            converted_price_dict["value"] = price_dict["value"] / float(
-                dolar_values.blue
-            )
-            prices_usd.append(converted_price_dict)
-        else:
-            raise ValueError(f"Moneda no reconocida: {price_dict['moneda']}")
-        
-    # Get the price_dict for the min value and max value
-    min_price_dict_ars = min(prices_ars, key=lambda x: x["value"])
-    max_price_dict_ars = max(prices_ars, key=lambda x: x["value"])
-
-    min_price_dict_usd = min(prices_usd, key=lambda x: x["value"])
-    max_price_dict_usd = max(prices_usd, key=lambda x: x["value"])
-
-    return {
-        "min_price_value_ars": min_price_dict_ars["value"],
-        "min_price_currency_ars": min_price_dict_ars["moneda"],
-        "min_price_car_id_ars": min_price_dict_ars["id"],
-        "min_price_car_url_ars": min_price_dict_ars["url"],
-        "max_price_value_ars": max_price_dict_ars["value"],
-        "max_price_currency_ars": max_price_dict_ars["moneda"],
-        "max_price_car_id_ars": max_price_dict_ars["id"],
-        "max_price_car_url_ars": max_price_dict_ars["url"],
-        "min_price_value_usd": min_price_dict_usd["value"],
-        "min_price_currency_usd": min_price_dict_usd["moneda"],
-        "min_price_car_id_usd": min_price_dict_usd["id"],
-        "min_price_car_url_usd": min_price_dict_usd["url"],
-        "max_price_value_usd": max_price_dict_usd["value"],
-        "max_price_currency_usd": max_price_dict_usd["moneda"],
-        "max_price_car_id_usd": max_price_dict_usd["id"],
-        "max_price_car_url_usd": max_price_dict_usd["url"],
-    }
+    return result
@@ -2,12 +2,55 @@
 
 import argparse
 import asyncio
-from scraper.autocosmos import AutocosmosScraper
+import sys
+from typing import Dict, List, Optional
 
+from logger import setup_logger
+from infoparser.crud_auto import run_with_db
+from scraper.extraction import DEFAULT_EXTRACTOR, EXTRACTORS
+from scraper.ratelimit import limiters_summary
+from scraper.registry import available_scrapers, get_scraper_class
+from scraper.sharding import run_sharded
 
-map_scrapers = {
-    "autocosmos": AutocosmosScraper(),
-}
+logger = setup_logger(__name__)
+
+
+async def crawl_sites(
+    sites: List[str],
+    options: dict,
+    site_concurrency: Dict[str, int],
+    from_page: Optional[int] = None,
+) -> List[str]:
+    """Crawls every site concurrently in this event loop, each one with its own concurrency budget.
+
+    Returns the sites whose crawl failed.
+    """
+    scrapers = []
+    for site in sites:
+        site_options = {**options, "concurrency": site_concurrency.get(site, options["concurrency"])}
+        scrapers.append(get_scraper_class(site)(**site_options))
+
+    results = await asyncio.gather(
+        *[scraper.run(from_page) for scraper in scrapers], return_exceptions=True
+    )
+    failed = []
+    for scraper, result in zip(scrapers, results):
+        if isinstance(result, BaseException):
+            logger.error("%s failed: %r", scraper.name, result)
+            failed.append(scraper.name)
+        logger.info("%s: %s", scraper.name, scraper.stats.summary())
+    logger.info("Rate limits: %s", limiters_summary())
+    return failed
+
+
+def parse_site_concurrency(values: List[str]) -> Dict[str, int]:
+    site_concurrency = {}
+    for value in values:
+        site, _, concurrency = value.partition("=")
+        if site not in available_scrapers() or not concurrency.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid --site-concurrency value: {value}")
+        site_concurrency[site] = int(concurrency)
+    return site_concurrency
 
 
 if __name__ == "__main__":
@@ -20,19 +63,119 @@ Examples:
 
   python extract.py --sites site1 site2 ... siteN
   python extract.py -s site1 site2 ... siteN
+
+  python extract.py --concurrency 8
+    Fetch up to 8 detail pages at a time over one pooled connection
+
+  python extract.py --workers 4
+    Split the listing pages among 4 processes
+
+  python extract.py -s site1 site2 --concurrency 4 --site-concurrency site2=16
+    Crawl both sites at the same time, 4 detail fetches in flight for site1 and 16 for site2
 """
     )
     parser.add_argument(
         "-s", "--sites",
         nargs="+",
-        choices=list(map_scrapers.keys()),
-        default=list(map_scrapers.keys()),
+        choices=available_scrapers(),
+        default=available_scrapers(),
         help="List of sites to scrape (default: all)",
         dest="sites"
     )
-    parser.add_argument("-f", "--from-page", type=int, default=1, help="From page to scrape")
+    parser.add_argument(
+        "-f", "--from-page",
+        type=int,
+        default=None,
+        help="From page to scrape, starts a fresh crawl (default: resume from the last checkpoint or page 1)",
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=1,
+        help="Max detail pages fetched in parallel over a shared session (default: 1)",
+    )
+    parser.add_argument(
+        "--site-concurrency",
+        nargs="+",
+        default=[],
+        metavar="SITE=N",
+        help="Per-site override of --concurrency",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=100,
+        help="Max links buffered between listing and detail fetches (default: 100)",
+    )
+    parser.add_argument(
+        "--flush-size",
+        type=int,
+        default=50,
+        help="Raw cars written to Mongo per batch (default: 50)",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="Max seconds a raw car waits before being written to Mongo (default: 5)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-fetch listings already stored in autos_raw",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=3,
+        help="Retries with backoff for a failed page before giving up on it (default: 3)",
+    )
+    parser.add_argument(
+        "--parser",
+        choices=list(EXTRACTORS.keys()),
+        default=DEFAULT_EXTRACTOR,
+        help=f"HTML extraction backend (default: {DEFAULT_EXTRACTOR})",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help="Max requests per second per host and worker, the limiter adapts below it (default: 20)",
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, each one crawls a share of the listing pages (default: 1)",
+    )
     args = parser.parse_args()
+    try:
+        site_concurrency = parse_site_concurrency(args.site_concurrency)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
 
-    scrapers = [map_scrapers[site] for site in args.sites]
-    for scraper in scrapers:
-        asyncio.run(scraper.run(args.from_page))
+    options = {
+        "concurrency": args.concurrency,
+        "queue_size": args.queue_size,
+        "flush_size": args.flush_size,
+        "flush_interval": args.flush_interval,
+        "incremental": not args.full,
+        "extractor": args.parser,
+        "max_retries": args.max_retries,
+        "max_rate": args.max_rate,
+    }
+    if args.workers > 1:
+        # Each site is already spread over all the worker processes
+        failed = []
+        for site in args.sites:
+            site_options = {**options, "concurrency": site_concurrency.get(site, args.concurrency)}
+            try:
+                run_sharded(get_scraper_class(site), site_options, args.workers, args.from_page)
+            except RuntimeError as error:
+                logger.error("%s failed: %s", site, error)
+                failed.append(site)
+    else:
+        failed = run_with_db(crawl_sites(args.sites, options, site_concurrency, args.from_page))
+    # A nonzero exit lets cron and CI notice a failed crawl
+    if failed:
+        sys.exit(f"Crawl failed for {', '.join(failed)}")
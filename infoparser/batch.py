@@ -0,0 +1,180 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, Tuple, Type
+
+from openai import AsyncOpenAI
+from openai.types import Batch
+from pydantic import BaseModel, ValidationError
+
+from logger import setup_logger
+from .crud_auto import init_db
+from .microdata import SOURCE_LLM
+from .parser_agent import MODEL, TEMPERATURE, CarParserAgent, missing_fields_model
+from .schemas import SimpleAuto
+
+logger = setup_logger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch API limit of requests per input file
+MAX_BATCH_REQUESTS = 50000
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+INSERT_CHUNK = 500
+
+
+class BatchParser:
+    """Bulk extraction of raw cars through the OpenAI Batch API.
+
+    Three steps: export unextracted raw cars to a JSONL file, submit it and poll the job, then ingest
+    the results into autos and mark the raw cars extracted. Exported raw cars are claimed with the
+    file name as batch_id, moved to the job's id once submitted, so workers and other runs skip them.
+    Cars left without a result, or in a file that could not be submitted, are released to be sent again.
+    """
+
+    def __init__(self, batch_dir: Path, client: Optional[AsyncOpenAI] = None, poll_interval: float = 60.0):
+        self.batch_dir = batch_dir
+        self.client = client or AsyncOpenAI()
+        self.poll_interval = poll_interval
+        self.agent = CarParserAgent(use_cache=False)
+
+    @staticmethod
+    def _response_format(model: Type[BaseModel]) -> dict:
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": model.__name__, "schema": model.model_json_schema()},
+        }
+
+    def _request(self, custom_id: str, prompt: str, car_info: str, missing: Tuple[str, ...]) -> dict:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": MODEL,
+                "messages": [
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": car_info},
+                ],
+                "response_format": self._response_format(missing_fields_model(missing)),
+                "temperature": float(TEMPERATURE),
+            },
+        }
+
+    async def export(self, limit: int = MAX_BATCH_REQUESTS) -> Optional[Path]:
+        """Claims raw cars and writes the batch input file. Cars fully covered by the microdata rules are inserted right away."""
+        autos_crud = await init_db()
+        path = self.batch_dir / f"batch-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.jsonl"
+        raw_cars = await autos_crud.claim_raw_cars_for_batch(path.name, min(limit, MAX_BATCH_REQUESTS))
+        try:
+            requests, ready = [], []
+            for raw_car in raw_cars:
+                fields, missing, prompt = self.agent.prepare_extraction(raw_car.text, raw_car.url)
+                if not missing:
+                    try:
+                        car, field_sources = self.agent.merge_fields(fields, missing, None)
+                        ready.append((car, raw_car.id, field_sources))
+                        continue
+                    except ValidationError:
+                        missing, prompt = tuple(SimpleAuto.model_fields), self.agent.base_prompt
+                requests.append(self._request(raw_car.id, prompt, self.agent.llm_input(raw_car.text), missing))
+
+            if ready:
+                await autos_crud.insert_cars(ready)
+                logger.info(f"Inserted {len(ready)} cars without LLM")
+            if not requests:
+                return None
+
+            self.batch_dir.mkdir(parents=True, exist_ok=True)
+            with path.open("w") as batch_file:
+                for request in requests:
+                    batch_file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        except BaseException:
+            await autos_crud.release_raw_cars_batch(path.name)
+            raise
+        logger.info(f"Exported {len(requests)} requests to {path}. {self.agent.input_summary()}")
+        return path
+
+    async def submit(self, path: Path) -> str:
+        """Uploads and submits an exported file, its raw cars are released if that fails."""
+        autos_crud = await init_db()
+        try:
+            with path.open("rb") as batch_file:
+                input_file = await self.client.files.create(file=batch_file, purpose="batch")
+            batch = await self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window="24h",
+                metadata={"source": path.name},
+            )
+        except BaseException:
+            released = await autos_crud.release_raw_cars_batch(path.name)
+            logger.error(f"Could not submit {path}, released its {released} raw cars")
+            raise
+        await autos_crud.set_raw_cars_batch(path.name, batch.id)
+        logger.info(f"Submitted batch {batch.id} from {path}")
+        return batch.id
+
+    async def wait(self, batch_id: str) -> Batch:
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            logger.info(f"Batch {batch_id}: {batch.status} {batch.request_counts}")
+            if batch.status in FINAL_STATUSES:
+                return batch
+            await asyncio.sleep(self.poll_interval)
+
+    async def ingest(self, batch: Batch) -> int:
+        autos_crud = await init_db()
+        results = {}
+        if batch.status != "completed":
+            logger.error(f"Batch {batch.id} ended as {batch.status}")
+        # Expired and cancelled batches also have the output of the requests they finished
+        if batch.output_file_id:
+            content = await self.client.files.content(batch.output_file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+        ingested = 0
+        raw_car_ids = list(results.keys())
+        for start in range(0, len(raw_car_ids), INSERT_CHUNK):
+            cars = []
+            for raw_car in await autos_crud.get_raw_cars_by_ids(raw_car_ids[start:start + INSERT_CHUNK]):
+                if raw_car.extracted:
+                    continue
+                fields, missing, _ = self.agent.prepare_extraction(raw_car.text, raw_car.url)
+                try:
+                    try:
+                        llm_fields = missing_fields_model(missing).model_validate_json(results[raw_car.id])
+                        car, field_sources = self.agent.merge_fields(fields, missing, llm_fields.model_dump())
+                    except ValidationError:
+                        # Exported as a full extraction because the rule fields were invalid
+                        car = SimpleAuto.model_validate_json(results[raw_car.id])
+                        field_sources = {name: SOURCE_LLM for name in SimpleAuto.model_fields}
+                except ValidationError as error:
+                    logger.warning(f"Invalid batch result for raw car {raw_car.id}: {error}")
+                    continue
+                cars.append((car, raw_car.id, field_sources))
+            await autos_crud.insert_cars(cars)
+            ingested += len(cars)
+
+        # Only the cars without a valid result are still unextracted
+        released = await autos_crud.release_raw_cars_batch(batch.id)
+        logger.info(f"Batch {batch.id}: ingested {ingested} cars, released {released} for a new batch")
+        return ingested
+
+    async def run(self, limit: int = MAX_BATCH_REQUESTS, batch_id: Optional[str] = None) -> int:
+        """Runs the three steps, or only waits and ingests when resuming a submitted `batch_id`."""
+        if batch_id is None:
+            path = await self.export(limit)
+            if path is None:
+                logger.info("No cars to parse")
+                return 0
+            batch_id = await self.submit(path)
+        batch = await self.wait(batch_id)
+        return await self.ingest(batch)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Local stand-in of the OpenAI Files and Batches endpoints, to run `parse_data.py --batch` offline.
+
+Every batch completes on its first poll, answers are placeholder values built from each request's
+json_schema. Run it and point the client at it with OPENAI_BASE_URL=http://127.0.0.1:8901/v1.
+"""
+
+import argparse
+import json
+import time
+import uuid
+from typing import Dict
+
+from aiohttp import web
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def placeholder(schema: dict, defs: Dict[str, dict]):
+    if "$ref" in schema:
+        return placeholder(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    if "anyOf" in schema:
+        return placeholder(next((s for s in schema["anyOf"] if s.get("type") != "null"), {}), defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {name: placeholder(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return []
+    return {"string": "", "integer": 0, "number": 0.0, "boolean": False}.get(schema_type)
+
+
+def answer(request: dict) -> dict:
+    json_schema = request["body"]["response_format"]["json_schema"]["schema"]
+    content = placeholder(json_schema, json_schema.get("$defs", {}))
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex}",
+        "custom_id": request["custom_id"],
+        "response": {
+            "status_code": 200,
+            "request_id": uuid.uuid4().hex,
+            "body": {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["body"]["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": json.dumps(content)},
+                    "finish_reason": "stop",
+                }],
+            },
+        },
+        "error": None,
+    }
+
+
+def make_batch_app() -> web.Application:
+    files: Dict[str, bytes] = {}
+    batches: Dict[str, dict] = {}
+
+    def file_object(file_id: str, purpose: str) -> dict:
+        return {
+            "id": file_id, "object": "file", "bytes": len(files[file_id]), "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed",
+        }
+
+    async def create_file(request: web.Request) -> web.Response:
+        form = await request.post()
+        file_id = f"file-{uuid.uuid4().hex}"
+        files[file_id] = form["file"].file.read()
+        return web.json_response(file_object(file_id, form.get("purpose", "batch")))
+
+    async def file_content(request: web.Request) -> web.Response:
+        content = files.get(request.match_info["file_id"])
+        if content is None:
+            return web.json_response({"error": {"message": "No such file"}}, status=404)
+        return web.Response(body=content, content_type="application/jsonl")
+
+    async def create_batch(request: web.Request) -> web.Response:
+        body = await request.json()
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body["endpoint"], "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"], "status": "validating", "created_at": int(time.time()),
+            "metadata": body.get("metadata"), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        return web.json_response(batches[batch_id])
+
+    async def retrieve_batch(request: web.Request) -> web.Response:
+        batch = batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"message": "No such batch"}}, status=404)
+        if batch["status"] == "validating":
+            lines = [json.loads(line) for line in files[batch["input_file_id"]].splitlines() if line.strip()]
+            output_file_id = f"file-{uuid.uuid4().hex}"
+            files[output_file_id] = "".join(json.dumps(answer(line)) + "\n" for line in lines).encode("utf-8")
+            batch.update(
+                status="completed", output_file_id=output_file_id, completed_at=int(time.time()),
+                request_counts={"total": len(lines), "completed": len(lines), "failed": 0},
+            )
+        return web.json_response(batch)
+
+    app = web.Application(client_max_size=200 * 1024 ** 2)
+    app.router.add_post("/v1/files", create_file)
+    app.router.add_get("/v1/files/{file_id}/content", file_content)
+    app.router.add_post("/v1/batches", create_batch)
+    app.router.add_get("/v1/batches/{batch_id}", retrieve_batch)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of the OpenAI Batch API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    args = parser.parse_args()
+    web.run_app(make_batch_app(), host=args.host, port=args.port, access_log=None)
@@ -0,0 +1,315 @@
+import json
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence, Tuple, Union
+
+import pymongo
+from bson import ObjectId
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import MongoClient, errors
+from pymongo.collection import Collection
+
+from logger import setup_logger
+from .crud_auto import DB_NAME, DB_URI, MONGO_MAX_POOL_SIZE, MONGO_TLS_ENABLED, init_db
+from .indexes import CONVERSATIONS_COLLECTION
+
+logger = setup_logger(__name__)
+
+# Conversations kept in memory, follow-up turns of a recent conversation skip reading the messages
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "256"))
+
+# (message _id, message) of a conversation, oldest first
+History = List[Tuple[ObjectId, BaseMessage]]
+
+
+class HistoryCache:
+    """LRU of (user_id, conversation_id) -> messages with their _id.
+
+    Other API workers may write the same conversation, so an entry is only a starting point: the
+    reader checks the newest _id in Mongo and reads what is missing (see aget_messages).
+    """
+
+    def __init__(self, size: int = CHAT_HISTORY_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], History]" = OrderedDict()
+
+    def get(self, key: Tuple[str, str]) -> Optional[History]:
+        history = self._entries.get(key)
+        if history is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return history
+
+    def put(self, key: Tuple[str, str], history: History) -> None:
+        self._entries[key] = history
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def merge(cached: History, history: History) -> None:
+        """Adds the messages `cached` doesn't have yet, keeping it in _id order."""
+        known = {message_id for message_id, _ in cached}
+        cached.extend(item for item in history if item[0] not in known)
+        cached.sort(key=lambda item: item[0])
+
+    def append(self, key: Tuple[str, str], history: History) -> None:
+        # Only extends a history read before, a partial one would hide older messages
+        cached = self._entries.get(key)
+        if cached is not None:
+            self.merge(cached, history)
+
+    def drop_conversation(self, conversation_id: str) -> None:
+        for key in [key for key in self._entries if key[1] == conversation_id]:
+            del self._entries[key]
+
+
+history_cache = HistoryCache()
+_sync_client: Optional[MongoClient] = None
+
+
+def get_sync_collection() -> Collection:
+    """Conversations through a process-wide pymongo client, for the sync interface only."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = MongoClient(
+            DB_URI,
+            tls=MONGO_TLS_ENABLED,
+            tlsAllowInvalidCertificates=True,
+            retryWrites=False,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+        )
+    return _sync_client[DB_NAME][CONVERSATIONS_COLLECTION]
+
+
+def _load_message(document: dict) -> BaseMessage:
+    message = document["Message"]
+    # Messages stored before the BSON format are JSON strings
+    if isinstance(message, str):
+        message = json.loads(message)
+    return messages_from_dict([message])[0]
+
+
+class MongoDBChatMessageHistory(BaseChatMessageHistory):
+    """Chat message history stored in MongoDB through the shared Motor client.
+
+    The async interface (aget_messages, aadd_messages, aclear and the a-prefixed versions of the
+    other methods), the one RunnableWithMessageHistory uses under ainvoke, runs on the shared Motor
+    client and the history cache. The sync one reads and writes directly with pymongo. Messages are
+    stored as BSON documents.
+    """
+
+    DEFAULT_COLLECTION_NAME = CONVERSATIONS_COLLECTION
+    CONTEXT_HOURS = 24
+
+    def __init__(self, conversation_id: str, user_id: str, cache: HistoryCache = history_cache):
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.cache = cache
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.user_id, self.conversation_id)
+
+    async def get_collection(self) -> AsyncIOMotorCollection:
+        autos_crud = await init_db()
+        # Indexes come from infoparser.indexes, applied at startup
+        return autos_crud.db[self.DEFAULT_COLLECTION_NAME]
+
+    def _since(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(hours=self.CONTEXT_HOURS)
+
+    def _history_query(self) -> dict:
+        query = {}
+        if self.conversation_id:
+            query["ConversationId"] = self.conversation_id
+        if self.user_id:
+            query["UserId"] = self.user_id
+        query["_id"] = {"$gt": ObjectId.from_datetime(self._since())}
+        return query
+
+    async def _read_history(self, collection: AsyncIOMotorCollection, after: Optional[ObjectId] = None) -> History:
+        query = self._history_query()
+        if after is not None:
+            query["_id"] = {"$gt": max(after, query["_id"]["$gt"])}
+        cursor = collection.find(query).sort("_id", pymongo.ASCENDING)
+        return [(document["_id"], _load_message(document)) async for document in cursor]
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """Messages of the conversation from the last CONTEXT_HOURS.
+
+        A cached conversation costs one indexed lookup of its newest _id, only messages written
+        since (e.g. by another worker) are read.
+        """
+        collection = await self.get_collection()
+        history = self.cache.get(self.key)
+        try:
+            if history is not None:
+                newest = await collection.find_one(
+                    self._history_query(), {"_id": 1}, sort=[("_id", pymongo.DESCENDING)]
+                )
+                cached_newest = history[-1][0] if history else None
+                newest_id = newest["_id"] if newest else None
+                if newest_id != cached_newest:
+                    if cached_newest is not None and newest_id is not None and newest_id > cached_newest:
+                        self.cache.merge(history, await self._read_history(collection, after=cached_newest))
+                    else:
+                        # Cleared or expired meanwhile, read it again
+                        history = None
+            if history is None:
+                history = await self._read_history(collection)
+                self.cache.put(self.key, history)
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+        since = ObjectId.from_datetime(self._since())
+        # Messages leave the context window, drop them from the cached list too
+        history[:] = [item for item in history if item[0] > since]
+        return [message for _, message in history]
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Appends the messages to the conversation in MongoDB"""
+        if not messages:
+            return
+        collection = await self.get_collection()
+        documents = [
+            {"ConversationId": self.conversation_id, "UserId": self.user_id, "Message": message_to_dict(message)}
+            for message in messages
+        ]
+        try:
+            await collection.insert_many(documents)
+        except errors.WriteError as err:
+            logger.error(err)
+            return
+        # insert_many sets the _id of the documents
+        self.cache.append(self.key, [(document["_id"], message) for document, message in zip(documents, messages)])
+
+    async def aclear(self) -> None:
+        """Clear session memory from MongoDB"""
+        self.cache.drop_conversation(self.conversation_id)
+        collection = await self.get_collection()
+        try:
+            await collection.delete_many({"ConversationId": self.conversation_id})
+        except errors.WriteError as err:
+            logger.error(err)
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        """Retrieve the messages from MongoDB"""
+        try:
+            cursor = get_sync_collection().find(self._history_query()).sort("_id", pymongo.ASCENDING)
+            return [_load_message(document) for document in cursor]
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages to the record in MongoDB"""
+        if not messages:
+            return
+        try:
+            get_sync_collection().insert_many([
+                {"ConversationId": self.conversation_id, "UserId": self.user_id, "Message": message_to_dict(message)}
+                for message in messages
+            ])
+        except errors.WriteError as err:
+            logger.error(err)
+
+    def clear(self) -> None:
+        """Clear session memory from MongoDB"""
+        self.cache.drop_conversation(self.conversation_id)
+        try:
+            get_sync_collection().delete_many({"ConversationId": self.conversation_id})
+        except errors.WriteError as err:
+            logger.error(err)
+
+    def get_last_message_for_user(self) -> Union[BaseMessage, None]:
+        """
+        Returns the last message of a user or None if the user has no messages.
+        """
+        if not self.user_id:
+            raise ValueError("User ID is required to get the last message for a user.")
+        document = get_sync_collection().find_one({"UserId": self.user_id}, sort=[("_id", pymongo.DESCENDING)])
+        return _load_message(document) if document else None
+
+    async def aget_last_message_for_user(self) -> Union[BaseMessage, None]:
+        """Async version of get_last_message_for_user."""
+        if not self.user_id:
+            raise ValueError("User ID is required to get the last message for a user.")
+        collection = await self.get_collection()
+        document = await collection.find_one({"UserId": self.user_id}, sort=[("_id", pymongo.DESCENDING)])
+        return _load_message(document) if document else None
+
+    def get_existing_conversation_id(self) -> Union[str, None]:
+        document = get_sync_collection().find_one(self._history_query(), {"ConversationId": 1})
+        return document["ConversationId"] if document else None
+
+    async def aget_existing_conversation_id(self) -> Union[str, None]:
+        collection = await self.get_collection()
+        document = await collection.find_one(self._history_query(), {"ConversationId": 1})
+        return document["ConversationId"] if document else None
+
+    def new_conversation(self) -> str:
+        """Create a new conversation in MongoDB"""
+        self.conversation_id = str(uuid.uuid4())
+        return str(self.conversation_id)
+
+    def _conversation_query(self) -> dict:
+        return {"ConversationId": self.conversation_id, "UserId": self.user_id}
+
+    def _feedback_update(self, feedback_score: int, feedback_detail: Optional[str]) -> dict:
+        if not self.conversation_id:
+            raise ValueError("Conversation ID is required to update feedback.")
+        return {
+            "$set": {
+                "feedback_score": feedback_score,
+                "feedback_detail": feedback_detail,
+                "feedback_timestamp": datetime.now(timezone.utc),
+            }
+        }
+
+    def exists(self) -> bool:
+        """Check if a conversation exists in MongoDB"""
+        try:
+            document = get_sync_collection().find_one(self._conversation_query(), {"_id": 1})
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return False
+        return document is not None
+
+    async def aexists(self) -> bool:
+        """Async version of exists."""
+        collection = await self.get_collection()
+        try:
+            document = await collection.find_one(self._conversation_query(), {"_id": 1})
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return False
+        return document is not None
+
+    def update_feedback(self, feedback_score: int, feedback_detail: Optional[str]) -> int:
+        update = self._feedback_update(feedback_score, feedback_detail)
+        try:
+            updated_result = get_sync_collection().update_many({"ConversationId": self.conversation_id}, update)
+        except errors.WriteError as err:
+            logger.error(err)
+            return 0
+        return updated_result.modified_count
+
+    async def aupdate_feedback(self, feedback_score: int, feedback_detail: Optional[str]) -> int:
+        update = self._feedback_update(feedback_score, feedback_detail)
+        collection = await self.get_collection()
+        try:
+            updated_result = await collection.update_many({"ConversationId": self.conversation_id}, update)
+        except errors.WriteError as err:
+            logger.error(err)
+            return 0
+        return updated_result.modified_count
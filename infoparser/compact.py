@@ -0,0 +1,58 @@
+import re
+from typing import List
+
+from bs4 import BeautifulSoup, Comment
+
+from .microdata import read_microdata
+
+# Markup without listing text
+SKIP_TAGS = ["script", "style", "svg", "noscript", "iframe", "link", "button", "form", "template", "img", "picture"]
+# Tags that start a new line of text
+BLOCK_TAGS = [
+    "address", "article", "aside", "dd", "div", "dl", "dt", "figcaption", "footer", "h1", "h2", "h3", "h4",
+    "h5", "h6", "header", "li", "ol", "p", "section", "table", "tbody", "thead", "ul",
+]
+
+
+def _text(tag) -> str:
+    return re.sub(r"\s+", " ", tag.get_text(" ", strip=True))
+
+
+def compact_article(html: str) -> str:
+    """Article HTML as the plain text the LLM needs: one line per block, specs as "label: value".
+
+    Microdata values only found in attributes (price, currency, dates) go first as "itemprop: value".
+    Lines repeated within the article are kept once.
+    """
+    microdata = read_microdata(html)
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup.find_all(SKIP_TAGS):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+
+    # Spec tables and definition lists become key/value lines
+    for row in soup.find_all("tr"):
+        cells = [_text(cell) for cell in row.find_all(["th", "td"])]
+        row.replace_with("\n" + ": ".join(cell for cell in cells if cell) + "\n")
+    for term in soup.find_all("dt"):
+        definition = term.find_next_sibling("dd")
+        if definition is not None:
+            term.replace_with(f"\n{_text(term)}: {_text(definition)}\n")
+            definition.decompose()
+    for tag in soup.find_all("br"):
+        tag.replace_with("\n")
+    for tag in soup.find_all(BLOCK_TAGS):
+        tag.insert_before("\n")
+        tag.insert_after("\n")
+
+    lines: List[str] = []
+    seen = set()
+    for line in soup.get_text(" ").split("\n"):
+        line = re.sub(r"\s+", " ", line).strip()
+        if line and line not in seen:
+            seen.add(line)
+            lines.append(line)
+    text = "\n".join(lines)
+    hidden = [f"{prop}: {value}" for prop, value in microdata.items() if value not in text]
+    return "\n".join(hidden + lines)
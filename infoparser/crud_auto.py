@@ -1,24 +1,22 @@
+import asyncio
 import logging
+from collections import Counter
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Union
+from typing import AsyncIterator, Awaitable, Dict, Optional, List, Set, Tuple, Type, TypeVar, Union
 from .schemas import SimpleAuto, SimpleAutoDB, AutoRaw, AutoRawDB
+from .facets import FACET_FIELDS, METADATA_COLLECTION, apply_facet_deltas, facet_catalog, facet_deltas
+from .price_stats import PRICE_FIELDS, apply_price_stats_updates, price_stats_updates
+from .indexes import CARS_COLLECTION, RAW_COLLECTION, apply_indexes
+from .pool_metrics import PoolMetrics
+from .raw_storage import compress_text
 import dotenv
 import os
 from bson import ObjectId
+from pydantic import BaseModel
 from typing import Any
-from pymongo import MongoClient, errors
+from pymongo import errors
 import pymongo
-from langchain_core.messages import (
-    BaseMessage,
-    SystemMessage,
-    messages_from_dict,
-    message_to_dict,
-)
-import uuid
-from urllib.parse import urlencode
-from langchain_core.chat_history import BaseChatMessageHistory
-import json
 
 dotenv.load_dotenv()
 
@@ -29,21 +27,60 @@ MONGO_PORT = os.getenv("MONGO_PORT")
 MONGO_TLS_ENABLED = True if os.getenv("MONGO_TLS_ENABLED", "0") == "1" else False
 DB_URI = f"mongodb://{MONGO_DB_USER}:{MONGO_DB_PASS}@{MONGO_HOST}:{MONGO_PORT}"
 DB_NAME = os.getenv("AUTOS_DATABASE_DB")
+# Connection pool of the process-wide client, pymongo's defaults when unset
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0")) or None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None
+
+PRICE_PERCENTILES = (0.1, 0.25, 0.75, 0.9)
+# Documents per round trip of the streaming reads, bounds what a worker holds of a large result
+CURSOR_BATCH_SIZE = 500
+
+# Parse queue states of autos_raw, documents without status are pending
+RAW_STATUS_PENDING = "pending"
+RAW_STATUS_PROCESSING = "processing"
+RAW_STATUS_DONE = "done"
+RAW_STATUS_DEAD = "dead"
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 class DataBase:
+    """Process-wide Motor client, created once by the app lifespan or the CLI entry points.
+
+    Later initialize() calls on the same event loop are free, so code can keep calling init_db().
+    """
     client: Optional[AsyncIOMotorClient] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    metrics: Optional[PoolMetrics] = None
 
     @classmethod
     async def initialize(cls, uri: str, tls: bool = True) -> None:
-        cls.client = AsyncIOMotorClient(uri, tls=tls, tlsAllowInvalidCertificates=True)
+        loop = asyncio.get_running_loop()
+        # One client per event loop, Motor binds a client to the loop it first runs on
+        if cls.client is not None and cls.loop is loop:
+            return
+        cls.metrics = PoolMetrics()
+        cls.client = AsyncIOMotorClient(
+            uri,
+            tls=tls,
+            tlsAllowInvalidCertificates=True,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[cls.metrics],
+        )
+        cls.loop = loop
         # Optionally, you can test the connection here
         try:
             await cls.client.admin.command('ping')
             logger.info("Successfully connected to MongoDB.")
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {e}")
+            cls.client = None
             raise
 
     @classmethod
@@ -52,18 +89,53 @@ class DataBase:
             raise Exception("Database client is not initialized.")
         return cls.client[name]
 
+    @classmethod
+    def pool_stats(cls) -> Dict[str, float]:
+        if cls.metrics is None:
+            return {}
+        return {"max_pool_size": MONGO_MAX_POOL_SIZE, **cls.metrics.snapshot()}
+
+    @classmethod
+    def close(cls) -> None:
+        if cls.client is None:
+            return
+        logger.info(f"Closing MongoDB client, pool: {cls.pool_stats()}")
+        cls.client.close()
+        cls.client = None
+        cls.loop = None
+
 
 class AutoDataBaseCRUD:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db: AsyncIOMotorDatabase = db
-        self.autos_collection = self.db["autos"]
-        self.autos_metadata_collection = self.db["autos_metadata"]
-        self.autos_raw_collection = self.db["autos_raw"]
-
-    async def insert_raw_car(self, raw_car_data: str) -> AutoRawDB:
+        self.autos_collection = self.db[CARS_COLLECTION]
+        self.autos_metadata_collection = self.db[METADATA_COLLECTION]
+        self.autos_raw_collection = self.db[RAW_COLLECTION]
+
+    @staticmethod
+    async def _stream(
+        cursor,
+        model: Optional[Type[BaseModel]] = None,
+        batch_size: int = CURSOR_BATCH_SIZE,
+    ) -> AsyncIterator[Union[dict, BaseModel]]:
+        """Yields the documents of `cursor` one batch at a time, as dicts with a str _id or as `model`."""
+        async for document in cursor.batch_size(batch_size):
+            if "_id" in document:
+                document["_id"] = str(document["_id"])
+            yield model.model_validate(document) if model else document
+
+    async def ensure_raw_indexes(self) -> None:
+        await apply_indexes(self.db, [RAW_COLLECTION])
+
+    async def get_raw_urls(self) -> Set[str]:
+        cursor = self.autos_raw_collection.find({"url": {"$type": "string"}}, {"url": 1, "_id": 0})
+        return {car["url"] async for car in cursor}
+
+    async def insert_raw_car(self, raw_car_data: str, url: Optional[str] = None) -> AutoRawDB:
         current_time = datetime.now(timezone.utc)
         car_dict = {
-            "text": raw_car_data,
+            **compress_text(raw_car_data),
+            "url": url,
             "created_at": current_time,
             "updated_at": current_time,
             "extracted": False,
@@ -71,7 +143,7 @@ class AutoDataBaseCRUD:
         }
         result = await self.autos_raw_collection.insert_one(car_dict)
         car_dict["_id"] = str(result.inserted_id)
-        return AutoRawDB(**car_dict)
+        return AutoRawDB(**car_dict, text=raw_car_data)
 
     async def get_raw_car_by_id(self, car_id: str) -> Optional[AutoRaw]:
         try:
@@ -84,232 +156,376 @@ class AutoDataBaseCRUD:
             return AutoRaw(**car)
         return None
 
-    async def get_raw_cars_not_extracted(self, offset: int, limit: int) -> List[AutoRawDB]:
-        cursor = self.autos_raw_collection.find({"extracted": False}).skip(offset).limit(limit)
-        cars = []
-        async for car in cursor:
-            car["_id"] = str(car["_id"])
-            cars.append(AutoRawDB(**car))
-        return cars
+    async def ensure_car_indexes(self) -> None:
+        await apply_indexes(self.db, [CARS_COLLECTION])
+
+    @staticmethod
+    def _car_key(car: SimpleAuto) -> dict:
+        return {"source": car.source, "external_id": car.external_id}
 
-    async def insert_car(self, car: SimpleAuto, raw_car_id: str) -> SimpleAutoDB:
+    @staticmethod
+    def _car_upsert(car: SimpleAuto, field_sources: Optional[Dict[str, str]], current_time: datetime) -> dict:
         car_dict = car.model_dump()
-        current_time = datetime.now(timezone.utc)
-        car_dict["created_at"] = current_time
+        # Which extraction path ("rules" or "llm") produced each field
+        car_dict["field_sources"] = field_sources
         car_dict["updated_at"] = current_time
-        result = await self.autos_collection.insert_one(car_dict)
-        car_dict["_id"] = str(result.inserted_id)
-        await self.autos_raw_collection.find_one_and_update(
-            {"_id": ObjectId(raw_car_id)},
-            {"$set": {"extracted": True, "updated_at": current_time, "extracted_car_id": car_dict["_id"]}},
+        car_dict["last_seen"] = current_time
+        return {
+            "$set": car_dict,
+            "$setOnInsert": {"created_at": current_time, "first_seen": current_time},
+        }
+
+    def _raw_extracted_update(self, car_id: str, current_time: datetime) -> dict:
+        return {"$set": {
+            "extracted": True,
+            "status": RAW_STATUS_DONE,
+            "lease_until": None,
+            "extracted_at": current_time,
+            "updated_at": current_time,
+            "extracted_car_id": car_id,
+        }}
+
+    async def insert_car(
+        self, car: SimpleAuto, raw_car_id: str, field_sources: Optional[Dict[str, str]] = None
+    ) -> SimpleAutoDB:
+        """Upserts the car on (source, external_id), a repost updates the stored listing."""
+        current_time = datetime.now(timezone.utc)
+        update = self._car_upsert(car, field_sources, current_time)
+        # The id of an insert is chosen here, with the pre-image the deltas come from this very write
+        update["$setOnInsert"]["_id"] = ObjectId()
+        previous = await self.autos_collection.find_one_and_update(
+            self._car_key(car), update, upsert=True, return_document=pymongo.ReturnDocument.BEFORE
+        )
+        if previous is None:
+            car_dict = {**update["$setOnInsert"], **update["$set"]}
+        else:
+            car_dict = {**previous, **update["$set"]}
+        car_dict["_id"] = str(car_dict["_id"])
+        await apply_facet_deltas(self.db, facet_deltas(previous, car_dict))
+        await apply_price_stats_updates(self.db, price_stats_updates(previous, car_dict))
+        await self.autos_raw_collection.update_one(
+            {"_id": ObjectId(raw_car_id)}, self._raw_extracted_update(car_dict["_id"], current_time)
         )
         return SimpleAutoDB(**car_dict)
     
-    async def exists_car(self, car: SimpleAuto) -> bool:
-        result = await self.autos_collection.find_one({"external_id": car.external_id})
-        return result is not None
-
-    async def get_field_unique_values(self, field: str) -> List[Any]:
-        cursor = self.autos_collection.find({}, {field: 1})
-        values = set()
-        async for car in cursor:
-            if field in car:
-                values.add(car[field])
-        return list(values)
-    
-    async def get_cars_by_filter(self, filter: dict) -> List[SimpleAutoDB]:
-        cursor = self.autos_collection.find(filter)
-        cars = []
-        async for car in cursor:
-            car["_id"] = str(car["_id"])  # Convert _id to string
-            cars.append(SimpleAutoDB.model_validate(car))
-        return cars
-    
-    async def insert_many_raw_cars(self, raw_car_data_list: List[str]) -> List[AutoRawDB]:
+    async def insert_cars(self, cars: List[Tuple[SimpleAuto, str, Optional[Dict[str, str]]]]) -> int:
+        """Bulk version of insert_car for (car, raw_car_id, field_sources) tuples, returns the new listings."""
+        if not cars:
+            return 0
         current_time = datetime.now(timezone.utc)
-        car_dicts = [
-            {
-                "text": raw_car_data,
-                "created_at": current_time,
-                "updated_at": current_time,
-                "extracted": False,
-            }
-            for raw_car_data in raw_car_data_list
-        ]
-        result = await self.autos_raw_collection.insert_many(car_dicts)
-        for i, inserted_id in enumerate(result.inserted_ids):
-            car_dicts[i]["_id"] = str(inserted_id)
-        return [AutoRawDB(**car_dict) for car_dict in car_dicts]
-
-
-class MongoDBChatMessageHistory(BaseChatMessageHistory):
-    """Chat message history that stores history in MongoDB."""
-
-    DEFAULT_COLLECTION_NAME = "conversations"
-    CONTEXT_HOURS = 24
-    # LIMIT = 15
-
-    def __init__(
-        self,
-        conversation_id: str,
-        user_id: str,
-    ):
-        self.conversation_id = conversation_id
-        self.user_id = user_id
-
-        params = {
-            "tls": "true" if MONGO_TLS_ENABLED else "false",
-            "tlsAllowInvalidCertificates": "true",
-            "retryWrites": "false",
-        }
-        self.connection_string = f"{DB_URI}?{urlencode(params)}"
-        try:
-            self.client: MongoClient = MongoClient(self.connection_string)
-        except errors.ConnectionFailure as error:
-            logger.error(error)
+        # The last parse of a listing wins when it appears twice in the batch
+        latest = {(car.source, car.external_id): (car, field_sources) for car, _, field_sources in cars}
+        keys = list(latest)
+        # Stored versions of these listings, for their ids and the facet counts and price cells they change
+        previous = {}
+        cursor = self.autos_collection.find(
+            {"$or": [{"source": source, "external_id": external_id} for source, external_id in keys]},
+            {"source": 1, "external_id": 1, **{field: 1 for field in FACET_FIELDS + PRICE_FIELDS}},
+        )
+        async for car in cursor:
+            previous[(car["source"], car["external_id"])] = car
+        result = await self.autos_collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    self._car_key(car), self._car_upsert(car, field_sources, current_time), upsert=True
+                )
+                for car, field_sources in latest.values()
+            ],
+            ordered=False,
+        )
+        car_ids = {key: str(car["_id"]) for key, car in previous.items()}
+        car_ids.update({keys[index]: str(car_id) for index, car_id in result.upserted_ids.items()})
+        # Inserted by another writer between the lookup and the upsert
+        racing = [{"source": source, "external_id": external_id} for source, external_id in keys if (source, external_id) not in car_ids]
+        if racing:
+            cursor = self.autos_collection.find({"$or": racing}, {"source": 1, "external_id": 1})
+            async for car in cursor:
+                car_ids[(car["source"], car["external_id"])] = str(car["_id"])
+        for key in [key for key in keys if key not in car_ids]:
+            # Deleted by another writer right after the upsert, store it again the way insert_car does
+            car, field_sources = latest[key]
+            stored = await self.autos_collection.find_one_and_update(
+                self._car_key(car),
+                self._car_upsert(car, field_sources, current_time),
+                {"_id": 1},
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+            car_ids[key] = str(stored["_id"])
+        deltas, price_updates = Counter(), []
+        for key, (car, _) in latest.items():
+            car_dict = {**car.model_dump(), "_id": car_ids[key]}
+            deltas.update(facet_deltas(previous.get(key), car_dict))
+            price_updates.extend(price_stats_updates(previous.get(key), car_dict))
+        await apply_facet_deltas(self.db, deltas)
+        await apply_price_stats_updates(self.db, price_updates)
+        await self.autos_raw_collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {"_id": ObjectId(raw_car_id)},
+                    self._raw_extracted_update(car_ids[(car.source, car.external_id)], current_time),
+                )
+                for car, raw_car_id, _ in cars
+            ],
+            ordered=False,
+        )
+        return result.upserted_count
 
-        self.db = self.client[DB_NAME]
-        self.collection = self.db[self.DEFAULT_COLLECTION_NAME]
-        self.collection.create_index("ConversationId")
-        self.collection.create_index("UserId")
+    async def claim_raw_cars_for_batch(self, claim_id: str, limit: int) -> List[AutoRawDB]:
+        """Sets `claim_id` as the batch_id of up to `limit` claimable raw cars and returns them.
 
-    def get_last_message_for_user(self) -> Union[BaseMessage, None]:
+        Claimed before the Batch API job exists so claim_raw_cars workers skip them, a car a worker
+        leases in between keeps its lease and is left out.
         """
-        Returns the last message of a user or None if the user has no messages.
-        """
-        if not self.user_id:
-            raise ValueError("User ID is required to get the last message for a user.")
-
-        query, items = {}, []
-
-        query["UserId"] = self.user_id
-
-        try:
-            cursor = (
-                self.collection.find(query).limit(1).sort("_id", pymongo.DESCENDING)
-            )
-            return cursor[0]
-        except IndexError:
-            return None
+        now = datetime.now(timezone.utc)
+        cursor = self.autos_raw_collection.find(self._claimable_filter(now), {"_id": 1}).limit(limit)
+        car_ids = [car["_id"] async for car in cursor]
+        await self.autos_raw_collection.update_many(
+            {"_id": {"$in": car_ids}, **self._claimable_filter(now)},
+            {"$set": {"batch_id": claim_id, "updated_at": now}},
+        )
+        cursor = self.autos_raw_collection.find({"batch_id": claim_id, "extracted": False})
+        return [car async for car in self._stream(cursor, AutoRawDB)]
 
-    def get_history(self) -> pymongo.cursor.Cursor:
-        query, items = {}, []
+    async def get_raw_cars_by_ids(self, car_ids: List[str]) -> List[AutoRawDB]:
+        cursor = self.autos_raw_collection.find({"_id": {"$in": [ObjectId(car_id) for car_id in car_ids]}})
+        return [car async for car in self._stream(cursor, AutoRawDB)]
 
-        if self.conversation_id:
-            query["ConversationId"] = self.conversation_id
+    @staticmethod
+    def _claimable_filter(now: datetime, max_attempts: Optional[int] = None) -> dict:
+        """Raw cars nobody holds: not extracted, not in a Batch API job, not dead and without a live lease."""
+        query = {
+            "extracted": False,
+            "batch_id": None,
+            "status": {"$ne": RAW_STATUS_DEAD},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}],
+        }
+        if max_attempts is not None:
+            query["attempts"] = {"$not": {"$gte": max_attempts}}
+        return query
 
-        if self.user_id:
-            query["UserId"] = self.user_id
+    async def claim_raw_cars(
+        self, worker_id: str, limit: int, lease_seconds: float, max_attempts: int
+    ) -> List[AutoRawDB]:
+        """Atomically leases up to `limit` raw cars to `worker_id`.
 
-        query["_id"] = {
-            "$gt": ObjectId.from_datetime(
-                datetime.now() - timedelta(hours=self.CONTEXT_HOURS)
+        A car whose lease expires (the worker died) can be claimed again, after `max_attempts`
+        claims it is no longer claimable and dead_letter_expired_raw_cars moves it to the dead state.
+        """
+        now = datetime.now(timezone.utc)
+        cars = []
+        for _ in range(limit):
+            car = await self.autos_raw_collection.find_one_and_update(
+                self._claimable_filter(now, max_attempts),
+                {
+                    "$set": {
+                        "status": RAW_STATUS_PROCESSING,
+                        "claimed_by": worker_id,
+                        "claimed_at": now,
+                        "lease_until": now + timedelta(seconds=lease_seconds),
+                        "updated_at": now,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                return_document=pymongo.ReturnDocument.AFTER,
             )
-        }
+            if car is None:
+                break
+            car["_id"] = str(car["_id"])
+            cars.append(AutoRawDB(**car))
+        return cars
 
-        try:
-            cursor = self.collection.find(query)
-        except errors.OperationFailure as error:
-            logger.error(error)
+    async def dead_letter_expired_raw_cars(self, max_attempts: int) -> int:
+        """Dead-letters claimed raw cars whose lease expired on their last attempt."""
+        now = datetime.now(timezone.utc)
+        result = await self.autos_raw_collection.update_many(
+            {
+                "extracted": False,
+                "status": RAW_STATUS_PROCESSING,
+                "lease_until": {"$lte": now},
+                "attempts": {"$gte": max_attempts},
+            },
+            {"$set": {"status": RAW_STATUS_DEAD, "lease_until": None, "last_error": "Lease expired", "updated_at": now}},
+        )
+        return result.modified_count
 
-        return cursor
+    async def release_raw_car(
+        self, car_id: str, worker_id: str, error: str, max_attempts: int, count_attempt: bool = True
+    ) -> None:
+        """Gives a claimed raw car back to the queue, or dead-letters it once it used all its attempts.
 
-    @property
-    def messages(self) -> List[BaseMessage]:  # type: ignore
-        """Retrieve the messages from MongoDB"""
-        cursor = self.get_history()
+        `count_attempt=False` is for failures that are not the car's fault, like rate limits.
+        """
+        attempts = "$attempts" if count_attempt else {"$subtract": ["$attempts", 1]}
+        await self.autos_raw_collection.update_one(
+            {"_id": ObjectId(car_id), "claimed_by": worker_id, "status": RAW_STATUS_PROCESSING},
+            [{"$set": {
+                "attempts": attempts,
+                "status": {"$cond": [{"$gte": [attempts, max_attempts]}, RAW_STATUS_DEAD, RAW_STATUS_PENDING]},
+                "lease_until": None,
+                "last_error": error,
+                "updated_at": datetime.now(timezone.utc),
+            }}],
+        )
 
-        if cursor:
-            # messages = cursor.limit(self.LIMIT)
-            items = [json.loads(document["Message"]) for document in cursor]
+    async def requeue_dead_raw_cars(self) -> int:
+        result = await self.autos_raw_collection.update_many(
+            {"extracted": False, "status": RAW_STATUS_DEAD},
+            {"$set": {"status": RAW_STATUS_PENDING, "attempts": 0, "updated_at": datetime.now(timezone.utc)}},
+        )
+        return result.modified_count
+
+    async def get_queue_stats(self, window_minutes: int = 15) -> dict:
+        """Queue depth by state and extraction throughput over the last `window_minutes`."""
+        now = datetime.now(timezone.utc)
+        since = now - timedelta(minutes=window_minutes)
+        pipeline = [{"$facet": {
+            "states": [{"$group": {
+                "_id": {
+                    "extracted": "$extracted",
+                    "status": "$status",
+                    "leased": {"$gt": ["$lease_until", now]},
+                    "in_batch": {"$ne": [{"$ifNull": ["$batch_id", None]}, None]},
+                },
+                "count": {"$sum": 1},
+            }}],
+            "recent": [
+                {"$match": {"extracted_at": {"$gte": since}}},
+                {"$group": {"_id": "$claimed_by", "count": {"$sum": 1}}},
+            ],
+        }}]
+        result = await self.autos_raw_collection.aggregate(pipeline).to_list(length=1)
+        stats = {"pending": 0, "processing": 0, "in_batch": 0, "dead": 0, "done": 0}
+        for state in result[0]["states"]:
+            key = state["_id"]
+            if key.get("extracted"):
+                stats["done"] += state["count"]
+            elif key.get("status") == RAW_STATUS_DEAD:
+                stats["dead"] += state["count"]
+            elif key.get("in_batch"):
+                stats["in_batch"] += state["count"]
+            elif key.get("status") == RAW_STATUS_PROCESSING and key.get("leased"):
+                stats["processing"] += state["count"]
+            else:
+                stats["pending"] += state["count"]
+        workers = {recent["_id"] or "unknown": recent["count"] for recent in result[0]["recent"]}
+        stats["extracted_last_window"] = sum(workers.values())
+        stats["per_minute"] = stats["extracted_last_window"] / window_minutes
+        stats["workers"] = workers
+        return stats
+
+    async def set_raw_cars_batch(self, claim_id: str, batch_id: str) -> None:
+        """Moves the raw cars claimed with `claim_id` to the Batch API job they were sent in."""
+        await self.autos_raw_collection.update_many(
+            {"batch_id": claim_id, "extracted": False},
+            {"$set": {"batch_id": batch_id, "updated_at": datetime.now(timezone.utc)}},
+        )
 
-        # Parse messages
-        messages = messages_from_dict(items)
+    async def release_raw_cars_batch(self, batch_id: str) -> int:
+        """Frees the raw cars of a Batch API job that were not extracted, so they can be sent again."""
+        result = await self.autos_raw_collection.update_many(
+            {"batch_id": batch_id, "extracted": False},
+            {"$set": {"batch_id": None, "updated_at": datetime.now(timezone.utc)}},
+        )
+        return result.modified_count
 
-        return messages
+    async def exists_car(self, car: SimpleAuto) -> bool:
+        result = await self.autos_collection.find_one(self._car_key(car), {"_id": 1})
+        return result is not None
 
-    def get_existing_conversation_id(self) -> Union[str, None]:
-        cursor = self.get_history()
-        if cursor:
-            try:
-                return cursor[0]["ConversationId"]
-            except IndexError:
-                return None
-        else:
+    async def get_fields_unique_values(self, fields: List[str]) -> Dict[str, List[Any]]:
+        return await facet_catalog.get_values(self.db, fields)
+    
+    async def get_price_stats(
+        self, filter: dict, usd_rate: float, percentiles: Tuple[float, ...] = PRICE_PERCENTILES
+    ) -> Optional[dict]:
+        """Price count, mean, extremes, median and percentiles of the matching cars, in ARS, computed by Mongo.
+
+        USD prices are converted with `usd_rate` inside the pipeline, only precio, moneda, url and _id
+        leave the index/documents. The extremes include the car they belong to. None if no car matches.
+        $median and $percentile need MongoDB 7.0 or newer.
+        """
+        extreme = {
+            "value": "$precio_ars",
+            "precio": "$precio",
+            "moneda": "$moneda",
+            "id": {"$toString": "$_id"},
+            "url": "$url",
+        }
+        pipeline = [
+            # The same cars the price cells count
+            {"$match": {**filter, "moneda": {"$in": ["ARS", "USD"]}, "precio": {"$gt": 0}}},
+            {"$project": {"precio": 1, "moneda": 1, "url": 1}},
+            {"$set": {"precio_ars": {
+                "$cond": [{"$eq": ["$moneda", "USD"]}, {"$multiply": ["$precio", usd_rate]}, "$precio"]
+            }}},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "mean": {"$avg": "$precio_ars"},
+                "min": {"$top": {"sortBy": {"precio_ars": 1}, "output": extreme}},
+                "max": {"$top": {"sortBy": {"precio_ars": -1}, "output": extreme}},
+                "median": {"$median": {"input": "$precio_ars", "method": "approximate"}},
+                "percentiles": {"$percentile": {"input": "$precio_ars", "p": list(percentiles), "method": "approximate"}},
+            }},
+        ]
+        result = await self.autos_collection.aggregate(pipeline).to_list(length=1)
+        if not result:
             return None
+        stats = result[0]
+        stats["percentiles"] = dict(zip(percentiles, stats["percentiles"]))
+        return stats
 
-    def add_message(self, message: BaseMessage) -> None:
-        """Append the message to the record in MongoDB"""
-        try:
-            self.collection.insert_one(
-                {
-                    "ConversationId": self.conversation_id,
-                    "UserId": self.user_id,
-                    "Message": json.dumps(message_to_dict(message)),
-                }
-            )
-        except errors.WriteError as err:
-            logger.error(err)
-
-    def clear(self) -> None:
-        """Clear session memory from MongoDB"""
-        try:
-            self.collection.delete_many({"ConversationId": self.conversation_id})
-        except errors.WriteError as err:
-            logger.error(err)
-
-    def new_conversation(self) -> str:
-        """Create a new conversation in MongoDB"""
-        self.conversation_id = str(uuid.uuid4())
-        # message = SystemMessage(prompts.AGENT_MEMORY_SYSTEM_PROMPT)
-        # self.add_message(message)
-        return str(self.conversation_id)
-
-    def exists(self) -> bool:
-        """Check if a conversation exists in MongoDB"""
-        try:
-            return (
-                self.collection.find_one(
-                    {
-                        "ConversationId": self.conversation_id,
-                        "UserId": self.user_id,
-                    }
-                )
-                is not None
-            )
-        except errors.OperationFailure as error:
-            logger.error(error)
-            return False
-
-    def update_feedback(
-        self, feedback_score: int, feedback_detail: Optional[str]
-    ) -> Union[str, None]:
-        if not self.conversation_id:
-            raise ValueError("Conversation ID is required to update feedback.")
-
-        updated_count = 0
-
+    async def insert_many_raw_cars(self, raw_cars: List[AutoRaw]) -> List[AutoRawDB]:
+        current_time = datetime.now(timezone.utc)
+        car_dicts = [
+            {
+                **compress_text(raw_car.text),
+                "url": raw_car.url,
+                "created_at": current_time,
+                "updated_at": current_time,
+                "extracted": False,
+            }
+            for raw_car in raw_cars
+        ]
+        # Unordered so a listing stored by a concurrent run doesn't abort the whole batch
+        failed = set()
         try:
-            updated_result = self.collection.update_many(
-                {"ConversationId": self.conversation_id},
-                {
-                    "$set": {
-                        "feedback_score": feedback_score,
-                        "feedback_detail": feedback_detail,
-                        "feedback_timestamp": datetime.now(),
-                    }
-                },
-            )
-            updated_count = updated_result.modified_count
-
-        except errors.WriteError as err:
-            logger.error(err)
+            await self.autos_raw_collection.insert_many(car_dicts, ordered=False)
+        except errors.BulkWriteError as error:
+            for write_error in error.details["writeErrors"]:
+                if write_error["code"] != 11000:
+                    raise
+                failed.add(write_error["index"])
+            logger.info(f"Skipped {len(failed)} raw cars already stored")
+        inserted = []
+        for i, car_dict in enumerate(car_dicts):
+            if i in failed:
+                continue
+            car_dict["_id"] = str(car_dict["_id"])
+            inserted.append(AutoRawDB(**car_dict, text=raw_cars[i].text))
+        return inserted
 
-        return updated_count
-    
 
 async def init_db():
     await DataBase.initialize(DB_URI, tls=MONGO_TLS_ENABLED)
     db = DataBase.get_database(DB_NAME)
     autos_crud = AutoDataBaseCRUD(db)
     return autos_crud
+
+
+def run_with_db(main: Awaitable[T]) -> T:
+    """asyncio.run for the CLI entry points, sharing one client for the whole run and closing it after."""
+
+    async def runner() -> T:
+        try:
+            await init_db()
+        except Exception:
+            main.close()
+            raise
+        try:
+            return await main
+        finally:
+            DataBase.close()
+
+    return asyncio.run(runner())
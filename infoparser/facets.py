@@ -0,0 +1,140 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FACETS_COLLECTION = "autos_facets"
+METADATA_COLLECTION = "autos_metadata"
+# autos_metadata document whose `version` changes when a value appears or disappears, or the catalog is rebuilt
+FACETS_VERSION_ID = "facets"
+# Attributes the agent can ask values for
+FACET_FIELDS = [
+    "marca",
+    "modelo",
+    "year",
+    "version",
+    "color",
+    "tipo_de_combustible",
+    "puertas",
+    "transmision",
+    "motor",
+    "tipo_de_carroceria",
+    "kilometros",
+    "direccion",
+]
+
+
+def facet_deltas(old: Optional[dict], new: Optional[dict]) -> Counter:
+    """(field, value) count changes when a car goes from `old` to `new`, None for an insert or a delete."""
+    deltas: Counter = Counter()
+    for field in FACET_FIELDS:
+        old_value = old.get(field) if old else None
+        new_value = new.get(field) if new else None
+        if old_value == new_value:
+            continue
+        if old_value is not None:
+            deltas[(field, old_value)] -= 1
+        if new_value is not None:
+            deltas[(field, new_value)] += 1
+    return deltas
+
+
+async def bump_facets_version(db: AsyncIOMotorDatabase) -> int:
+    version = await db[METADATA_COLLECTION].find_one_and_update(
+        {"_id": FACETS_VERSION_ID}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return version["version"]
+
+
+async def apply_facet_deltas(db: AsyncIOMotorDatabase, deltas: Counter) -> None:
+    """Applies the count changes, the version only changes when a value appears or disappears.
+
+    Plain count changes keep the cached catalogs, so their most-common-first order can lag until
+    the next new or removed value or the periodic rebuild.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    result = await db[FACETS_COLLECTION].bulk_write(
+        [
+            UpdateOne({"field": field, "value": value}, {"$inc": {"count": delta}}, upsert=True)
+            for (field, value), delta in deltas.items()
+        ],
+        ordered=False,
+    )
+    changed = result.upserted_count > 0
+    if any(delta < 0 for delta in deltas.values()):
+        deleted = await db[FACETS_COLLECTION].delete_many({"count": {"$lte": 0}})
+        changed = changed or deleted.deleted_count > 0
+    if changed:
+        await bump_facets_version(db)
+
+
+async def rebuild_facets(db: AsyncIOMotorDatabase, cars_collection: str = "autos") -> int:
+    """Recomputes the whole catalog from the cars with one aggregation, returns the number of values.
+
+    Incremental updates can drift when two workers write the same listing at once, this fixes it.
+    """
+    pipeline = [
+        {"$project": {"_id": 0, "facets": [{"field": field, "value": f"${field}"} for field in FACET_FIELDS]}},
+        {"$unwind": "$facets"},
+        {"$match": {"facets.value": {"$ne": None}}},
+        {"$group": {"_id": {"field": "$facets.field", "value": "$facets.value"}, "count": {"$sum": 1}}},
+        {"$project": {"_id": 0, "field": "$_id.field", "value": "$_id.value", "count": 1}},
+        # $out swaps the collection in one step and keeps its indexes
+        {"$out": FACETS_COLLECTION},
+    ]
+    await db[cars_collection].aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+    await bump_facets_version(db)
+    size = await db[FACETS_COLLECTION].count_documents({})
+    logger.info(f"Rebuilt the facet catalog: {size} values")
+    return size
+
+
+class FacetCatalog:
+    """In-process cache of the facet catalog, dropped whenever the catalog version changes.
+
+    Every read costs one lookup of the version, the values are only fetched again after a change.
+    The cache tracks which values exist, their order by count is refreshed by the periodic rebuild.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.values: Dict[str, List[Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_values(self, db: AsyncIOMotorDatabase, fields: Iterable[str]) -> Dict[str, List[Any]]:
+        """Distinct values of each field, most common first."""
+        fields = list(fields)
+        metadata = await db[METADATA_COLLECTION].find_one({"_id": FACETS_VERSION_ID})
+        version = metadata["version"] if metadata else None
+        # Versions only grow, a slower request that read an older one doesn't roll the cache back
+        if self.version is None or (version is not None and version > self.version):
+            self.version = version
+            self.values = {}
+        values = {field: self.values[field] for field in fields if field in self.values}
+        missing = [field for field in fields if field not in values]
+        self.hits += len(values)
+        self.misses += len(missing)
+        if missing:
+            # Read into a local dict, other requests keep using the cache while this one waits
+            fetched: Dict[str, List[Any]] = {field: [] for field in missing}
+            cursor = db[FACETS_COLLECTION].find(
+                {"field": {"$in": missing}}, {"_id": 0, "field": 1, "value": 1}
+            ).sort([("field", 1), ("count", -1)])
+            async for facet in cursor:
+                fetched[facet["field"]].append(facet["value"])
+            values.update(fetched)
+            # Not cached if the catalog changed meanwhile
+            if self.version == version:
+                self.values.update(fetched)
+        return {field: values[field] for field in fields}
+
+
+facet_catalog = FacetCatalog()
@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, errors
+
+from logger import setup_logger
+from .facets import FACETS_COLLECTION
+from .llm_cache import CACHE_COLLECTION_NAME
+
+logger = setup_logger(__name__)
+
+CARS_COLLECTION = "autos"
+RAW_COLLECTION = "autos_raw"
+CONVERSATIONS_COLLECTION = "conversations"
+CAR_KEY_INDEX = "source_external_id_unique"
+
+
+class IndexSpec(BaseModel):
+    collection: str
+    keys: List[Tuple[str, int]]
+    name: Optional[str] = Field(default=None, description="Defaults to the name Mongo generates from the keys")
+    unique: bool = False
+    partial_filter: Optional[Dict[str, Any]] = None
+
+    def model(self) -> IndexModel:
+        options: Dict[str, Any] = {"unique": self.unique}
+        if self.name:
+            options["name"] = self.name
+        if self.partial_filter:
+            options["partialFilterExpression"] = self.partial_filter
+        return IndexModel(self.keys, **options)
+
+
+INDEXES: List[IndexSpec] = [
+    # One document per listing, ingestion upserts on this key
+    IndexSpec(collection=CARS_COLLECTION, keys=[("source", 1), ("external_id", 1)], name=CAR_KEY_INDEX, unique=True),
+    # Price range filters of the agent: $in on marca, modelo and year, always with ignore
+    IndexSpec(collection=CARS_COLLECTION, keys=[("marca", 1), ("modelo", 1), ("year", 1), ("ignore", 1)]),
+    IndexSpec(collection=CARS_COLLECTION, keys=[("modelo", 1), ("year", 1), ("ignore", 1)]),
+    # Unique per listing URL; old documents without url are left out of the index
+    IndexSpec(
+        collection=RAW_COLLECTION, keys=[("url", 1)], unique=True, partial_filter={"url": {"$type": "string"}}
+    ),
+    # Parse queue claims and the Batch API export
+    IndexSpec(collection=RAW_COLLECTION, keys=[("extracted", 1), ("lease_until", 1)]),
+    # Chat history of a conversation within the context window, and the last message of a user
+    IndexSpec(collection=CONVERSATIONS_COLLECTION, keys=[("ConversationId", 1), ("UserId", 1), ("_id", 1)]),
+    IndexSpec(collection=CONVERSATIONS_COLLECTION, keys=[("UserId", 1), ("_id", -1)]),
+    # Facet catalog: incremental $inc upserts, and the values of a field by count
+    IndexSpec(collection=FACETS_COLLECTION, keys=[("field", 1), ("value", 1)], unique=True),
+    IndexSpec(collection=FACETS_COLLECTION, keys=[("field", 1), ("count", -1)]),
+    # LRU eviction of the LLM cache
+    IndexSpec(collection=CACHE_COLLECTION_NAME, keys=[("last_used_at", 1)]),
+]
+
+
+async def apply_indexes(
+    db: AsyncIOMotorDatabase, collections: Optional[Iterable[str]] = None, prune: bool = False
+) -> List[str]:
+    """Creates the INDEXES of `collections` (all by default), returns the names created or already there.
+
+    A failing index (e.g. unique over duplicated data) is logged and skipped. With `prune`, indexes
+    not in the spec are dropped.
+    """
+    collections = set(collections) if collections is not None else {spec.collection for spec in INDEXES}
+    applied = []
+    for collection in sorted(collections):
+        specs = [spec for spec in INDEXES if spec.collection == collection]
+        for spec in specs:
+            try:
+                applied.extend(await db[collection].create_indexes([spec.model()]))
+            except errors.OperationFailure as error:
+                logger.error(f"Could not create index {spec.keys} on {collection}: {error}")
+        if prune:
+            declared = {spec.model().document["name"] for spec in specs} | {"_id_"}
+            for name in await db[collection].index_information():
+                if name not in declared:
+                    await db[collection].drop_index(name)
+                    logger.info(f"Dropped index {name} of {collection}, not in the spec")
+    return applied
+
+
+class HotQuery(BaseModel):
+    name: str
+    collection: str
+    filter: Callable[[], Dict[str, Any]]
+    sort: Optional[List[Tuple[str, int]]] = None
+
+
+def _claim_filter() -> Dict[str, Any]:
+    from .crud_auto import AutoDataBaseCRUD
+
+    return AutoDataBaseCRUD._claimable_filter(datetime.now(timezone.utc), 3)
+
+
+def _recent_history_filter() -> Dict[str, Any]:
+    since = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(hours=24))
+    return {"ConversationId": "1", "UserId": "test", "_id": {"$gt": since}}
+
+
+# Query shapes on the request path, they must run as index scans
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery(
+        name="price range by marca/modelo/year",
+        collection=CARS_COLLECTION,
+        filter=lambda: {
+            "ignore": False, "marca": {"$in": ["Toyota", "TOYOTA"]},
+            "modelo": {"$in": ["Corolla"]}, "year": {"$in": ["2020"]},
+        },
+    ),
+    HotQuery(
+        name="price range by marca",
+        collection=CARS_COLLECTION,
+        filter=lambda: {"ignore": False, "marca": {"$in": ["Toyota"]}},
+    ),
+    HotQuery(
+        name="price range by modelo/year",
+        collection=CARS_COLLECTION,
+        filter=lambda: {"ignore": False, "modelo": {"$in": ["Corolla"]}, "year": {"$in": ["2020"]}},
+    ),
+    HotQuery(
+        name="listing upsert key",
+        collection=CARS_COLLECTION,
+        filter=lambda: {"source": "autocosmos.com.ar", "external_id": "1"},
+    ),
+    HotQuery(name="parse queue claim", collection=RAW_COLLECTION, filter=_claim_filter),
+    HotQuery(name="raw car by url", collection=RAW_COLLECTION, filter=lambda: {"url": "https://example.com/1"}),
+    HotQuery(name="conversation history", collection=CONVERSATIONS_COLLECTION, filter=_recent_history_filter),
+    HotQuery(
+        name="last message of a user",
+        collection=CONVERSATIONS_COLLECTION,
+        filter=lambda: {"UserId": "test"},
+        sort=[("_id", -1)],
+    ),
+    HotQuery(
+        name="facet values",
+        collection=FACETS_COLLECTION,
+        filter=lambda: {"field": {"$in": ["marca", "modelo"]}},
+        sort=[("field", 1), ("count", -1)],
+    ),
+    HotQuery(name="LLM cache eviction", collection=CACHE_COLLECTION_NAME, filter=lambda: {}, sort=[("last_used_at", 1)]),
+]
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Every stage of an explain plan, SBE plans nest the classic plan under queryPlan."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+async def check_query_plans(db: AsyncIOMotorDatabase) -> List[Tuple[str, bool, List[str]]]:
+    """Explains every HOT_QUERIES shape: (name, uses an index without a collection scan, plan stages)."""
+    results = []
+    for query in HOT_QUERIES:
+        cursor = db[query.collection].find(query.filter())
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        # EOF: the collection doesn't exist yet, there is nothing to scan
+        uses_index = "COLLSCAN" not in stages and any(
+            stage in ("IXSCAN", "EXPRESS_IXSCAN", "IDHACK", "EOF") for stage in stages
+        )
+        results.append((query.name, uses_index, stages))
+    return results
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from logger import setup_logger
+from .crud_auto import AutoDataBaseCRUD
+from .schemas import SimpleAuto
+
+logger = setup_logger(__name__)
+
+
+class CarIngestSink:
+    """Buffers parsed cars and writes them to Mongo in batches.
+
+    Each flush is one bulk upsert into autos plus one unordered bulk_write marking the raw cars
+    extracted, every `flush_size` cars or `flush_interval` seconds. Use it as an async context
+    manager, leaving it flushes what is left.
+    """
+
+    def __init__(self, crud: AutoDataBaseCRUD, flush_size: int = 50, flush_interval: float = 5.0):
+        self.crud = crud
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.inserted = 0
+        self.new_listings = 0
+        self.failed = 0
+        self.flushes = 0
+        self.write_seconds: List[float] = []
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=flush_size * 2)
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "CarIngestSink":
+        self._task = asyncio.create_task(self._flush_loop())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._queue.put(None)
+        await self._task
+
+    async def add(self, car: SimpleAuto, raw_car_id: str, field_sources: Optional[Dict[str, str]] = None) -> None:
+        await self._queue.put((car, raw_car_id, field_sources))
+
+    async def _flush_loop(self) -> None:
+        batch = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        done = False
+        while not done:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=max(deadline - loop.time(), 0))
+                if item is None:
+                    done = True
+                else:
+                    batch.append(item)
+            except asyncio.TimeoutError:
+                pass
+            # Flush by size, by time or when the sink is closed
+            if done or len(batch) >= self.flush_size or loop.time() >= deadline:
+                if batch:
+                    await self._flush(batch)
+                    batch = []
+                deadline = loop.time() + self.flush_interval
+
+    async def _flush(self, batch: List[Tuple[SimpleAuto, str, Optional[Dict[str, str]]]]) -> None:
+        start = time.perf_counter()
+        try:
+            new_listings = await self.crud.insert_cars(batch)
+        except Exception:
+            # The raw cars stay claimed, other workers take them again when the lease expires
+            logger.exception(f"Failed to write {len(batch)} cars")
+            self.failed += len(batch)
+            return
+        self.write_seconds.append(time.perf_counter() - start)
+        self.flushes += 1
+        self.inserted += len(batch)
+        self.new_listings += new_listings
+        logger.info(f"Wrote {len(batch)} cars ({new_listings} new) in {self.write_seconds[-1] * 1000:.0f}ms")
+
+    def summary(self) -> str:
+        if not self.write_seconds:
+            return f"Ingest: {self.inserted} cars written, {self.failed} failed"
+        latencies = sorted(self.write_seconds)
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        return (
+            f"Ingest: {self.inserted} cars written ({self.new_listings} new listings) in {self.flushes} flushes, "
+            f"{self.failed} failed, "
+            f"write latency mean {sum(latencies) / len(latencies) * 1000:.0f}ms, "
+            f"p95 {p95 * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms"
+        )
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Type
+
+import httpx
+import openai
+from pydantic import BaseModel
+
+from logger import setup_logger
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = setup_logger(__name__)
+
+# Starting quota until the first response brings the real limits in its headers
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "64"))
+# Share of the quota we plan to use, the rest absorbs estimate errors and other clients of the key
+HEADROOM = float(os.getenv("LLM_QUOTA_HEADROOM", "0.9"))
+# Completion tokens assumed per structured extraction, they count against the quota too
+EXPECTED_OUTPUT_TOKENS = 300
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds of an x-ratelimit-reset-* header, like "1s", "6m0s" or "20ms"."""
+    if not value:
+        return None
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+_encodings: Dict[Optional[str], object] = {}
+
+
+def _encoding(model: Optional[str]):
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model or "")
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as error:
+            # tiktoken downloads its encodings on first use, offline hosts fall back to the estimate
+            logger.warning(f"No tiktoken encoding for {model} ({error}), estimating tokens from length")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(model: Optional[str], text: str) -> int:
+    encoding = _encoding(model) if tiktoken is not None else None
+    if encoding is None:
+        # About 4 characters per token for Spanish and English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_request_tokens(
+    model: Optional[str], system_prompt: str, content: str, response_format: Type[BaseModel]
+) -> int:
+    """Tokens a structured completion will take from the quota: messages, schema and expected output."""
+    schema = json.dumps(response_format.model_json_schema(), ensure_ascii=False)
+    # Per message framing, as in OpenAI's token counting guide
+    overhead = 2 * 4 + 3
+    return (
+        count_tokens(model, system_prompt)
+        + count_tokens(model, content)
+        + count_tokens(model, schema)
+        + overhead
+        + EXPECTED_OUTPUT_TOKENS
+    )
+
+
+class LLMBudget:
+    """Requests and tokens per minute budget for the OpenAI API, shared by every call of the process.
+
+    Both budgets refill continuously at the account limits and are corrected with the
+    x-ratelimit-* headers of every response, which also count what other processes using the
+    same key spent. Calls wait until the budget covers their estimated tokens, so the number of
+    calls in flight follows the quota instead of a fixed batch size.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = TOKENS_PER_MINUTE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        headroom: float = HEADROOM,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.headroom = headroom
+        self.requests = 0
+        self.throttled = 0
+        self.estimated_tokens = 0
+        self.used_tokens = 0
+        self.peak_in_flight = 0
+        # Until a response tells us the real quota, send one call at a time
+        self._limits_known = False
+        self._request_budget = max(self._request_capacity / 10, 1.0)
+        self._token_budget = self._token_capacity / 10
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._in_flight_tokens = 0
+        self._condition = asyncio.Condition()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def _request_capacity(self) -> float:
+        return self.requests_per_minute * self.headroom
+
+    @property
+    def _token_capacity(self) -> float:
+        return self.tokens_per_minute * self.headroom
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_budget = min(
+            self._request_budget + elapsed * self.requests_per_minute / 60, self._request_capacity
+        )
+        self._token_budget = min(self._token_budget + elapsed * self.tokens_per_minute / 60, self._token_capacity)
+
+    async def acquire(self, tokens: int) -> int:
+        """Waits for a slot and `tokens` of budget, returns the tokens reserved, to be given to release()."""
+        # A request bigger than the whole budget still has to go out eventually
+        tokens = min(tokens, int(self._token_capacity))
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                max_in_flight = self.max_in_flight if self._limits_known else 1
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight < max_in_flight:
+                    self._refill(now)
+                    if self._request_budget >= 1 and self._token_budget >= tokens:
+                        self._request_budget -= 1
+                        self._token_budget -= tokens
+                        self._in_flight += 1
+                        self._in_flight_tokens += tokens
+                        self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+                        return tokens
+                    wait = max(
+                        (1 - self._request_budget) * 60 / self.requests_per_minute,
+                        (tokens - self._token_budget) * 60 / self.tokens_per_minute,
+                        0.01,
+                    )
+                # Otherwise wait for a release to free a slot
+                try:
+                    await asyncio.wait_for(self._condition.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(
+        self,
+        tokens: int,
+        headers: Optional[httpx.Headers] = None,
+        used_tokens: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._in_flight_tokens -= tokens
+            self.requests += 1
+            self.estimated_tokens += tokens
+            now = time.monotonic()
+            self._refill(now)
+            if used_tokens is not None:
+                self.used_tokens += used_tokens
+                # Give back what the estimate overbooked
+                self._token_budget = min(self._token_budget + max(tokens - used_tokens, 0), self._token_capacity)
+            if headers is not None:
+                self._update_from_headers(headers)
+            if retry_after is not None:
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, now + retry_after)
+                self._request_budget = min(self._request_budget, 0.0)
+                logger.warning(f"OpenAI rate limit hit, pausing LLM calls for {retry_after:.1f}s")
+            self._condition.notify_all()
+
+    def _update_from_headers(self, headers: httpx.Headers) -> None:
+        limit_requests = _header_int(headers, "x-ratelimit-limit-requests")
+        limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens")
+        if limit_requests:
+            self.requests_per_minute = limit_requests
+        if limit_tokens:
+            self.tokens_per_minute = limit_tokens
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        reserve = 1 - self.headroom
+        # The server counted the calls it already received, ours in flight may not be among them
+        if remaining_requests is not None:
+            self._request_budget = min(
+                remaining_requests - self.requests_per_minute * reserve - self._in_flight, self._request_capacity
+            )
+        if remaining_tokens is not None:
+            self._token_budget = min(
+                remaining_tokens - self.tokens_per_minute * reserve - self._in_flight_tokens, self._token_capacity
+            )
+        # Responses without rate limit headers (proxies, stand-ins) keep the configured quota
+        self._limits_known = True
+
+    def summary(self) -> str:
+        return (
+            f"LLM budget: {self.requests} requests, {self.throttled} throttled, peak {self.peak_in_flight} in flight, "
+            f"{self.used_tokens} tokens used ({self.estimated_tokens} estimated), "
+            f"limits {self.requests_per_minute} RPM / {self.tokens_per_minute} TPM"
+        )
+
+
+def retry_after_seconds(error: openai.APIStatusError) -> Optional[float]:
+    headers = error.response.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    resets = [parse_reset(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+async def call_with_budget(
+    budget: "LLMBudget",
+    tokens: int,
+    request: Callable[[], Awaitable[Any]],
+    max_attempts: int = 5,
+    backoff: float = 1.0,
+    max_backoff: float = 60.0,
+):
+    """Runs `request` (a with_raw_response call) inside the budget and returns the parsed response.
+
+    Transient errors are retried with full-jitter exponential backoff, the caller only sees the
+    error once `max_attempts` are used.
+    """
+    for attempt in range(1, max_attempts + 1):
+        reserved = await budget.acquire(tokens)
+        # Whatever happens the slot is given back exactly once, with the tokens actually reserved
+        release: Dict[str, Any] = {}
+        try:
+            raw_response = await request()
+            response = raw_response.parse()
+            usage = getattr(response, "usage", None)
+            release = {"headers": raw_response.headers, "used_tokens": usage.total_tokens if usage else None}
+            return response
+        except RETRYABLE_ERRORS as error:
+            retry_after = None
+            if isinstance(error, openai.RateLimitError):
+                retry_after = retry_after_seconds(error) or backoff
+            release = {"headers": getattr(getattr(error, "response", None), "headers", None), "retry_after": retry_after}
+            if attempt == max_attempts:
+                raise
+            delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+            failure = type(error).__name__
+        finally:
+            await budget.release(reserved, **release)
+        logger.warning(f"LLM call failed ({failure}), retry {attempt} in {delay:.1f}s")
+        await asyncio.sleep(max(delay, retry_after or 0.0))
+
+
+_budget: Optional[LLMBudget] = None
+
+
+def get_llm_budget() -> LLMBudget:
+    """Budget shared by every LLM call in this process's event loop."""
+    global _budget
+    loop = asyncio.get_running_loop()
+    # asyncio primitives are bound to a loop, each asyncio.run gets a fresh budget
+    if _budget is None or _budget.loop is not loop:
+        _budget = LLMBudget()
+        _budget.loop = loop
+    return _budget
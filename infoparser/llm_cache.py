@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import Optional, Type
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_COLLECTION_NAME = "llm_cache"
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200000"))
+# Check the cache size every this many writes
+EVICTION_CHECK_EVERY = 500
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def schema_version(response_format: Type[BaseModel]) -> str:
+    """Changes whenever a field, type or description of the response format changes."""
+    schema = json.dumps(response_format.model_json_schema(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:16]
+
+
+class ExtractionCache:
+    """Structured LLM extractions stored in Mongo, keyed by content, prompt, model and schema.
+
+    Entries are evicted least recently used first once the collection grows past `max_entries`.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, max_entries: int = CACHE_MAX_ENTRIES):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    @staticmethod
+    def key(text: str, prompt: str, model: str, response_format: Type[BaseModel]) -> str:
+        parts = [normalize_text(text), prompt, model or "", schema_version(response_format)]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = await self.collection.find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_used_at": datetime.now(timezone.utc)}, "$inc": {"hits": 1}},
+            projection={"value": 1},
+        )
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["value"]
+
+    async def set(self, key: str, value: dict, model: str, response_format: Type[BaseModel]) -> None:
+        current_time = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {"value": value, "last_used_at": current_time},
+                "$setOnInsert": {
+                    "model": model,
+                    "schema": response_format.__name__,
+                    "created_at": current_time,
+                    "hits": 0,
+                },
+            },
+            upsert=True,
+        )
+        self._writes += 1
+        if self._writes % EVICTION_CHECK_EVERY == 0:
+            await self.evict()
+
+    async def evict(self) -> int:
+        """Deletes the least recently used entries above `max_entries`, plus a 10% margin."""
+        size = await self.collection.estimated_document_count()
+        if size <= self.max_entries:
+            return 0
+        excess = size - int(self.max_entries * 0.9)
+        cursor = self.collection.find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess)
+        ids = [entry["_id"] async for entry in cursor]
+        result = await self.collection.delete_many({"_id": {"$in": ids}})
+        logger.info(f"Evicted {result.deleted_count} LLM cache entries")
+        return result.deleted_count
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
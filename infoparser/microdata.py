@@ -0,0 +1,132 @@
+import re
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+
+from .schemas import normalize_source
+
+# Provenance of each SimpleAuto field stored with the car
+SOURCE_RULES = "rules"
+SOURCE_LLM = "llm"
+
+
+def _itemprop_value(tag) -> Optional[str]:
+    # Nested items (e.g. brand as a schema.org Brand) expose their value in a `name` property
+    if tag.has_attr("itemscope"):
+        name = tag.find(attrs={"itemprop": "name"})
+        return _itemprop_value(name) if name else None
+    for attribute in ("content", "datetime", "href"):
+        if tag.has_attr(attribute):
+            return tag[attribute].strip()
+    text = tag.get_text(" ", strip=True)
+    return text or None
+
+
+def read_microdata(html: str) -> Dict[str, str]:
+    """First value of every itemprop in the article, nested scopes are flattened."""
+    soup = BeautifulSoup(html, "html.parser")
+    values: Dict[str, str] = {}
+    for tag in soup.find_all(attrs={"itemprop": True}):
+        value = _itemprop_value(tag)
+        if not value:
+            continue
+        for prop in tag["itemprop"].split():
+            values.setdefault(prop, value)
+    return values
+
+
+def to_float(value: str) -> Optional[float]:
+    number = re.sub(r"[^\d.,]", "", value)
+    if not number:
+        return None
+    # 1.234.567,50 (es-AR) or 1,234,567.50 / 1234567.50
+    if "," in number and ("." not in number or number.rindex(",") > number.rindex(".")):
+        number = number.replace(".", "").replace(",", ".")
+    else:
+        number = number.replace(",", "")
+    if number.count(".") > 1:
+        number = number.replace(".", "")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def to_int(value: str) -> Optional[int]:
+    digits = re.sub(r"\D", "", value.split(",")[0])
+    return int(digits) if digits else None
+
+
+def to_year(value: str) -> Optional[str]:
+    match = re.search(r"(19|20)\d{2}", value)
+    return match.group(0) if match else None
+
+
+def to_currency(value: str) -> Optional[str]:
+    value = value.strip().upper()
+    if value in ("ARS", "USD"):
+        return value
+    if "U$S" in value or "US$" in value or "USD" in value:
+        return "USD"
+    if "$" in value:
+        return "ARS"
+    return None
+
+
+def to_text(value: str) -> Optional[str]:
+    value = re.sub(r"\s+", " ", value).strip()
+    return value or None
+
+
+class MicrodataRules:
+    """Fills SimpleAuto fields from the schema.org Car/Offer microdata of an article.
+
+    Only values that parse cleanly are returned, everything else is left to the LLM.
+    """
+
+    # SimpleAuto field -> (itemprops to try in order, converter)
+    FIELDS: Dict[str, Tuple[Tuple[str, ...], Callable[[str], Any]]] = {
+        "precio": (("price",), to_float),
+        "moneda": (("priceCurrency",), to_currency),
+        "marca": (("brand", "manufacturer"), to_text),
+        "modelo": (("model",), to_text),
+        "year": (("vehicleModelDate", "modelDate", "productionDate", "dateVehicleFirstRegistered"), to_year),
+        "color": (("color",), to_text),
+        "tipo_de_combustible": (("fuelType",), to_text),
+        "puertas": (("numberOfDoors",), to_text),
+        "transmision": (("vehicleTransmission",), to_text),
+        "motor": (("engineDisplacement", "vehicleEngine"), to_text),
+        "tipo_de_carroceria": (("bodyType",), to_text),
+        "kilometros": (("mileageFromOdometer",), to_int),
+    }
+
+    def extract(self, html: str, url: Optional[str] = None) -> Dict[str, Any]:
+        microdata = read_microdata(html)
+        fields: Dict[str, Any] = {}
+        for field, (props, convert) in self.FIELDS.items():
+            for prop in props:
+                if prop in microdata:
+                    value = convert(microdata[prop])
+                    if value is not None:
+                        fields[field] = value
+                        break
+        url = url or microdata.get("url")
+        if url:
+            fields.update(self.listing_fields(url))
+        return fields
+
+    def listing_fields(self, url: str) -> Dict[str, Any]:
+        """url, source and external_id, read from the listing URL."""
+        parts = urlsplit(url)
+        if not parts.netloc:
+            return {}
+        fields = {"url": url, "source": normalize_source(parts.netloc)}
+        external_id = parts.path.rstrip("/").rsplit("/", 1)[-1]
+        if external_id:
+            fields["external_id"] = external_id
+        return fields
+
+
+def extract_rule_fields(html: str, url: Optional[str] = None) -> Dict[str, Any]:
+    return MicrodataRules().extract(html, url)
@@ -1,9 +1,17 @@
 import asyncio
-from typing import List, Optional
-from openai import AsyncOpenAI
+import json
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Type
+from openai import AsyncOpenAI, RateLimitError
+from pydantic import BaseModel, ValidationError, create_model
 
 from logger import setup_logger
-from .schemas import SimpleAuto, DolarValues
+from .compact import compact_article
+from .llm_budget import call_with_budget, count_tokens, estimate_request_tokens, get_llm_budget
+from .ingest import CarIngestSink
+from .llm_cache import CACHE_COLLECTION_NAME, ExtractionCache
+from .microdata import SOURCE_LLM, SOURCE_RULES, extract_rule_fields
+from .schemas import AutoRawDB, SimpleAuto, DolarValues
 from infoparser.crud_auto import init_db
 from dotenv import load_dotenv
 import os
@@ -14,85 +22,213 @@ logger = setup_logger(__name__)
 
 MODEL = os.getenv("PARSER_MODEL")
 TEMPERATURE = os.getenv("TEMPERATURE_CONVERTIDOR_PROMPT")
+COMPACT_INPUT = os.getenv("PARSER_COMPACT_INPUT", "1") == "1"
 logger.info(f"Using LLM model: {MODEL}")
 
 
+async def get_extraction_cache() -> ExtractionCache:
+    autos_crud = await init_db()
+    return ExtractionCache(autos_crud.db[CACHE_COLLECTION_NAME])
+
+
+async def parse_with_llm(
+    system_prompt: str,
+    content: str,
+    response_format: Type[BaseModel],
+    cache: Optional[ExtractionCache] = None,
+) -> Optional[BaseModel]:
+    """Structured extraction of `content`, served from `cache` when the same request was already made."""
+    if cache is not None:
+        key = cache.key(content, system_prompt, MODEL, response_format)
+        cached = await cache.get(key)
+        if cached is not None:
+            return response_format.model_validate(cached)
+
+    # Retries are done by call_with_budget, for the failed call only
+    client = AsyncOpenAI(max_retries=0)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+    completion = await call_with_budget(
+        get_llm_budget(),
+        estimate_request_tokens(MODEL, system_prompt, content, response_format),
+        lambda: client.beta.chat.completions.with_raw_response.parse(
+            model=MODEL,
+            messages=messages,
+            response_format=response_format,
+            temperature=float(TEMPERATURE),
+        ),
+    )
+
+    # Extract the response from the completion object
+    parsed = completion.choices[0].message.parsed
+    if cache is not None and parsed is not None:
+        await cache.set(key, parsed.model_dump(mode="json"), MODEL, response_format)
+    return parsed
+
+
 class DolarParserAgent:
-    def __init__(self, base_prompt="Extrae los diferentes valores del dolar en el siguiente texto, cada uno debe ser un decimal."):
+    def __init__(
+        self,
+        base_prompt="Extrae los diferentes valores del dolar en el siguiente texto, cada uno debe ser un decimal.",
+        use_cache: bool = True,
+    ):
         self.base_prompt = base_prompt
+        self.use_cache = use_cache
 
     async def _extract_dolar_info(self, dolar_info: str) -> DolarValues:
-        final_prompt = self.base_prompt
+        cache = await get_extraction_cache() if self.use_cache else None
+        return await parse_with_llm(self.base_prompt, dolar_info, DolarValues, cache)
 
-        client = AsyncOpenAI()
 
-        completion = await client.beta.chat.completions.parse(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": final_prompt},
-                {"role": "user", "content": dolar_info},
-            ],
-            response_format=DolarValues,
-            temperature=float(TEMPERATURE),
-        )
-
-        return completion.choices[0].message.parsed
+@lru_cache(maxsize=None)
+def missing_fields_model(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """SimpleAuto restricted to `fields`, the response format when rules already filled the rest."""
+    return create_model(
+        "SimpleAuto",
+        __doc__=SimpleAuto.__doc__,
+        **{name: (SimpleAuto.model_fields[name].annotation, SimpleAuto.model_fields[name]) for name in fields},
+    )
 
 
 class CarParserAgent:
     # Initialize OpenAI model
     def __init__(
         self,
-        base_prompt="Extraé la información del auto en el siguiente texto. Si en other info el vendedor se refiere a financiamiento SOLO en cuotas, marca la flag ignore en True."
+        base_prompt="Extraé la información del auto en el siguiente texto. Si en other info el vendedor se refiere a financiamiento SOLO en cuotas, marca la flag ignore en True.",
+        use_cache: bool = True,
+        compact_input: bool = COMPACT_INPUT,
     ) -> None:
         self.base_prompt = base_prompt
+        # Extractions are cached by article content, prompt, model and schema
+        self.use_cache = use_cache
+        self.cache: Optional[ExtractionCache] = None
+        # The LLM gets the article as compact text instead of HTML
+        self.compact_input = compact_input
+        self.html_tokens = 0
+        self.input_tokens = 0
+        # When set, parsed cars are written in batches instead of one insert per car
+        self.sink: Optional[CarIngestSink] = None
+
+    async def _get_cache(self) -> Optional[ExtractionCache]:
+        if self.use_cache and self.cache is None:
+            self.cache = await get_extraction_cache()
+        return self.cache
+
+    def llm_input(self, car_info: str) -> str:
+        """What the LLM reads of an article, token counts before and after are added to the agent totals."""
+        content = compact_article(car_info) if self.compact_input else car_info
+        html_tokens = count_tokens(MODEL, car_info)
+        input_tokens = count_tokens(MODEL, content) if self.compact_input else html_tokens
+        self.html_tokens += html_tokens
+        self.input_tokens += input_tokens
+        logger.debug(f"Article input: {html_tokens} HTML tokens -> {input_tokens} tokens")
+        return content
+
+    def input_summary(self) -> str:
+        saved = 1 - self.input_tokens / self.html_tokens if self.html_tokens else 0.0
+        return f"Article input: {self.html_tokens} HTML tokens -> {self.input_tokens} tokens ({saved:.0%} saved)"
 
     async def _extract_car_info(self, car_info: str) -> SimpleAuto:
-        final_prompt = self.base_prompt
-
-        # Use the async OpenAI client to make a non-blocking request
-        client = AsyncOpenAI()
-
-        # Assuming that 'parse' is also an async function in the async OpenAI client
-        completion = await client.beta.chat.completions.parse(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": final_prompt},
-                {"role": "user", "content": car_info},
-            ],
-            response_format=SimpleAuto,
-            temperature=float(TEMPERATURE),
-        )
-
-        # Extract the response from the completion object
-        event = completion.choices[0].message.parsed
-
-        return event
-
-    async def _save_extracted_car_info(self, car_info: SimpleAuto, raw_car_id: str) -> SimpleAuto:
+        return await parse_with_llm(self.base_prompt, self.llm_input(car_info), SimpleAuto, await self._get_cache())
+
+    def missing_fields_prompt(self, known: dict) -> str:
+        # The fields we already know go in the prompt, they help with flags like ignore
+        return self.base_prompt + "\nDatos ya extraídos del anuncio: " + json.dumps(known, ensure_ascii=False)
+
+    def prepare_extraction(
+        self, car_info: str, url: Optional[str] = None
+    ) -> Tuple[dict, Tuple[str, ...], str]:
+        """Fields the source microdata gives deterministically, the fields left for the LLM and its prompt."""
+        fields = extract_rule_fields(car_info, url)
+        missing = tuple(name for name in SimpleAuto.model_fields if name not in fields)
+        return fields, missing, self.missing_fields_prompt(fields)
+
+    @staticmethod
+    def merge_fields(
+        fields: dict, missing: Tuple[str, ...], llm_fields: Optional[dict]
+    ) -> Tuple[SimpleAuto, Dict[str, str]]:
+        """Builds the car from rule and LLM fields, raises ValidationError if they don't make a SimpleAuto."""
+        field_sources = {name: SOURCE_RULES for name in fields}
+        fields = {**fields, **(llm_fields or {})}
+        field_sources.update({name: SOURCE_LLM for name in missing})
+        return SimpleAuto.model_validate(fields), field_sources
+
+    async def _extract_car_fields(
+        self, car_info: str, url: Optional[str] = None
+    ) -> Tuple[Optional[SimpleAuto], Dict[str, str]]:
+        """Fills what the source microdata gives deterministically and asks the LLM only for the rest.
+
+        Returns the car and the provenance of each field ("rules" or "llm").
+        """
+        fields, missing, prompt = self.prepare_extraction(car_info, url)
+        llm_fields = None
+        if missing:
+            parsed = await parse_with_llm(
+                prompt, self.llm_input(car_info), missing_fields_model(missing), await self._get_cache()
+            )
+            if parsed is None:
+                return None, {}
+            llm_fields = parsed.model_dump()
+        try:
+            return self.merge_fields(fields, missing, llm_fields)
+        except ValidationError as error:
+            logger.warning(f"Rule extraction gave an invalid car ({error}), falling back to the LLM")
+            car = await self._extract_car_info(car_info)
+            return car, {name: SOURCE_LLM for name in SimpleAuto.model_fields}
+
+    async def _save_extracted_car_info(
+        self, car_info: SimpleAuto, raw_car_id: str, field_sources: Optional[Dict[str, str]] = None
+    ) -> SimpleAuto:
+        if self.sink is not None:
+            await self.sink.add(car_info, raw_car_id, field_sources)
+            return car_info
         autos_crud = await init_db()
-        return await autos_crud.insert_car(car_info, raw_car_id)
+        return await autos_crud.insert_car(car_info, raw_car_id, field_sources)
 
-    async def parse_car_info(self, car_info: str, raw_car_id: str) -> Optional[SimpleAuto]:
-        car = await self._extract_car_info(car_info)
+    async def parse_car_info(self, car_info: str, raw_car_id: str, url: Optional[str] = None) -> Optional[SimpleAuto]:
+        car, field_sources = await self._extract_car_fields(car_info, url)
         if car is None:
             return None
-        return await self._save_extracted_car_info(car, raw_car_id)
+        return await self._save_extracted_car_info(car, raw_car_id, field_sources)
+
+    async def _parse_claimed_car(
+        self, autos_crud, car_info_raw: AutoRawDB, worker_id: str, max_attempts: int
+    ) -> Optional[SimpleAuto]:
+        try:
+            car = await self.parse_car_info(car_info_raw.text, car_info_raw.id, car_info_raw.url)
+        except RateLimitError as error:
+            await autos_crud.release_raw_car(car_info_raw.id, worker_id, str(error), max_attempts, count_attempt=False)
+            raise
+        except Exception as error:
+            logger.exception(f"Failed to parse raw car {car_info_raw.id}")
+            await autos_crud.release_raw_car(car_info_raw.id, worker_id, repr(error), max_attempts)
+            return None
+        if car is None:
+            await autos_crud.release_raw_car(car_info_raw.id, worker_id, "No structured output", max_attempts)
+        return car
+
+    async def parse_car_infos(
+        self, worker_id: str, limit: int = 10, lease_seconds: float = 600, max_attempts: int = 3
+    ) -> Optional[List[SimpleAuto]]:
+        """Claims up to `limit` raw cars and parses them. Returns None when the queue is empty.
 
-    async def parse_car_infos(self, offset=0, limit=10) -> List[SimpleAuto]:
+        Claims are leased, so any number of workers can run at once without parsing a car twice.
+        """
         autos_crud = await init_db()
-        car_infos = await autos_crud.get_raw_cars_not_extracted(offset, limit)
+        car_infos = await autos_crud.claim_raw_cars(worker_id, limit, lease_seconds, max_attempts)
 
         if len(car_infos) == 0:
             logger.info("No cars to parse")
-            return []
-        
-        simples_autos = []
-        tasks = []
-        for car_info_raw in car_infos:
-            tasks.append(self.parse_car_info(car_info_raw.text, car_info_raw.id))
-        
-        simples_autos = await asyncio.gather(*tasks)
+            return None
+
+        simples_autos = await asyncio.gather(
+            *(self._parse_claimed_car(autos_crud, car_info_raw, worker_id, max_attempts) for car_info_raw in car_infos),
+            return_exceptions=True,
+        )
+        for result in simples_autos:
+            if isinstance(result, BaseException):
+                raise result
 
         return [car for car in simples_autos if car is not None]
- 
\ No newline at end of file
@@ -0,0 +1,270 @@
+import math
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import product
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne, errors
+
+from logger import setup_logger
+from .facets import METADATA_COLLECTION, facet_catalog
+
+logger = setup_logger(__name__)
+
+PRICE_STATS_COLLECTION = "price_stats"
+CURRENCIES = ("ARS", "USD")
+# Cells are kept for each prefix of these fields, "*" stands for any value of the rest
+LEVELS = (("marca",), ("marca", "modelo"), ("marca", "modelo", "year"), ("marca", "modelo", "year", "version"))
+KEY_FIELDS = LEVELS[-1]
+ANY = "*"
+# Stored car fields the cells need besides KEY_FIELDS
+PRICE_FIELDS = ["precio", "moneda", "ignore", "url"]
+# Histogram buckets grow 2% each, quantiles are within about 1% of the exact value
+BUCKET_GROWTH = 1.02
+# Price questions with more combinations of spellings than this go to the aggregation instead
+MAX_CELLS = 200
+# autos_metadata document holding when the next periodic rebuild is due
+REBUILD_LEASE_ID = "price_stats_rebuild"
+
+
+def normalize_key(value: Any) -> str:
+    return str(value if value is not None else "").strip().lower()
+
+
+def cell_id(values: Sequence[Any]) -> str:
+    """Cell of the normalized (marca, modelo, year, version) prefix `values`."""
+    parts = [normalize_key(value) for value in values]
+    return "|".join(parts + [ANY] * (len(KEY_FIELDS) - len(parts)))
+
+
+def bucket(price: float) -> int:
+    return math.floor(math.log(price) / math.log(BUCKET_GROWTH))
+
+
+def bucket_value(index: int) -> float:
+    # Geometric middle of the bucket
+    return BUCKET_GROWTH ** (index + 0.5)
+
+
+def _counted(car: Optional[dict]) -> bool:
+    """Cars that take part in the price statistics, the same ones the agent's price range looks at."""
+    return (
+        car is not None
+        and not car.get("ignore")
+        and car.get("moneda") in CURRENCIES
+        and isinstance(car.get("precio"), (int, float))
+        and car["precio"] > 0
+    )
+
+
+def _cell_updates(car: dict, sign: int, current_time: datetime) -> List[UpdateOne]:
+    currency, price = car["moneda"], float(car["precio"])
+    prefix = f"currencies.{currency}"
+    extreme = {"value": price, "id": str(car["_id"]), "url": car.get("url")}
+    updates = []
+    for level in LEVELS:
+        update: Dict[str, Any] = {
+            "$inc": {f"{prefix}.count": sign, f"{prefix}.sum": sign * price, f"{prefix}.hist.{bucket(price)}": sign},
+            "$set": {"updated_at": current_time},
+            "$setOnInsert": {field: normalize_key(car.get(field)) for field in level},
+        }
+        # Min/max can't be undone incrementally, they only get exact again with a rebuild
+        if sign > 0:
+            update["$min"] = {f"{prefix}.min": extreme}
+            update["$max"] = {f"{prefix}.max": extreme}
+        # A removal never creates a cell, it would be left with a negative count
+        updates.append(UpdateOne({"_id": cell_id([car.get(field) for field in level])}, update, upsert=sign > 0))
+    return updates
+
+
+def price_stats_updates(previous: Optional[dict], car: Optional[dict]) -> List[UpdateOne]:
+    """Cell changes when a stored car goes from `previous` to `car` (None for an insert or a delete)."""
+    old = previous if _counted(previous) else None
+    new = car if _counted(car) else None
+    if old is not None and new is not None and all(
+        old.get(field) == new.get(field) for field in KEY_FIELDS + ("precio", "moneda")
+    ):
+        return []
+    current_time = datetime.now(timezone.utc)
+    updates = []
+    if old is not None:
+        updates += _cell_updates(old, -1, current_time)
+    if new is not None:
+        updates += _cell_updates(new, 1, current_time)
+    return updates
+
+
+async def apply_price_stats_updates(db: AsyncIOMotorDatabase, updates: List[UpdateOne]) -> None:
+    if updates:
+        await db[PRICE_STATS_COLLECTION].bulk_write(updates, ordered=False)
+
+
+def _level_pipeline(level: Tuple[str, ...], into: str) -> List[dict]:
+    key_parts = []
+    for field in KEY_FIELDS:
+        if field in level:
+            key_parts.append({"$toLower": {"$trim": {"input": {"$toString": {"$ifNull": [f"${field}", ""]}}}}})
+        else:
+            key_parts.append(ANY)
+    separated = [part for key_part in key_parts for part in (key_part, "|")][:-1]
+    extreme = {"value": "$precio", "id": {"$toString": "$_id"}, "url": "$url"}
+    return [
+        {"$match": {"ignore": {"$ne": True}, "moneda": {"$in": list(CURRENCIES)}, "precio": {"$gt": 0}}},
+        {"$project": {
+            "cell": {"$concat": separated},
+            "moneda": 1,
+            "precio": 1,
+            "url": 1,
+            "bucket": {"$floor": {"$divide": [{"$ln": "$precio"}, math.log(BUCKET_GROWTH)]}},
+            **{field: {"$toLower": {"$trim": {"input": {"$toString": {"$ifNull": [f"${field}", ""]}}}}} for field in level},
+        }},
+        # Count per histogram bucket, then fold the buckets into one document per cell and currency
+        {"$group": {
+            "_id": {"cell": "$cell", "moneda": "$moneda", "bucket": "$bucket"},
+            "count": {"$sum": 1},
+            "sum": {"$sum": "$precio"},
+            "min": {"$min": extreme},
+            "max": {"$max": extreme},
+            **{field: {"$first": f"${field}"} for field in level},
+        }},
+        {"$group": {
+            "_id": {"cell": "$_id.cell", "moneda": "$_id.moneda"},
+            "count": {"$sum": "$count"},
+            "sum": {"$sum": "$sum"},
+            "min": {"$min": "$min"},
+            "max": {"$max": "$max"},
+            "hist": {"$push": {"k": {"$toString": {"$toInt": "$_id.bucket"}}, "v": "$count"}},
+            **{field: {"$first": f"${field}"} for field in level},
+        }},
+        {"$group": {
+            "_id": "$_id.cell",
+            "currencies": {"$push": {"k": "$_id.moneda", "v": {
+                "count": "$count", "sum": "$sum", "min": "$min", "max": "$max", "hist": {"$arrayToObject": "$hist"},
+            }}},
+            **{field: {"$first": f"${field}"} for field in level},
+        }},
+        {"$set": {"currencies": {"$arrayToObject": "$currencies"}, "updated_at": "$$NOW"}},
+        {"$merge": {"into": into, "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+async def rebuild_price_stats(db: AsyncIOMotorDatabase, cars_collection: str = "autos") -> int:
+    """Recomputes every cell from the cars and swaps the collection, returns the number of cells.
+
+    Fixes the min/max left behind by updated or removed listings, run it periodically. Cars written
+    while it runs may be missing from the new cells until the next rebuild.
+    """
+    staging = f"{PRICE_STATS_COLLECTION}_rebuild_{uuid.uuid4().hex[:8]}"
+    try:
+        for level in LEVELS:
+            await db[cars_collection].aggregate(_level_pipeline(level, staging), allowDiskUse=True).to_list(length=None)
+        if staging not in await db.list_collection_names(filter={"name": staging}):
+            await db.create_collection(staging)
+        await db[staging].rename(PRICE_STATS_COLLECTION, dropTarget=True)
+    finally:
+        await db.drop_collection(staging)
+    size = await db[PRICE_STATS_COLLECTION].estimated_document_count()
+    logger.info(f"Rebuilt the price statistics: {size} cells")
+    return size
+
+
+async def claim_rebuild(db: AsyncIOMotorDatabase, interval_seconds: float) -> bool:
+    """True for the one process that gets to run the rebuild that is due, the first time or every
+    `interval_seconds` after the last one started.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db[METADATA_COLLECTION].find_one_and_update(
+            {"_id": REBUILD_LEASE_ID, "next_rebuild_at": {"$lte": now}},
+            {"$set": {"next_rebuild_at": now + timedelta(seconds=interval_seconds), "claimed_at": now}},
+            upsert=True,
+        )
+    except errors.DuplicateKeyError:
+        # The document exists but the rebuild isn't due, or another process just claimed it
+        return False
+    return True
+
+
+def _quantile(weighted: List[Tuple[float, int]], q: float) -> float:
+    target = q * (sum(count for _, count in weighted) - 1)
+    seen = 0
+    for value, count in weighted:
+        seen += count
+        if seen > target:
+            return value
+    return weighted[-1][0]
+
+
+def summarize_cells(cells: Iterable[dict], usd_rate: float, percentiles: Sequence[float]) -> Optional[dict]:
+    """Merges cells into the price statistics of their cars, in ARS with USD converted at `usd_rate`.
+
+    Same shape as AutoDataBaseCRUD.get_price_stats: count, mean, min/max car, median and percentiles.
+    """
+    rates = {"ARS": 1.0, "USD": usd_rate}
+    count, total, extremes, weighted = 0, 0.0, {"min": [], "max": []}, {}
+    for cell in cells:
+        for currency, stats in cell.get("currencies", {}).items():
+            if currency not in rates or stats.get("count", 0) <= 0:
+                continue
+            rate = rates[currency]
+            count += stats["count"]
+            total += stats["sum"] * rate
+            for name in ("min", "max"):
+                if stats.get(name):
+                    car = stats[name]
+                    extremes[name].append({
+                        "value": car["value"] * rate, "precio": car["value"], "moneda": currency,
+                        "id": car["id"], "url": car["url"],
+                    })
+            for index, bucket_count in stats.get("hist", {}).items():
+                if bucket_count > 0:
+                    value = bucket_value(int(index)) * rate
+                    weighted[value] = weighted.get(value, 0) + bucket_count
+    if count <= 0 or not extremes["min"]:
+        return None
+    weighted_values = sorted(weighted.items())
+    return {
+        "count": count,
+        "mean": total / count,
+        "min": min(extremes["min"], key=lambda car: car["value"]),
+        "max": max(extremes["max"], key=lambda car: car["value"]),
+        "median": _quantile(weighted_values, 0.5),
+        "percentiles": {p: _quantile(weighted_values, p) for p in percentiles},
+    }
+
+
+async def get_price_cells(db: AsyncIOMotorDatabase, attributes: Dict[str, List[Any]]) -> List[dict]:
+    """Cells with cars matching `attributes` (field -> accepted values), in one lookup by _id.
+
+    Values match case and whitespace insensitively. Raises LookupError when the question doesn't fit
+    the cube (fields other than a prefix of marca/modelo/year/version, or too many combinations),
+    the caller then aggregates over autos instead.
+    """
+    fields = [field for field, values in attributes.items() if values]
+    level = KEY_FIELDS[: len(fields)]
+    if not fields or set(fields) != set(level):
+        raise LookupError(f"No price cells for {fields}")
+    values = [sorted({normalize_key(value) for value in attributes[field]}) for field in level]
+    combinations = math.prod(len(field_values) for field_values in values)
+    if combinations > MAX_CELLS:
+        raise LookupError(f"{combinations} price cells is too many")
+    ids = [cell_id(combination) for combination in product(*values)]
+    query = {"_id": {"$in": ids}, "$or": [{f"currencies.{currency}.count": {"$gt": 0}} for currency in CURRENCIES]}
+    return await db[PRICE_STATS_COLLECTION].find(query).to_list(length=None)
+
+
+async def expand_spellings(db: AsyncIOMotorDatabase, attributes: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+    """Adds to each marca/modelo/year/version value every stored spelling the cells would merge
+    with it (same normalize_key), so filters over autos match the same cars as the cube.
+    """
+    fields = [field for field in KEY_FIELDS if attributes.get(field)]
+    if not fields:
+        return attributes
+    catalog = await facet_catalog.get_values(db, fields)
+    expanded = dict(attributes)
+    for field in fields:
+        wanted = {normalize_key(value) for value in attributes[field]}
+        spellings = [value for value in catalog[field] if normalize_key(value) in wanted]
+        expanded[field] = list(attributes[field]) + [value for value in spellings if value not in attributes[field]]
+    return expanded
@@ -0,0 +1,30 @@
+import hashlib
+import zlib
+from typing import Union
+
+from bson import Binary
+
+# Compression of the raw article HTML stored in autos_raw
+RAW_ENCODING = "zlib"
+COMPRESSION_LEVEL = 9
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress_text(text: str) -> dict:
+    """Fields stored in autos_raw in place of the plain `text`."""
+    original = text.encode("utf-8")
+    compressed = zlib.compress(original, COMPRESSION_LEVEL)
+    return {
+        "text_z": Binary(compressed),
+        "encoding": RAW_ENCODING,
+        "content_hash": hashlib.sha256(original).hexdigest(),
+        "size_original": len(original),
+        "size_compressed": len(compressed),
+    }
+
+
+def decompress_text(text_z: Union[bytes, Binary]) -> str:
+    return zlib.decompress(bytes(text_z)).decode("utf-8")
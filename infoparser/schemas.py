@@ -1,16 +1,45 @@
 from datetime import datetime
 from decimal import Decimal
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from .raw_storage import decompress_text
+
+
+# Sites also written by name, mapped to the host stored in `source`
+SOURCE_ALIASES = {"autocosmos": "autocosmos.com.ar"}
+
+
+def normalize_source(value: str) -> str:
+    """Listing site as stored in `source`, part of the unique key of a car: lowercase host without
+    scheme, www. or path, e.g. "https://www.Autocosmos.com.ar/auto" -> "autocosmos.com.ar".
+    """
+    value = value.strip().lower()
+    host = urlsplit(value if "//" in value else f"//{value}").netloc or value
+    host = host.removeprefix("www.")
+    return SOURCE_ALIASES.get(host, host)
 
 
 class AutoRaw(BaseModel):
     text: str = Field(title="Texto del anuncio")
+    url: Optional[str] = Field(title="URL normalizada del anuncio", default=None)
     extracted: bool = Field(title="Si ya fue extraído o no", default=False)
 
+    @model_validator(mode="before")
+    @classmethod
+    def decompress(cls, data: Any) -> Any:
+        # Documents stored compressed only have text_z, older ones have the plain text
+        if isinstance(data, dict) and "text" not in data and "text_z" in data:
+            data = {**data, "text": decompress_text(data["text_z"])}
+        return data
+
 
 class AutoRawDB(AutoRaw):
     id: str = Field(title="ID de la base de datos", alias="_id")
+    content_hash: Optional[str] = Field(title="SHA-256 del texto del anuncio", default=None)
+    size_original: Optional[int] = Field(title="Tamaño del texto en bytes", default=None)
+    size_compressed: Optional[int] = Field(title="Tamaño comprimido en bytes", default=None)
     extracted_car_id: Optional[str] = Field(title="ID del auto extraído", alias="extracted_car_id", default=None)
     created_at: datetime = Field(
         title="Fecha de creación",
@@ -70,9 +99,19 @@ class SimpleAuto(BaseModel):
         description="Si se debe ignorar el auto en el caso de que el vendedor solo financie el auto en cuotas.",
     )
 
+    @field_validator("source")
+    @classmethod
+    def _normalize_source(cls, value: str) -> str:
+        return normalize_source(value)
+
 
 class SimpleAutoDB(SimpleAuto):
     id: str = Field(title="ID de la base de datos", alias="_id")
+    field_sources: Optional[Dict[str, str]] = Field(
+        title="Origen de cada campo",
+        description="'rules' si se leyó de los datos estructurados del anuncio, 'llm' si lo extrajo el modelo",
+        default=None,
+    )
     created_at: datetime = Field(
         title="Fecha de creación",
         description="Fecha en la que se creó el registro",
@@ -81,6 +120,16 @@ class SimpleAutoDB(SimpleAuto):
         title="Fecha de actualización",
         description="Fecha en la que se actualizó el registro",
     )
+    first_seen: Optional[datetime] = Field(
+        title="Primera vez visto",
+        description="Fecha en la que se extrajo el anuncio por primera vez",
+        default=None,
+    )
+    last_seen: Optional[datetime] = Field(
+        title="Última vez visto",
+        description="Fecha en la que se extrajo el anuncio por última vez, se actualiza con cada repost o re-parseo",
+        default=None,
+    )
 
 
 class DolarValues(BaseModel):
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+from typing import List
+
+import pymongo
+
+from infoparser.crud_auto import AutoDataBaseCRUD, init_db, run_with_db
+from infoparser.facets import rebuild_facets
+from infoparser.indexes import apply_indexes, check_query_plans
+from infoparser.price_stats import rebuild_price_stats
+from infoparser.schemas import normalize_source
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Duplicate groups resolved per round of bulk writes
+DEDUP_CHUNK = 500
+
+
+async def _resolve_duplicates(autos_crud: AutoDataBaseCRUD, groups: List[dict]) -> None:
+    car_updates, raw_updates, duplicate_ids = [], [], []
+    for group in groups:
+        # Sorted newest first, the latest parse of the listing is kept
+        keep, *duplicates = group["ids"]
+        car_updates.append(pymongo.UpdateOne(
+            {"_id": keep}, {"$set": {"first_seen": group["first_seen"], "last_seen": group["last_seen"]}}
+        ))
+        raw_updates.append(pymongo.UpdateMany(
+            {"extracted_car_id": {"$in": [str(car_id) for car_id in duplicates]}},
+            {"$set": {"extracted_car_id": str(keep)}},
+        ))
+        duplicate_ids.extend(duplicates)
+    await autos_crud.autos_collection.bulk_write(car_updates, ordered=False)
+    await autos_crud.autos_raw_collection.bulk_write(raw_updates, ordered=False)
+    await autos_crud.autos_collection.delete_many({"_id": {"$in": duplicate_ids}})
+
+
+async def dedup_cars(dry_run: bool) -> None:
+    """One-off migration: keeps one car per (normalized source, external_id) and adds the unique index.
+
+    The kept car is the most recently updated one, with first_seen/last_seen spanning all of its
+    copies. Raw cars pointing to a deleted copy are pointed to the kept one.
+    """
+    autos_crud = await init_db()
+    # Older cars were stored with the source as written by the LLM ("autocosmos", "www.autocosmos.com.ar"...),
+    # they are grouped and renamed by the same normalization new cars get
+    renamed = {
+        source: normalize_source(source)
+        for source in await autos_crud.autos_collection.distinct("source")
+        if isinstance(source, str) and normalize_source(source) != source
+    }
+    source_key = {"$switch": {
+        "branches": [{"case": {"$eq": ["$source", raw]}, "then": normalized} for raw, normalized in renamed.items()],
+        "default": "$source",
+    }} if renamed else "$source"
+    pipeline = [
+        {"$sort": {"updated_at": -1}},
+        {"$group": {
+            "_id": {"source": source_key, "external_id": "$external_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+            "first_seen": {"$min": {"$ifNull": ["$first_seen", "$created_at"]}},
+            "last_seen": {"$max": {"$ifNull": ["$last_seen", "$updated_at"]}},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    groups, duplicates, chunk = 0, 0, []
+    async for group in autos_crud.autos_collection.aggregate(pipeline, allowDiskUse=True):
+        groups += 1
+        duplicates += group["count"] - 1
+        if dry_run:
+            continue
+        chunk.append(group)
+        if len(chunk) >= DEDUP_CHUNK:
+            await _resolve_duplicates(autos_crud, chunk)
+            chunk = []
+    if chunk:
+        await _resolve_duplicates(autos_crud, chunk)
+
+    if dry_run:
+        logger.info(f"{duplicates} duplicate cars in {groups} listings, nothing changed (dry run)")
+        return
+    logger.info(f"Deleted {duplicates} duplicate cars of {groups} listings")
+    for raw, normalized in renamed.items():
+        result = await autos_crud.autos_collection.update_many({"source": raw}, {"$set": {"source": normalized}})
+        logger.info(f"Renamed source {raw!r} to {normalized!r} in {result.modified_count} cars")
+    # Cars stored before the upsert only have created_at/updated_at
+    result = await autos_crud.autos_collection.update_many(
+        {"first_seen": {"$exists": False}},
+        [{"$set": {"first_seen": "$created_at", "last_seen": "$updated_at"}}],
+    )
+    logger.info(f"Backfilled first_seen/last_seen of {result.modified_count} cars")
+    await autos_crud.ensure_car_indexes()
+    logger.info("Unique (source, external_id) index ready")
+    await rebuild_facets(autos_crud.db)
+    await rebuild_price_stats(autos_crud.db)
+
+
+async def manage_indexes(prune: bool, check: bool) -> bool:
+    autos_crud = await init_db()
+    applied = await apply_indexes(autos_crud.db, prune=prune)
+    logger.info(f"Indexes in place: {', '.join(applied)}")
+    if not check:
+        return True
+    ok = True
+    for name, uses_index, stages in await check_query_plans(autos_crud.db):
+        ok = ok and uses_index
+        print(f"{'OK  ' if uses_index else 'SCAN'} {name}: {' > '.join(stages)}")
+    return ok
+
+
+async def manage_facets() -> None:
+    autos_crud = await init_db()
+    await rebuild_facets(autos_crud.db)
+
+
+async def manage_price_stats() -> None:
+    autos_crud = await init_db()
+    await rebuild_price_stats(autos_crud.db)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database maintenance tasks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dedup_parser = subparsers.add_parser("dedup", help="Remove duplicate cars and enforce one per listing")
+    dedup_parser.add_argument("--dry-run", action="store_true", help="Only count the duplicates")
+
+    indexes_parser = subparsers.add_parser("indexes", help="Create the indexes of infoparser.indexes")
+    indexes_parser.add_argument("--check", action="store_true", help="Explain the hot queries, exit 1 if any scans the collection")
+    indexes_parser.add_argument("--prune", action="store_true", help="Drop indexes that are not in the spec")
+
+    subparsers.add_parser("facets", help="Rebuild the facet catalog of car attribute values from autos")
+    subparsers.add_parser("price-stats", help="Rebuild the price statistics by marca/modelo/year/version from autos")
+
+    args = parser.parse_args()
+    if args.command == "dedup":
+        run_with_db(dedup_cars(args.dry_run))
+    elif args.command == "indexes":
+        sys.exit(0 if run_with_db(manage_indexes(args.prune, args.check)) else 1)
+    elif args.command == "facets":
+        run_with_db(manage_facets())
+    elif args.command == "price-stats":
+        run_with_db(manage_price_stats())
@@ -2,28 +2,91 @@
 
 import argparse
 import asyncio
+import json
+import os
+import socket
+from pathlib import Path
+from infoparser.batch import MAX_BATCH_REQUESTS, BatchParser
+from infoparser.crud_auto import init_db, run_with_db
+from infoparser.ingest import CarIngestSink
+from infoparser.llm_budget import get_llm_budget
 from infoparser.parser_agent import CarParserAgent
 from logger import setup_logger
 import openai
 
 logger = setup_logger(__name__)
 
-async def parse_cars(offset: int, limit: int):
+async def parse_cars(
+    worker_id: str, concurrency: int, lease_seconds: float, max_attempts: int, flush_size: int, flush_interval: float
+):
+    autos_crud = await init_db()
+    await autos_crud.ensure_raw_indexes()
+    # Duplicates stored before the upserts block the unique index, it is logged until manage_db.py dedup runs
+    await autos_crud.ensure_car_indexes()
+    await autos_crud.dead_letter_expired_raw_cars(max_attempts)
     parser = CarParserAgent()
-    while True:
-        try:
-            parsed_cars = await parser.parse_car_infos(offset, limit)
-            logger.info(f"Parsed {len(parsed_cars)} cars")
-            await asyncio.sleep(3)
-            if len(parsed_cars) == 0:
-                break
-        except openai.RateLimitError:
-            await asyncio.sleep(2)
+    logger.info(f"Worker {worker_id} started")
+
+    async def parse_next():
+        # One car at a time per task, the LLM budget decides how many of them are in flight
+        while True:
+            try:
+                if await parser.parse_car_infos(worker_id, 1, lease_seconds, max_attempts) is None:
+                    return
+            except openai.RateLimitError:
+                # Out of retries, the car went back to the queue and the budget is paused
+                continue
+
+    async with CarIngestSink(autos_crud, flush_size, flush_interval) as sink:
+        parser.sink = sink
+        await asyncio.gather(*(parse_next() for _ in range(concurrency)))
+    logger.info(sink.summary())
+    logger.info(get_llm_budget().summary())
+    logger.info(parser.input_summary())
+    if parser.cache is not None:
+        logger.info(f"LLM cache: {parser.cache.stats()}")
+
+async def show_queue_stats(window_minutes: int, requeue_dead: bool, max_attempts: int):
+    autos_crud = await init_db()
+    await autos_crud.dead_letter_expired_raw_cars(max_attempts)
+    if requeue_dead:
+        requeued = await autos_crud.requeue_dead_raw_cars()
+        logger.info(f"Requeued {requeued} dead raw cars")
+    print(json.dumps(await autos_crud.get_queue_stats(window_minutes), indent=2))
+
+async def parse_cars_batch(batch_dir: Path, max_requests: int, batch_id: str, poll_interval: float):
+    parser = BatchParser(batch_dir, poll_interval=poll_interval)
+    parsed = await parser.run(max_requests, batch_id)
+    logger.info(f"Parsed {parsed} cars with the Batch API")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse raw cars data using the parser agent")
-    parser.add_argument("-o", "--offset", type=int, default=0, help="Offset for fetching raw cars")
-    parser.add_argument("-l", "--limit", type=int, default=10, help="Limit for fetching raw cars")
+    parser.add_argument("-c", "--concurrency", type=int, default=32, help="Max LLM calls in flight, the rate limit budget may run fewer (default: 32)")
+    # Paging flags from before the claim queue, kept so old invocations fail instead of meaning something else
+    parser.add_argument("-o", "--offset", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("-l", "--limit", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}", help="Worker name stored with its claims (default: host-pid)")
+    parser.add_argument("--lease", type=float, default=600, help="Seconds a claim is held before other workers can take it (default: 600)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Claims before a raw car is dead-lettered (default: 3)")
+    parser.add_argument("--flush-size", type=int, default=50, help="Parsed cars written to Mongo per batch (default: 50)")
+    parser.add_argument("--flush-interval", type=float, default=5.0, help="Max seconds parsed cars wait to be written (default: 5)")
+    parser.add_argument("--stats", action="store_true", help="Show queue depth and throughput, then exit")
+    parser.add_argument("--stats-window", type=int, default=15, help="Minutes of the throughput window (default: 15)")
+    parser.add_argument("--requeue-dead", action="store_true", help="With --stats, give dead raw cars a new set of attempts")
+    parser.add_argument("--batch", action="store_true", help="Parse through the OpenAI Batch API instead of one request per car")
+    parser.add_argument("--batch-dir", type=Path, default=Path("batches"), help="Where batch input files are written (default: batches)")
+    parser.add_argument("--batch-id", default=None, help="Resume a submitted batch: wait for it and ingest its results")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_REQUESTS, help=f"Max requests per batch (default: {MAX_BATCH_REQUESTS})")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between batch status checks (default: 60)")
     args = parser.parse_args()
+    if args.offset is not None or args.limit is not None:
+        parser.error("-o/--offset and -l/--limit were removed, workers claim raw cars from a queue now (see --concurrency)")
 
-    asyncio.run(parse_cars(args.offset, args.limit))
+    if args.stats:
+        run_with_db(show_queue_stats(args.stats_window, args.requeue_dead, args.max_attempts))
+    elif args.batch or args.batch_id:
+        run_with_db(parse_cars_batch(args.batch_dir, args.batch_size, args.batch_id, args.poll_interval))
+    else:
+        run_with_db(parse_cars(
+            args.worker_id, args.concurrency, args.lease, args.max_attempts, args.flush_size, args.flush_interval
+        ))
@@ -0,0 +1,362 @@
+import aiohttp
+import asyncio
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional, Set
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from logger import setup_logger
+
+from infoparser.crud_auto import AutoDataBaseCRUD, init_db
+from infoparser.schemas import AutoRaw
+from scraper.checkpoint import CrawlCheckpoint
+from scraper.extraction import DEFAULT_EXTRACTOR, get_extractor
+from scraper.ratelimit import configure_host, get_limiter, limited_get, limiters_summary
+from scraper.stats import CrawlStats
+
+# Errors worth retrying instead of ending the crawl
+TRANSIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+# Listing pages failing in a row before the crawl stops, the site is probably down
+MAX_CONSECUTIVE_FAILED_PAGES = 3
+
+
+class BaseScraper(ABC):
+    """Pipelined crawler of a listing site, subclasses implement the site specific parts.
+
+    A subclass sets `name`, `base_url` and `headers` and implements `get_links`, which returns the
+    detail links of a listing page and sets `total_pages`. Everything else (pooled session, rate
+    limiting, retries, checkpoints, incremental skipping and batched Mongo writes) is shared.
+    """
+
+    name: str
+    base_url: str
+    headers: dict = {}
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        queue_size: int = 100,
+        flush_size: int = 50,
+        flush_interval: float = 5.0,
+        incremental: bool = True,
+        extractor: str = DEFAULT_EXTRACTOR,
+        max_retries: int = 3,
+        retry_backoff: float = 2.0,
+        max_rate: Optional[float] = None,
+    ):
+        self.total_pages = None
+        # Max detail requests in flight at the same time
+        self.concurrency = concurrency
+        # Max links waiting for a detail worker, bounds how far listing pages are prefetched
+        self.queue_size = queue_size
+        # Raw articles are written to Mongo every flush_size items or flush_interval seconds
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # Skip listings whose url is already stored in autos_raw
+        self.incremental = incremental
+        self.seen_urls: Set[str] = set()
+        self.extractor = get_extractor(extractor)
+        # Failed links are retried with exponential backoff before giving up on them
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.checkpoint: Optional[CrawlCheckpoint] = None
+        if max_rate is not None:
+            # Ceiling of the adaptive per-host limiter, in requests per second per process
+            configure_host(urlsplit(self.base_url).netloc, max_rate=max_rate)
+        # Last listing page to crawl, used to split the crawl in shards
+        self.to_page: Optional[int] = None
+        self.stats = CrawlStats()
+        # Called with the stats after every listing page and Mongo flush
+        self.on_progress: Optional[Callable[[CrawlStats], None]] = None
+        # Long-lived session shared by every request of a run
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.logger = setup_logger(f"scraper.{self.name}")
+        # Called with (url, status, body) for every response, used to record replay corpora
+        self.recorder: Optional[Callable[[str, int, str], None]] = None
+
+    async def open_session(self) -> None:
+        if self.session is not None:
+            return
+        # One pooled connector per run so connections and TLS sessions get reused
+        connector = aiohttp.TCPConnector(limit=self.concurrency + 1, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+
+    async def close_session(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def normalize_url(self, link: str) -> str:
+        """Absolute listing URL without query string, fragment or trailing slash."""
+        scheme, netloc, path, _, _ = urlsplit(urljoin(self.base_url, link))
+        return urlunsplit((scheme.lower(), netloc.lower(), path.rstrip("/"), "", ""))
+
+    async def _fetch(self, url: str) -> str:
+        # Every request goes through the per-host limiter, it replaces the fixed delay between pages
+        if self.session is None:
+            # Out of a run (e.g. calling get_links directly), fall back to a one-off session
+            async with aiohttp.ClientSession(headers=self.headers) as session:
+                page_content = await limited_get(session, url, self.recorder)
+        else:
+            page_content = await limited_get(self.session, url, self.recorder)
+        self.stats.bytes_fetched += len(page_content.encode("utf-8"))
+        return page_content
+
+    def _parse(self, func: Callable[..., Any], *args) -> Any:
+        """Runs an extraction function, accounting its time as parse time."""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.stats.parse_seconds += time.perf_counter() - start
+
+    @abstractmethod
+    async def get_links(self, index: int = 1) -> list:
+        """Detail links of listing page `index`, also sets `total_pages`."""
+
+    async def run(
+        self,
+        from_page: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        to_page: Optional[int] = None,
+        crud: Optional[AutoDataBaseCRUD] = None,
+    ) -> None:
+        """Crawls from `from_page` (default: the checkpoint) and stores raw cars in `crud` (default: Mongo)."""
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if to_page is not None:
+            self.to_page = to_page
+        self.stats = CrawlStats()
+        if self.checkpoint is None:
+            self.checkpoint = CrawlCheckpoint.for_scraper(self.name)
+        if from_page is None:
+            from_page = self.checkpoint.resume_page()
+            if from_page is not None:
+                self.logger.info(
+                    "Resuming from page %s with %s pending links", from_page, len(self.checkpoint.pending)
+                )
+            from_page = from_page or 1
+        else:
+            # An explicit start page means a fresh crawl, links given up on before are still retried
+            self.checkpoint.reset(keep_failed=True)
+
+        if crud is None:
+            crud = await init_db()
+        await crud.ensure_raw_indexes()
+        if self.incremental:
+            self.seen_urls = await crud.get_raw_urls()
+            self.logger.info("Loaded %s listings already stored", len(self.seen_urls))
+        await self.open_session()
+        try:
+            await self._crawl(crud, from_page)
+        finally:
+            await self.close_session()
+        self.stats.finished_at = time.time()
+
+        for url, failure in self.checkpoint.failed.items():
+            self.logger.warning("Gave up on %s after %s attempts: %s", url, failure["attempts"], failure["error"])
+        for page, failure in self.checkpoint.failed_pages.items():
+            self.logger.warning(
+                "Gave up on listing page %s after %s attempts: %s", page, failure["attempts"], failure["error"]
+            )
+        self.logger.info("Crawl finished: %s", self.stats.summary())
+        self.logger.info("Rate limits: %s", limiters_summary())
+        # The crawl is complete, next run starts from the first page again and retries the failed links
+        self.checkpoint.reset(keep_failed=True)
+
+    def _report_progress(self) -> None:
+        if self.on_progress is not None:
+            self.on_progress(self.stats)
+
+    async def _crawl(self, crud: AutoDataBaseCRUD, from_page: int) -> None:
+        # Pipeline: listing producer -> detail workers -> Mongo flusher.
+        # Bounded queues give backpressure so no stage runs too far ahead.
+        links_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        results_queue: asyncio.Queue = asyncio.Queue(maxsize=self.flush_size * 2)
+        # Links queued, in flight or waiting for a retry
+        self._outstanding = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._retries: Set[asyncio.Task] = set()
+
+        async def detail_stage() -> None:
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(self.concurrency):
+                    tg.create_task(self._detail_worker(links_queue, results_queue))
+            await results_queue.put(None)
+
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(self._produce_links(from_page, links_queue))
+            tg.create_task(detail_stage())
+            tg.create_task(self._flush_results(crud, results_queue))
+
+    async def _enqueue(self, links_queue: asyncio.Queue, url: str, page: int) -> None:
+        self._outstanding += 1
+        self._drained.clear()
+        await links_queue.put((url, page, 0))
+
+    def _settle(self) -> None:
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            self._drained.set()
+
+    async def _produce_links(self, from_page: int, links_queue: asyncio.Queue) -> None:
+        # Links left pending by an interrupted run go first
+        for url, page in list(self.checkpoint.pending.items()):
+            self.seen_urls.add(url)
+            await self._enqueue(links_queue, url, page)
+        # Then the links a previous run gave up on, with a new set of attempts
+        for url, failure in list(self.checkpoint.failed.items()):
+            if url in self.checkpoint.pending:
+                continue
+            if url in self.seen_urls:
+                # Stored since, e.g. by another shard
+                self.checkpoint.stored([url])
+                continue
+            self.seen_urls.add(url)
+            await self._enqueue(links_queue, url, failure["page"] or from_page)
+
+        page = from_page
+        consecutive_failures = 0
+        while True:
+            try:
+                links = await self._get_links_with_retry(page)
+                consecutive_failures = 0
+            except TRANSIENT_ERRORS as error:
+                # One bad page doesn't stop the crawl, a site that is down does
+                consecutive_failures += 1
+                if consecutive_failures >= MAX_CONSECUTIVE_FAILED_PAGES:
+                    raise
+                self.logger.error(
+                    "Giving up on listing page %s after %s attempts: %r", page, self.max_retries + 1, error
+                )
+                self.checkpoint.page_failed(page, self.max_retries + 1, repr(error))
+                self.checkpoint.save()
+                self.stats.failed_pages += 1
+                self._report_progress()
+                if (self.total_pages and page >= self.total_pages) or (self.to_page and page >= self.to_page):
+                    break
+                page += 1
+                continue
+            self.logger.info("-" * 40)
+            self.logger.info(
+                "Getting cars from page %s/%s (%.2f req/s)",
+                page, self.total_pages, get_limiter(self.base_url).achieved_rate(),
+            )
+            self.stats.listing_pages += 1
+            self.stats.last_page = page
+            if not links:
+                break
+            urls = []
+            for link in links:
+                url = self.normalize_url(link)
+                if url in self.seen_urls:
+                    continue
+                self.seen_urls.add(url)
+                urls.append(url)
+            if len(urls) < len(links):
+                self.stats.skipped += len(links) - len(urls)
+                self.logger.info("Skipped %s listings already stored", len(links) - len(urls))
+            self.checkpoint.page_queued(page, urls)
+            self.checkpoint.save()
+            self._report_progress()
+            for url in urls:
+                await self._enqueue(links_queue, url, page)
+            if self.total_pages and page >= self.total_pages:
+                break
+            if self.to_page and page >= self.to_page:
+                break
+            page += 1
+
+        # Retries put links back in the queue, wait for them before stopping the workers
+        await self._drained.wait()
+        # One sentinel per detail worker
+        for _ in range(self.concurrency):
+            await links_queue.put(None)
+
+    def _backoff(self, attempts: int) -> float:
+        return self.retry_backoff * 2 ** (attempts - 1) + random.uniform(0, 1)
+
+    async def _get_links_with_retry(self, page: int) -> list:
+        attempts = 0
+        while True:
+            try:
+                return await self.get_links(page)
+            except TRANSIENT_ERRORS as error:
+                attempts += 1
+                if attempts > self.max_retries:
+                    raise
+                self.logger.warning("Listing page %s failed (%r), retry %s/%s", page, error, attempts, self.max_retries)
+                await asyncio.sleep(self._backoff(attempts))
+
+    async def _detail_worker(self, links_queue: asyncio.Queue, results_queue: asyncio.Queue) -> None:
+        while True:
+            item = await links_queue.get()
+            if item is None:
+                return
+            url, page, attempts = item
+            self.logger.debug("Link: %s", url)
+            try:
+                result = await self._extract_vehicle_data(url)
+                self.stats.detail_pages += 1
+                error = None if result is not None else "No article found"
+            except TRANSIENT_ERRORS as exc:
+                result, error = None, repr(exc)
+
+            if error is None:
+                await results_queue.put(AutoRaw(text=result, url=url))
+                self._settle()
+                continue
+
+            attempts += 1
+            if attempts > self.max_retries:
+                self.logger.error("Giving up on %s after %s attempts: %s", url, attempts, error)
+                self.checkpoint.gave_up(url, attempts, error)
+                self.stats.failed += 1
+                self._settle()
+                continue
+            self.checkpoint.retrying(url, attempts, error)
+            task = asyncio.create_task(self._retry_later(links_queue, (url, page, attempts)))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+
+    async def _retry_later(self, links_queue: asyncio.Queue, item: tuple) -> None:
+        url, _, attempts = item
+        delay = self._backoff(attempts)
+        self.logger.info("Retrying %s in %.1fs (attempt %s/%s)", url, delay, attempts, self.max_retries)
+        await asyncio.sleep(delay)
+        await links_queue.put(item)
+
+    async def _flush_results(self, crud: AutoDataBaseCRUD, results_queue: asyncio.Queue) -> None:
+        batch = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        done = False
+        while not done:
+            try:
+                result = await asyncio.wait_for(results_queue.get(), timeout=max(deadline - loop.time(), 0))
+                if result is None:
+                    done = True
+                else:
+                    batch.append(result)
+            except asyncio.TimeoutError:
+                pass
+            # Flush by size, by time or when the detail stage is done
+            if done or len(batch) >= self.flush_size or loop.time() >= deadline:
+                if batch:
+                    start = time.perf_counter()
+                    await crud.insert_many_raw_cars(batch)
+                    self.stats.insert_seconds += time.perf_counter() - start
+                    self.checkpoint.stored([raw_car.url for raw_car in batch])
+                    self.checkpoint.save()
+                    self.stats.inserted += len(batch)
+                    self.logger.info("Inserted %s cars", self.stats.inserted)
+                    self._report_progress()
+                    batch = []
+                deadline = loop.time() + self.flush_interval
+
+    async def _extract_vehicle_data(self, link: str) -> Optional[str]:
+        page_content = await self._fetch(urljoin(self.base_url, link))
+        # Extracted and sanitized on the one tree the extractor builds
+        return self._parse(self.extractor.sanitized_article, page_content)
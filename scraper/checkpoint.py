@@ -0,0 +1,122 @@
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CHECKPOINT_DIR = Path(os.getenv("CRAWL_CHECKPOINT_DIR", ".crawl_state"))
+
+
+class CrawlCheckpoint:
+    """Crawl progress persisted to a local JSON file.
+
+    Tracks the last listing page whose links were all stored, the links queued but not stored yet,
+    the links that failed with their retry counts and the listing pages given up on.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.last_completed_page = 0
+        self.last_queued_page = 0
+        # url -> listing page it came from
+        self.pending: Dict[str, int] = {}
+        # url -> {"page", "attempts", "error", "failed_at"}
+        self.failed: Dict[str, dict] = {}
+        # listing page (as a string, JSON keys) -> {"attempts", "error", "failed_at"}
+        self.failed_pages: Dict[str, dict] = {}
+
+    @classmethod
+    def for_scraper(cls, name: str) -> "CrawlCheckpoint":
+        return cls.load(CHECKPOINT_DIR / f"{name}.json")
+
+    @classmethod
+    def load(cls, path: Path) -> "CrawlCheckpoint":
+        checkpoint = cls(path)
+        if path.exists():
+            state = json.loads(path.read_text())
+            checkpoint.last_completed_page = state["last_completed_page"]
+            checkpoint.last_queued_page = state["last_queued_page"]
+            checkpoint.pending = state["pending"]
+            checkpoint.failed = state["failed"]
+            checkpoint.failed_pages = state.get("failed_pages", {})
+        return checkpoint
+
+    @property
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {
+            "last_completed_page": self.last_completed_page,
+            "last_queued_page": self.last_queued_page,
+            "pending": self.pending,
+            "failed": self.failed,
+            "failed_pages": self.failed_pages,
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+        }
+        # Write then rename so a crash never leaves a half written checkpoint
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self.path)
+
+    def reset(self, keep_failed: bool = False) -> None:
+        """Forgets the progress. With `keep_failed` the links given up on stay, the next run retries them."""
+        failed = self.failed if keep_failed else {}
+        self.__init__(self.path)
+        self.failed = failed
+        if self.failed:
+            self.save()
+        elif self.path.exists():
+            self.path.unlink()
+
+    def page_queued(self, page: int, urls: List[str]) -> None:
+        for url in urls:
+            self.pending[url] = page
+        self.last_queued_page = max(self.last_queued_page, page)
+        self._advance()
+
+    def page_failed(self, page: int, attempts: int, error: str) -> None:
+        """A listing page given up on, the crawl goes on with the next one."""
+        self.failed_pages[str(page)] = {
+            "attempts": attempts,
+            "error": error,
+            "failed_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.page_queued(page, [])
+
+    def stored(self, urls: List[str]) -> None:
+        for url in urls:
+            self.pending.pop(url, None)
+            self.failed.pop(url, None)
+        self._advance()
+
+    def retrying(self, url: str, attempts: int, error: str) -> None:
+        self.failed[url] = {
+            "page": self.pending.get(url),
+            "attempts": attempts,
+            "error": error,
+            "failed_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def gave_up(self, url: str, attempts: int, error: str) -> None:
+        self.retrying(url, attempts, error)
+        self.pending.pop(url, None)
+        self._advance()
+
+    def resume_page(self) -> Optional[int]:
+        """First listing page not fully stored, None if there is nothing to resume."""
+        if not self.last_queued_page and not self.pending:
+            return None
+        return self.last_completed_page + 1
+
+    def _advance(self) -> None:
+        if self.pending:
+            lowest_pending = min(self.pending.values())
+            self.last_completed_page = max(self.last_completed_page, lowest_pending - 1)
+        else:
+            self.last_completed_page = max(self.last_completed_page, self.last_queued_page)
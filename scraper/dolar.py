@@ -1,16 +1,17 @@
 import aiohttp
-from bs4 import BeautifulSoup
+from typing import Optional
 from infoparser.parser_agent import DolarParserAgent
 from infoparser.schemas import DolarValues
+from scraper.extraction import HtmlExtractor, get_extractor
+from scraper.ratelimit import limited_get
 
 
-async def get_dolar_blue_value() -> DolarValues:
+async def get_dolar_blue_value(extractor: Optional[HtmlExtractor] = None) -> DolarValues:
     url = "https://www.dolarhoy.com/"
+    extractor = extractor or get_extractor()
     async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            response_text = await response.text()
-            soup = BeautifulSoup(response_text, 'html.parser')
-            dolar_values = soup.find('div', class_='tile dolar')
-            # Send the dolar values to DolarParserAgent
-            dolar_values = await DolarParserAgent()._extract_dolar_info(str(dolar_values))
+        response_text = await limited_get(session, url)
+    dolar_values = extractor.dolar_tile(response_text)
+    # Send the dolar values to DolarParserAgent
+    dolar_values = await DolarParserAgent()._extract_dolar_info(str(dolar_values))
     return dolar_values
@@ -0,0 +1,135 @@
+from typing import Dict, List, Optional, Tuple, Type
+
+from bs4 import BeautifulSoup, Comment, SoupStrainer, Tag
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:  # lxml is optional, only needed for the "lxml" backend
+    lxml = None
+
+# Markup that never carries listing content
+STRIP_TAGS = ["script", "style", "svg", "noscript", "iframe", "link", "button", "form", "template"]
+# Attributes worth keeping, itemprop/content carry the microdata of the listing
+KEEP_ATTRIBUTES = {"itemprop", "itemscope", "itemtype", "content", "href", "datetime", "class", "title", "alt"}
+
+
+def _sanitize_soup(soup: Tag) -> None:
+    for tag in soup.find_all(STRIP_TAGS):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for tag in [soup, *soup.find_all(True)]:
+        # Metadata tags are kept only when they carry microdata
+        if tag.name == "meta" and not tag.has_attr("itemprop"):
+            tag.decompose()
+            continue
+        tag.attrs = {key: value for key, value in tag.attrs.items() if key in KEEP_ATTRIBUTES}
+
+
+class HtmlExtractor:
+    """Full-tree extraction with html.parser, the original behavior."""
+
+    name = "bs4"
+
+    def _soup(self, html: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+        return BeautifulSoup(html, "html.parser")
+
+    def parse_listing(self, html: str) -> Tuple[List[str], Optional[int]]:
+        """Returns the listing detail links and the total cars announced in the page subtitle."""
+        soup = self._soup(html, SoupStrainer(["a", "h2"]))
+        links = [link.get("href") for link in soup.find_all("a", itemprop="url")]
+        total_cars = None
+        subtitle = soup.find("h2", {"class": "section__subtitle"})
+        if subtitle and subtitle.find("strong"):
+            total_cars = int(subtitle.find("strong").text)
+        return links, total_cars
+
+    def article(self, html: str) -> Optional[str]:
+        article = self._soup(html, SoupStrainer("article")).find("article")
+        return str(article) if article else None
+
+    def sanitized_article(self, html: str) -> Optional[str]:
+        """The article without scripts, styles, SVGs, comments and tracking/presentation attributes."""
+        article = self._soup(html, SoupStrainer("article")).find("article")
+        if not article:
+            return None
+        _sanitize_soup(article)
+        return str(article)
+
+    def dolar_tile(self, html: str) -> Optional[str]:
+        tile = self._soup(html, SoupStrainer("div", class_="tile dolar")).find("div", class_="tile dolar")
+        return str(tile) if tile else None
+
+
+class StrainerExtractor(HtmlExtractor):
+    """html.parser limited to the tags we need, the rest of the page never becomes a tree."""
+
+    name = "strainer"
+
+    def _soup(self, html: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+        return BeautifulSoup(html, "html.parser", parse_only=parse_only)
+
+
+class LxmlExtractor(HtmlExtractor):
+    """C-backed parsing with lxml and XPath lookups."""
+
+    name = "lxml"
+
+    def __init__(self):
+        if lxml is None:
+            raise ValueError("The lxml extractor requires the lxml package")
+
+    @staticmethod
+    def _has_classes(*classes: str) -> str:
+        return " and ".join(
+            f"contains(concat(' ', normalize-space(@class), ' '), ' {css_class} ')" for css_class in classes
+        )
+
+    def parse_listing(self, html: str) -> Tuple[List[str], Optional[int]]:
+        tree = lxml.html.fromstring(html)
+        links = [str(href) for href in tree.xpath('//a[@itemprop="url"]/@href')]
+        total_cars = None
+        strong = tree.xpath(f"//h2[{self._has_classes('section__subtitle')}]//strong")
+        if strong:
+            total_cars = int(strong[0].text_content())
+        return links, total_cars
+
+    def _first(self, html: str, xpath: str) -> Optional[str]:
+        found = lxml.html.fromstring(html).xpath(xpath)
+        return lxml.html.tostring(found[0], encoding="unicode", with_tail=False) if found else None
+
+    def article(self, html: str) -> Optional[str]:
+        return self._first(html, "(//article)[1]")
+
+    def sanitized_article(self, html: str) -> Optional[str]:
+        found = lxml.html.fromstring(html).xpath("(//article)[1]")
+        if not found:
+            return None
+        article = found[0]
+        lxml.etree.strip_elements(article, *STRIP_TAGS, lxml.etree.Comment, with_tail=False)
+        for meta in article.xpath(".//meta[not(@itemprop)]"):
+            meta.drop_tree()
+        for element in article.iter(lxml.etree.Element):
+            for key in [key for key in element.attrib if key not in KEEP_ATTRIBUTES]:
+                del element.attrib[key]
+        return lxml.html.tostring(article, encoding="unicode", with_tail=False)
+
+    def dolar_tile(self, html: str) -> Optional[str]:
+        return self._first(html, f"(//div[{self._has_classes('tile', 'dolar')}])[1]")
+
+
+EXTRACTORS: Dict[str, Type[HtmlExtractor]] = {
+    HtmlExtractor.name: HtmlExtractor,
+    StrainerExtractor.name: StrainerExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+# lxml is several times faster when installed, otherwise fall back to the strained html.parser
+DEFAULT_EXTRACTOR = LxmlExtractor.name if lxml is not None else StrainerExtractor.name
+
+
+def get_extractor(name: str = DEFAULT_EXTRACTOR) -> HtmlExtractor:
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor: {name}")
+    return EXTRACTORS[name]()
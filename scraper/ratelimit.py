@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Statuses that mean the host wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Slot:
+    """Outcome of one request, filled by the caller while it holds the slot."""
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+
+    def record(self, response: aiohttp.ClientResponse) -> None:
+        self.status = response.status
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+
+class HostRateLimiter:
+    """Token bucket with an AIMD concurrency window for a single host.
+
+    Healthy responses raise the request rate and the concurrency window additively, 429/503, errors
+    and slow responses cut both in half. A Retry-After header pauses the host for the given time.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        rate: float = 2.0,
+        max_rate: float = 20.0,
+        min_rate: float = 0.2,
+        max_concurrency: int = 32,
+        slow_threshold: float = 10.0,
+        initial_concurrency: float = 1.0,
+    ):
+        self.host = host
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        # Responses slower than this many seconds count as the host struggling
+        self.slow_threshold = slow_threshold
+        self.requests = 0
+        self.throttled = 0
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._completed: deque = deque()
+        self._condition = asyncio.Condition()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _refill(self, now: float) -> None:
+        # Burst of up to one second worth of requests
+        self._tokens = min(self._tokens + (now - self._last_refill) * self.rate, max(self.rate, 1.0))
+        self._last_refill = now
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight < int(self.concurrency):
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                # Otherwise wait for a release to free a slot
+                try:
+                    await asyncio.wait_for(self._condition.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, status: Optional[int], elapsed: float, retry_after: Optional[float]) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self.requests += 1
+            now = time.monotonic()
+            self._completed.append(now)
+            if status in THROTTLE_STATUSES or status is None or status >= 500 or elapsed > self.slow_threshold:
+                self.throttled += 1
+                self.concurrency = max(self.concurrency / 2, 1.0)
+                self.rate = max(self.rate / 2, self.min_rate)
+                logger.warning(
+                    "%s throttled (status %s, %.1fs), window %.1f, rate %.2f/s",
+                    self.host, status, elapsed, self.concurrency, self.rate,
+                )
+            else:
+                # Additive increase, about +1 slot per window of healthy responses
+                self.concurrency = min(self.concurrency + 1 / self.concurrency, float(self.max_concurrency))
+                self.rate = min(self.rate + 1 / max(self.rate, 1.0), self.max_rate)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+                logger.warning("%s asked to retry after %.1fs", self.host, retry_after)
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[_Slot]:
+        await self.acquire()
+        slot = _Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        finally:
+            await self.release(slot.status, time.monotonic() - start, slot.retry_after)
+
+    def achieved_rate(self, window: float = 60.0) -> float:
+        """Completed requests per second over the last `window` seconds."""
+        now = time.monotonic()
+        while self._completed and self._completed[0] < now - window:
+            self._completed.popleft()
+        if not self._completed:
+            return 0.0
+        return len(self._completed) / min(window, max(now - self._completed[0], 1.0))
+
+    def summary(self) -> str:
+        return (
+            f"{self.host}: {self.achieved_rate():.2f} req/s achieved, rate limit {self.rate:.2f}/s, "
+            f"window {self.concurrency:.1f}, {self.requests} requests, {self.throttled} throttled"
+        )
+
+
+_limiters: Dict[str, HostRateLimiter] = {}
+_limiter_options: Dict[str, dict] = {}
+
+
+def configure_host(host: str, **options) -> None:
+    """Sets the HostRateLimiter arguments used when the limiter for `host` is created."""
+    _limiter_options[host] = options
+    _limiters.pop(host, None)
+
+
+def get_limiter(url: str) -> HostRateLimiter:
+    """Limiter shared by every request to the host of `url` in this process's event loop."""
+    host = urlsplit(url).netloc or url
+    loop = asyncio.get_running_loop()
+    # asyncio primitives are bound to a loop, each asyncio.run gets fresh limiters
+    if host not in _limiters or _limiters[host].loop is not loop:
+        _limiters[host] = HostRateLimiter(host, **_limiter_options.get(host, {}))
+        _limiters[host].loop = loop
+    return _limiters[host]
+
+
+def limiters_summary() -> str:
+    return "; ".join(limiter.summary() for limiter in _limiters.values())
+
+
+async def limited_get(
+    session: aiohttp.ClientSession, url: str, recorder: Optional[Callable[[str, int, str], None]] = None
+) -> str:
+    """GET through the host limiter, raising aiohttp.ClientResponseError on error statuses.
+
+    `recorder` gets (url, status, body) of every response, error statuses included.
+    """
+    async with get_limiter(url).slot() as slot:
+        async with session.get(url) as response:
+            slot.record(response)
+            if recorder is not None:
+                recorder(url, response.status, await response.text())
+            response.raise_for_status()
+            return await response.text()
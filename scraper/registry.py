@@ -0,0 +1,33 @@
+import importlib
+from typing import Dict, List, Type
+
+from scraper.base import BaseScraper
+
+# Site name -> "module:Class", the module is only imported when the site is used
+SCRAPERS: Dict[str, str] = {
+    "autocosmos": "scraper.autocosmos:AutocosmosScraper",
+}
+
+_loaded: Dict[str, Type[BaseScraper]] = {}
+
+
+def register_scraper(name: str, path: str) -> None:
+    """Adds a scraper plugin given as "module:Class"."""
+    SCRAPERS[name] = path
+    _loaded.pop(name, None)
+
+
+def available_scrapers() -> List[str]:
+    return list(SCRAPERS.keys())
+
+
+def get_scraper_class(name: str) -> Type[BaseScraper]:
+    if name not in SCRAPERS:
+        raise ValueError(f"Unknown scraper: {name}")
+    if name not in _loaded:
+        module_name, class_name = SCRAPERS[name].split(":")
+        scraper_cls = getattr(importlib.import_module(module_name), class_name)
+        if not issubclass(scraper_cls, BaseScraper):
+            raise TypeError(f"{SCRAPERS[name]} is not a BaseScraper")
+        _loaded[name] = scraper_cls
+    return _loaded[name]
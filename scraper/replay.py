@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Record/replay harness to run scrapers offline.
+
+`record` crawls a few listing pages of a live site and saves every response to a corpus directory.
+`serve` starts a local stand-in of the site that replays the corpus with configurable latency and
+injected errors. Point a scraper's `base_url` at the stand-in to crawl it without the network.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+from infoparser.schemas import AutoRaw
+from logger import setup_logger
+from scraper.base import BaseScraper
+from scraper.checkpoint import CrawlCheckpoint
+from scraper.registry import available_scrapers, get_scraper_class
+
+logger = setup_logger(__name__)
+
+INDEX_FILE = "index.json"
+
+
+def _path_qs(url: str) -> str:
+    parts = urlsplit(url)
+    return parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+class ReplayCorpus:
+    """Responses of a site saved on disk, keyed by path and query string."""
+
+    def __init__(self, directory: Path, base_url: Optional[str] = None):
+        self.directory = directory
+        self.base_url = base_url
+        self.responses: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, directory: Path) -> "ReplayCorpus":
+        index = json.loads((directory / INDEX_FILE).read_text())
+        corpus = cls(directory, index["base_url"])
+        corpus.responses = index["responses"]
+        return corpus
+
+    def save(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index = {"base_url": self.base_url, "responses": self.responses}
+        (self.directory / INDEX_FILE).write_text(json.dumps(index, indent=2))
+
+    def record(self, url: str, status: int, body: str) -> None:
+        key = _path_qs(url)
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".html"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / file_name).write_text(body)
+        self.responses[key] = {"file": file_name, "status": status}
+
+    def body(self, key: str) -> Optional[str]:
+        if key not in self.responses:
+            return None
+        return (self.directory / self.responses[key]["file"]).read_text()
+
+
+class MemoryRawSink:
+    """Stand-in for AutoDataBaseCRUD that keeps raw cars in memory, for offline runs."""
+
+    def __init__(self, insert_delay: float = 0.0):
+        self.raw_cars: List[AutoRaw] = []
+        # Simulated Mongo round trip per insert_many call
+        self.insert_delay = insert_delay
+
+    async def ensure_raw_indexes(self) -> None:
+        pass
+
+    async def get_raw_urls(self) -> Set[str]:
+        return {raw_car.url for raw_car in self.raw_cars}
+
+    async def insert_many_raw_cars(self, raw_cars: List[AutoRaw]) -> List[AutoRaw]:
+        await asyncio.sleep(self.insert_delay)
+        self.raw_cars.extend(raw_cars)
+        return raw_cars
+
+
+def make_replay_app(
+    corpus: ReplayCorpus,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    error_statuses: Sequence[int] = (500, 503),
+    seed: Optional[int] = None,
+) -> web.Application:
+    """aiohttp app replaying `corpus`, links to the original site are rewritten to the stand-in."""
+    rng = random.Random(seed)
+
+    async def handler(request: web.Request) -> web.Response:
+        delay = latency + rng.uniform(-jitter, jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if rng.random() < error_rate:
+            return web.Response(status=rng.choice(error_statuses), text="Injected error")
+        body = corpus.body(request.path_qs)
+        if body is None:
+            return web.Response(status=404, text="Not in corpus")
+        if corpus.base_url:
+            body = body.replace(corpus.base_url, f"{request.scheme}://{request.host}")
+        return web.Response(
+            status=corpus.responses[request.path_qs]["status"], text=body, content_type="text/html"
+        )
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    return app
+
+
+async def start_replay_server(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """Starts `app` and returns its runner, the bound address is in `runner.addresses`."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def record_site(scraper: BaseScraper, directory: Path, pages: int) -> ReplayCorpus:
+    """Crawls the first `pages` listing pages of the live site, saving every response."""
+    corpus = ReplayCorpus(directory, scraper.base_url)
+    scraper.recorder = corpus.record
+    scraper.incremental = False
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        scraper.checkpoint = CrawlCheckpoint(Path(checkpoint_dir) / "record.json")
+        await scraper.run(1, to_page=pages, crud=MemoryRawSink())
+    corpus.save()
+    logger.info("Recorded %s responses in %s", len(corpus.responses), directory)
+    return corpus
+
+
+async def serve(args: argparse.Namespace) -> None:
+    corpus = ReplayCorpus.load(args.corpus)
+    app = make_replay_app(corpus, args.latency, args.jitter, args.error_rate, seed=args.seed)
+    runner = await start_replay_server(app, args.host, args.port)
+    logger.info("Replaying %s responses of %s on http://%s:%s", len(corpus.responses), corpus.base_url, args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response (default: 0.05)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of responses replaced by a 5xx")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the latency and error randomness")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and replay scraper responses")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Save live responses to a corpus")
+    record_parser.add_argument("corpus", type=Path, help="Corpus directory")
+    record_parser.add_argument("-s", "--site", choices=available_scrapers(), default="autocosmos")
+    record_parser.add_argument("-p", "--pages", type=int, default=2, help="Listing pages to record (default: 2)")
+    record_parser.add_argument("-c", "--concurrency", type=int, default=4)
+
+    serve_parser = subparsers.add_parser("serve", help="Replay a corpus on a local HTTP server")
+    serve_parser.add_argument("corpus", type=Path, help="Corpus directory")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8900)
+    add_server_arguments(serve_parser)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        scraper = get_scraper_class(args.site)(concurrency=args.concurrency)
+        asyncio.run(record_site(scraper, args.corpus, args.pages))
+    else:
+        asyncio.run(serve(args))
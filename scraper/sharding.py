@@ -0,0 +1,136 @@
+import asyncio
+import json
+import math
+import multiprocessing
+import queue
+import time
+from typing import Dict, List, Optional, Tuple, Type
+
+from infoparser.crud_auto import run_with_db
+from logger import setup_logger
+from scraper.checkpoint import CHECKPOINT_DIR, CrawlCheckpoint
+from scraper.stats import CrawlStats
+
+logger = setup_logger(__name__)
+
+PROGRESS_INTERVAL = 10
+
+
+def split_pages(from_page: int, total_pages: int, workers: int) -> List[Tuple[int, int]]:
+    """Splits [from_page, total_pages] in up to `workers` contiguous, inclusive ranges."""
+    pages = total_pages - from_page + 1
+    if pages <= 0:
+        return []
+    size = math.ceil(pages / workers)
+    return [
+        (start, min(start + size - 1, total_pages))
+        for start in range(from_page, total_pages + 1, size)
+    ]
+
+
+async def discover_total_pages(scraper_cls: Type, options: dict) -> int:
+    scraper = scraper_cls(**options)
+    await scraper.get_links(1)
+    return scraper.total_pages
+
+
+def _run_shard(
+    scraper_cls: Type,
+    options: dict,
+    shard: int,
+    start: int,
+    end: int,
+    progress: multiprocessing.Queue,
+) -> None:
+    """Entry point of a worker process, crawls listing pages start..end."""
+    scraper = scraper_cls(**options)
+    scraper.checkpoint = CrawlCheckpoint.for_scraper(f"{scraper.name}.shard{shard}")
+    # A shard left half done by an interrupted run resumes from its own checkpoint
+    from_page = None if scraper.checkpoint.resume_page() is not None else start
+    scraper.on_progress = lambda stats: progress.put((shard, stats.model_dump()))
+    run_with_db(scraper.run(from_page, to_page=end))
+    progress.put((shard, scraper.stats.model_dump()))
+
+
+def _plan_path(name: str):
+    return CHECKPOINT_DIR / f"{name}.shards.json"
+
+
+def run_sharded(scraper_cls: Type, options: dict, workers: int, from_page: Optional[int] = None) -> CrawlStats:
+    """Crawls a site with one process per listing page range and merges their progress.
+
+    `options` are the scraper constructor arguments, every worker builds its own scraper. Raises
+    RuntimeError when a shard fails, once the plan is saved for the next run to resume it.
+    """
+    name = scraper_cls.name
+    plan_path = _plan_path(name)
+    ranges = None
+    # Shards that finished, a resumed plan doesn't crawl them again
+    done: List[int] = []
+    if from_page is None and plan_path.exists():
+        plan = json.loads(plan_path.read_text())
+        if plan["workers"] == workers:
+            ranges = [tuple(page_range) for page_range in plan["ranges"]]
+            done = plan.get("done", [])
+            logger.info("Resuming sharded crawl of %s: %s, shards %s already done", name, ranges, done)
+    if ranges is None:
+        for shard in range(workers):
+            CrawlCheckpoint.for_scraper(f"{name}.shard{shard}").reset()
+        total_pages = asyncio.run(discover_total_pages(scraper_cls, options))
+        ranges = split_pages(from_page or 1, total_pages, workers)
+        logger.info("Sharding %s pages of %s in %s workers: %s", total_pages, name, workers, ranges)
+
+    def save_plan() -> None:
+        plan_path.parent.mkdir(parents=True, exist_ok=True)
+        plan_path.write_text(json.dumps({"workers": workers, "ranges": ranges, "done": sorted(done)}))
+
+    save_plan()
+
+    # Spawn keeps the workers free of the coordinator's event loop and sockets
+    context = multiprocessing.get_context("spawn")
+    progress = context.Queue()
+    processes = {
+        shard: context.Process(
+            target=_run_shard,
+            args=(scraper_cls, options, shard, start, end, progress),
+            name=f"{name}-shard{shard}",
+        )
+        for shard, (start, end) in enumerate(ranges)
+        if shard not in done
+    }
+    for process in processes.values():
+        process.start()
+
+    shard_stats: Dict[int, CrawlStats] = {}
+    last_report = time.monotonic()
+    while any(process.is_alive() for process in processes.values()) or not progress.empty():
+        try:
+            shard, stats = progress.get(timeout=1)
+            shard_stats[shard] = CrawlStats(**stats)
+        except queue.Empty:
+            pass
+        # Recorded as soon as each shard exits, a crash of the coordinator keeps them
+        finished = [
+            shard for shard, process in processes.items()
+            if shard not in done and not process.is_alive() and process.exitcode == 0
+        ]
+        if finished:
+            done.extend(finished)
+            save_plan()
+        if shard_stats and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            logger.info("%s: %s", name, CrawlStats.merge(shard_stats.values()).summary())
+            last_report = time.monotonic()
+
+    for process in processes.values():
+        process.join()
+    failed = [process.name for process in processes.values() if process.exitcode != 0]
+    merged = CrawlStats.merge(shard_stats.values())
+    if failed:
+        done.extend(shard for shard, process in processes.items() if shard not in done and process.exitcode == 0)
+        save_plan()
+    else:
+        plan_path.unlink(missing_ok=True)
+    logger.info("Sharded crawl of %s finished: %s", name, merged.summary())
+    if failed:
+        raise RuntimeError(f"Shards {failed} failed, run again to resume them")
+    return merged
@@ -0,0 +1,61 @@
+import time
+from typing import Iterable, Optional
+
+from pydantic import BaseModel, Field
+
+
+class CrawlStats(BaseModel):
+    """Counters of a crawl, mergeable across shards."""
+
+    listing_pages: int = Field(default=0, title="Listing pages fetched")
+    detail_pages: int = Field(default=0, title="Detail pages fetched")
+    inserted: int = Field(default=0, title="Raw cars inserted")
+    skipped: int = Field(default=0, title="Listings skipped because they are already stored")
+    failed: int = Field(default=0, title="Links given up after all retries")
+    failed_pages: int = Field(default=0, title="Listing pages given up after all retries")
+    last_page: int = Field(default=0, title="Last listing page queued")
+    bytes_fetched: int = Field(default=0, title="Response bytes downloaded")
+    parse_seconds: float = Field(default=0.0, title="Seconds spent extracting HTML")
+    insert_seconds: float = Field(default=0.0, title="Seconds spent writing raw cars to Mongo")
+    started_at: float = Field(default_factory=time.time)
+    finished_at: Optional[float] = Field(default=None)
+
+    @property
+    def elapsed(self) -> float:
+        return max((self.finished_at or time.time()) - self.started_at, 1e-9)
+
+    @classmethod
+    def merge(cls, stats: Iterable["CrawlStats"]) -> "CrawlStats":
+        stats = list(stats)
+        merged = cls(started_at=min((s.started_at for s in stats), default=time.time()))
+        if stats and all(s.finished_at for s in stats):
+            merged.finished_at = max(s.finished_at for s in stats)
+        for s in stats:
+            merged.listing_pages += s.listing_pages
+            merged.detail_pages += s.detail_pages
+            merged.inserted += s.inserted
+            merged.skipped += s.skipped
+            merged.failed += s.failed
+            merged.failed_pages += s.failed_pages
+            merged.last_page = max(merged.last_page, s.last_page)
+            merged.bytes_fetched += s.bytes_fetched
+            merged.parse_seconds += s.parse_seconds
+            merged.insert_seconds += s.insert_seconds
+        return merged
+
+    @property
+    def pages_per_second(self) -> float:
+        return (self.listing_pages + self.detail_pages) / self.elapsed
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_fetched / self.elapsed
+
+    def summary(self) -> str:
+        return (
+            f"{self.listing_pages} listing pages, {self.detail_pages} detail pages "
+            f"({self.pages_per_second:.2f} pages/s, {self.bytes_per_second / 1024:.0f} KiB/s), "
+            f"{self.inserted} inserted, {self.skipped} skipped, {self.failed} failed, "
+            f"{self.failed_pages} listing pages failed, "
+            f"parse {self.parse_seconds:.1f}s, insert {self.insert_seconds:.1f}s"
+        )
@@ -0,0 +1,4 @@
+import os
+
+# Log to testing.log instead of production.log
+os.environ.setdefault("ENV", "testing")
@@ -0,0 +1,235 @@
+"""In-memory stand-ins for the Motor collections, covering the queries and updates the code under test uses."""
+
+import copy
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne, errors
+
+from infoparser.schemas import SimpleAuto
+
+MISSING = object()
+
+
+def _get(document: dict, path: str) -> Any:
+    value: Any = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def _set(document: dict, path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def _comparable(value: Any) -> Any:
+    # Mongo compares embedded documents field by field
+    return tuple(_comparable(item) for item in value.values()) if isinstance(value, dict) else value
+
+
+OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$gt": lambda value, operand: value is not None and _comparable(value) > _comparable(operand),
+    "$gte": lambda value, operand: value is not None and _comparable(value) >= _comparable(operand),
+    "$lt": lambda value, operand: value is not None and _comparable(value) < _comparable(operand),
+    "$lte": lambda value, operand: value is not None and _comparable(value) <= _comparable(operand),
+}
+
+
+def matches(document: dict, query: dict) -> bool:
+    """The subset of Mongo's query language used here: equality, comparisons, $in, $not and $or."""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+            continue
+        value = _get(document, field)
+        value = None if value is MISSING else value
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            for operator, operand in condition.items():
+                if operator == "$not":
+                    if matches(document, {field: operand}):
+                        return False
+                elif not OPERATORS[operator](value, operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def apply_update(document: dict, update: dict, inserting: bool = False) -> None:
+    for operator, fields in update.items():
+        for path, operand in fields.items():
+            current = _get(document, path)
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                _set(document, path, copy.deepcopy(operand))
+            elif operator == "$inc":
+                _set(document, path, (0 if current is MISSING else current) + operand)
+            elif operator == "$min":
+                if current is MISSING or _comparable(operand) < _comparable(current):
+                    _set(document, path, copy.deepcopy(operand))
+            elif operator == "$max":
+                if current is MISSING or _comparable(operand) > _comparable(current):
+                    _set(document, path, copy.deepcopy(operand))
+            elif operator != "$setOnInsert":
+                raise NotImplementedError(operator)
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    if any(value for key, value in projection.items() if key != "_id"):
+        kept = {key: document[key] for key, value in projection.items() if value and key in document}
+        if projection.get("_id", 1) and "_id" in document:
+            kept["_id"] = document["_id"]
+        return kept
+    return {key: value for key, value in document.items() if projection.get(key, 1)}
+
+
+class FakeCursor:
+    def __init__(self, documents: List[dict], projection: Optional[dict] = None):
+        self.documents = documents
+        # Applied on the way out, sorting can use fields the projection leaves out
+        self.projection = projection
+
+    def sort(self, key, direction: int = 1) -> "FakeCursor":
+        keys = [(key, direction)] if isinstance(key, str) else key
+        for field, field_direction in reversed(keys):
+            self.documents.sort(key=lambda document: _comparable(_get(document, field)), reverse=field_direction < 0)
+        return self
+
+    def limit(self, count: int) -> "FakeCursor":
+        self.documents = self.documents[:count]
+        return self
+
+    def batch_size(self, size: int) -> "FakeCursor":
+        return self
+
+    def results(self) -> List[dict]:
+        return [_project(document, self.projection) for document in self.documents]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return self.results()[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.results():
+            yield document
+
+
+class FakeCollection:
+    def __init__(self, documents: Optional[List[dict]] = None):
+        self.documents: List[dict] = documents or []
+
+    def _matching(self, query: dict) -> List[dict]:
+        return [document for document in self.documents if matches(document, query)]
+
+    def _insert(self, document: dict) -> dict:
+        document.setdefault("_id", ObjectId())
+        if any(stored["_id"] == document["_id"] for stored in self.documents):
+            raise errors.DuplicateKeyError(f"Duplicate _id {document['_id']}")
+        self.documents.append(document)
+        return document
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        document = {
+            field: value for field, value in query.items()
+            if not field.startswith("$") and not (isinstance(value, dict) and any(key.startswith("$") for key in value))
+        }
+        apply_update(document, update, inserting=True)
+        return self._insert(document)
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> FakeCursor:
+        return FakeCursor(self._matching(query or {}), projection)
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None, sort=None) -> Optional[dict]:
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        documents = cursor.limit(1).results()
+        return documents[0] if documents else None
+
+    async def find_one_and_update(
+        self,
+        query: dict,
+        update: dict,
+        projection: Optional[dict] = None,
+        upsert: bool = False,
+        return_document: bool = ReturnDocument.BEFORE,
+    ) -> Optional[dict]:
+        found = self._matching(query)
+        if not found:
+            if not upsert:
+                return None
+            document = self._upsert(query, update)
+            return _project(document, projection) if return_document == ReturnDocument.AFTER else None
+        document = found[0]
+        before = _project(document, projection)
+        apply_update(document, update)
+        return _project(document, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False) -> SimpleNamespace:
+        return await self.bulk_write([UpdateOne(query, update, upsert=upsert)])
+
+    async def update_many(self, query: dict, update: dict) -> SimpleNamespace:
+        found = self._matching(query)
+        for document in found:
+            apply_update(document, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found))
+
+    async def bulk_write(self, requests: List[UpdateOne], ordered: bool = True) -> SimpleNamespace:
+        upserted_ids: Dict[int, Any] = {}
+        matched = 0
+        for index, request in enumerate(requests):
+            found = self._matching(request._filter)
+            if found:
+                matched += 1
+                apply_update(found[0], request._doc)
+            elif request._upsert:
+                upserted_ids[index] = self._upsert(request._filter, request._doc)["_id"]
+        return SimpleNamespace(
+            upserted_ids=upserted_ids, upserted_count=len(upserted_ids), matched_count=matched, modified_count=matched
+        )
+
+    async def insert_many(self, documents: List[dict]) -> SimpleNamespace:
+        # Like pymongo, the _id is set on the documents passed in
+        for document in documents:
+            self._insert(document)
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents])
+
+    async def delete_many(self, query: dict) -> SimpleNamespace:
+        found = self._matching(query)
+        self.documents = [document for document in self.documents if document not in found]
+        return SimpleNamespace(deleted_count=len(found))
+
+    async def estimated_document_count(self) -> int:
+        return len(self.documents)
+
+
+class FakeDatabase(dict):
+    """Collections are created on first use, like in Mongo."""
+
+    def __missing__(self, name: str) -> FakeCollection:
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def make_car(**fields) -> SimpleAuto:
+    car = {field: None for field in SimpleAuto.model_fields}
+    car.update(
+        precio=15_000_000, moneda="ARS", url="https://www.autocosmos.com.ar/auto/usado/ford/ka/1", source="autocosmos.com.ar",
+        external_id="1", marca="Ford", modelo="Ka", year="2018", version="1.5 S", ignore=False,
+    )
+    car.update(fields)
+    return SimpleAuto(**car)
@@ -0,0 +1,64 @@
+import asyncio
+
+from bson import ObjectId
+
+from infoparser.crud_auto import AutoDataBaseCRUD
+from tests.fakes import FakeDatabase, make_car
+
+
+def insert(db: FakeDatabase, cars) -> int:
+    batch = []
+    for car in cars:
+        raw_id = ObjectId()
+        db["autos_raw"].documents.append({"_id": raw_id, "extracted": False})
+        batch.append((car, str(raw_id), {"precio": "rules"}))
+    return asyncio.run(AutoDataBaseCRUD(db).insert_cars(batch))
+
+
+def test_a_repost_updates_the_stored_listing():
+    db = FakeDatabase()
+    assert insert(db, [make_car(precio=100)]) == 1
+    stored, = db["autos"].documents
+    created_at = stored["created_at"]
+
+    assert insert(db, [make_car(precio=90)]) == 0
+    stored, = db["autos"].documents
+    assert stored["precio"] == 90
+    assert stored["created_at"] == created_at == stored["first_seen"]
+    assert stored["updated_at"] >= created_at
+    assert stored["field_sources"] == {"precio": "rules"}
+    assert {raw["extracted_car_id"] for raw in db["autos_raw"].documents} == {str(stored["_id"])}
+
+
+def test_the_last_parse_wins_within_a_batch():
+    db = FakeDatabase()
+    assert insert(db, [make_car(precio=100), make_car(external_id="2"), make_car(precio=80)]) == 2
+    prices = {car["external_id"]: car["precio"] for car in db["autos"].documents}
+    assert prices == {"1": 80, "2": 15_000_000}
+    assert all(raw["extracted"] for raw in db["autos_raw"].documents)
+
+
+def test_same_external_id_on_another_source_is_another_listing():
+    db = FakeDatabase()
+    assert insert(db, [make_car(), make_car(source="mercadolibre")]) == 2
+
+
+def test_the_llm_and_rule_spellings_of_a_source_are_the_same_listing():
+    db = FakeDatabase()
+    spellings = ["autocosmos", "www.autocosmos.com.ar", "https://www.Autocosmos.com.ar/auto/usado"]
+    assert insert(db, [make_car(source=source) for source in spellings]) == 1
+    stored, = db["autos"].documents
+    assert stored["source"] == "autocosmos.com.ar"
+
+
+def test_insert_car_returns_the_stored_listing():
+    db = FakeDatabase()
+    raw_id = ObjectId()
+    db["autos_raw"].documents.append({"_id": raw_id, "extracted": False})
+    crud = AutoDataBaseCRUD(db)
+    first = asyncio.run(crud.insert_car(make_car(precio=100), str(raw_id)))
+    second = asyncio.run(crud.insert_car(make_car(precio=90), str(raw_id)))
+    assert first.id == second.id
+    assert second.precio == 90
+    assert len(db["autos"].documents) == 1
+    assert db["autos_raw"].documents[0]["extracted_car_id"] == second.id
@@ -0,0 +1,101 @@
+import asyncio
+
+from bson import ObjectId
+from langchain_core.messages import AIMessage, HumanMessage
+
+from infoparser.chat_history import HistoryCache, MongoDBChatMessageHistory
+from tests.fakes import FakeCollection
+
+
+def history(*texts):
+    return [(ObjectId(), HumanMessage(text)) for text in texts]
+
+
+def test_cache_evicts_the_least_recently_used():
+    cache = HistoryCache(size=2)
+    cache.put(("user", "a"), history("a"))
+    cache.put(("user", "b"), history("b"))
+    assert cache.get(("user", "a")) is not None
+    cache.put(("user", "c"), history("c"))
+    assert cache.get(("user", "b")) is None
+    assert cache.get(("user", "a")) is not None and cache.get(("user", "c")) is not None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_merge_skips_known_messages_and_keeps_id_order():
+    older, newer, newest = history("1", "2", "3")
+    cached = [older, newest]
+    HistoryCache.merge(cached, [newest, newer])
+    assert cached == [older, newer, newest]
+
+
+def test_append_only_extends_cached_conversations():
+    cache = HistoryCache()
+    cache.append(("user", "a"), history("partial"))
+    assert cache.get(("user", "a")) is None
+    cache.put(("user", "a"), history("1"))
+    cache.append(("user", "a"), history("2"))
+    assert [message.content for _, message in cache.get(("user", "a"))] == ["1", "2"]
+
+
+def test_drop_conversation_for_every_user():
+    cache = HistoryCache()
+    cache.put(("user", "a"), history("1"))
+    cache.put(("other", "a"), history("1"))
+    cache.put(("user", "b"), history("1"))
+    cache.drop_conversation("a")
+    assert cache.get(("user", "a")) is None and cache.get(("other", "a")) is None
+    assert cache.get(("user", "b")) is not None
+
+
+def worker_history(collection: FakeCollection, monkeypatch) -> MongoDBChatMessageHistory:
+    """The conversation as seen by one API worker, with its own cache."""
+    async def get_collection(self):
+        return collection
+
+    monkeypatch.setattr(MongoDBChatMessageHistory, "get_collection", get_collection)
+    return MongoDBChatMessageHistory("conversation", "user", cache=HistoryCache())
+
+
+def contents(chat_history: MongoDBChatMessageHistory):
+    return [message.content for message in asyncio.run(chat_history.aget_messages())]
+
+
+def test_cached_history_picks_up_messages_from_other_workers(monkeypatch):
+    collection = FakeCollection()
+    first = worker_history(collection, monkeypatch)
+    second = worker_history(collection, monkeypatch)
+
+    asyncio.run(first.aadd_messages([HumanMessage("hola"), AIMessage("buenas")]))
+    assert contents(first) == ["hola", "buenas"]
+    assert contents(second) == ["hola", "buenas"]
+
+    asyncio.run(second.aadd_messages([HumanMessage("un Ford Ka")]))
+    assert contents(first) == ["hola", "buenas", "un Ford Ka"]
+    assert (first.cache.hits, first.cache.misses) == (1, 1)
+
+
+def test_cached_history_is_read_again_after_a_clear(monkeypatch):
+    collection = FakeCollection()
+    first = worker_history(collection, monkeypatch)
+    second = worker_history(collection, monkeypatch)
+    asyncio.run(first.aadd_messages([HumanMessage("hola")]))
+    assert contents(first) == ["hola"]
+
+    asyncio.run(second.aclear())
+    assert contents(first) == []
+    asyncio.run(second.aadd_messages([HumanMessage("de nuevo")]))
+    assert contents(first) == ["de nuevo"]
+
+
+def test_feedback_of_an_existing_conversation(monkeypatch):
+    collection = FakeCollection()
+    chat_history = worker_history(collection, monkeypatch)
+    assert not asyncio.run(chat_history.aexists())
+
+    asyncio.run(chat_history.aadd_messages([HumanMessage("hola"), AIMessage("buenas")]))
+    assert asyncio.run(chat_history.aexists())
+    assert asyncio.run(chat_history.aget_existing_conversation_id()) == "conversation"
+    assert asyncio.run(chat_history.aget_last_message_for_user()).content == "buenas"
+    assert asyncio.run(chat_history.aupdate_feedback(5, "muy bien")) == 2
+    assert {document["feedback_score"] for document in collection.documents} == {5}
@@ -0,0 +1,72 @@
+from scraper.checkpoint import CrawlCheckpoint
+
+
+def test_advances_to_the_page_before_the_lowest_pending(tmp_path):
+    checkpoint = CrawlCheckpoint(tmp_path / "site.json")
+    checkpoint.page_queued(1, ["a", "b"])
+    checkpoint.page_queued(2, ["c"])
+    assert checkpoint.last_completed_page == 0
+
+    checkpoint.stored(["a", "b"])
+    assert checkpoint.last_completed_page == 1
+    checkpoint.stored(["c"])
+    assert checkpoint.last_completed_page == 2
+
+
+def test_gave_up_links_do_not_hold_the_page_back(tmp_path):
+    checkpoint = CrawlCheckpoint(tmp_path / "site.json")
+    checkpoint.page_queued(1, ["a"])
+    checkpoint.retrying("a", 1, "timeout")
+    assert checkpoint.failed["a"]["page"] == 1
+    assert checkpoint.last_completed_page == 0
+
+    checkpoint.gave_up("a", 3, "timeout")
+    assert checkpoint.last_completed_page == 1
+    assert checkpoint.failed["a"]["attempts"] == 3
+
+
+def test_failed_listing_page_counts_as_queued(tmp_path):
+    checkpoint = CrawlCheckpoint(tmp_path / "site.json")
+    checkpoint.page_queued(1, [])
+    checkpoint.page_failed(2, 4, "ClientError")
+    checkpoint.page_queued(3, [])
+    assert checkpoint.last_completed_page == 3
+    assert checkpoint.failed_pages["2"]["attempts"] == 4
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "state" / "site.json"
+    checkpoint = CrawlCheckpoint(path)
+    assert checkpoint.resume_page() is None
+    checkpoint.page_queued(1, [])
+    checkpoint.page_queued(2, ["a"])
+    checkpoint.page_failed(3, 2, "boom")
+    checkpoint.save()
+
+    loaded = CrawlCheckpoint.load(path)
+    assert loaded.last_completed_page == 1
+    assert loaded.last_queued_page == 3
+    assert loaded.pending == {"a": 2}
+    assert set(loaded.failed_pages) == {"3"}
+    assert loaded.resume_page() == 2
+    assert not path.with_suffix(".tmp").exists()
+
+    loaded.reset()
+    assert not path.exists()
+    assert loaded.pending == {} and loaded.last_completed_page == 0
+
+
+def test_reset_can_keep_the_failed_links(tmp_path):
+    path = tmp_path / "site.json"
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.page_queued(1, ["a", "b"])
+    checkpoint.page_failed(2, 4, "ClientError")
+    checkpoint.gave_up("a", 3, "timeout")
+    checkpoint.reset(keep_failed=True)
+
+    loaded = CrawlCheckpoint.load(path)
+    assert set(loaded.failed) == {"a"}
+    assert loaded.pending == {} and loaded.failed_pages == {}
+    assert loaded.last_queued_page == 0
+    # Only failed links left, the next crawl starts from its own first page
+    assert loaded.resume_page() is None
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from infoparser.crud_auto import (
+    RAW_STATUS_DEAD,
+    RAW_STATUS_PENDING,
+    RAW_STATUS_PROCESSING,
+    AutoDataBaseCRUD,
+)
+from tests.fakes import matches
+
+NOW = datetime(2024, 10, 1, 12, tzinfo=timezone.utc)
+
+
+def evaluate(document: dict, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    if isinstance(expression, dict):
+        (operator, arguments), = expression.items()
+        values = [evaluate(document, argument) for argument in arguments]
+        if operator == "$subtract":
+            return values[0] - values[1]
+        if operator == "$gte":
+            return values[0] >= values[1]
+        if operator == "$cond":
+            return values[1] if values[0] else values[2]
+        raise NotImplementedError(operator)
+    return expression
+
+
+class FakeRawCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def update_one(self, query, pipeline):
+        for document in self.documents:
+            if matches(document, query):
+                for stage in pipeline:
+                    document.update({field: evaluate(document, value) for field, value in stage["$set"].items()})
+                return
+
+
+def raw_car(**fields):
+    return {"extracted": False, "batch_id": None, "status": RAW_STATUS_PENDING, "lease_until": None, "attempts": 0, **fields}
+
+
+def claimable(document, max_attempts=3):
+    return matches(document, AutoDataBaseCRUD._claimable_filter(NOW, max_attempts))
+
+
+def test_claimable_filter_takes_free_and_expired_cars():
+    assert claimable(raw_car())
+    assert claimable({"extracted": False, "batch_id": None})
+    assert claimable(raw_car(status=RAW_STATUS_PROCESSING, lease_until=NOW - timedelta(seconds=1), attempts=1))
+
+
+def test_claimable_filter_skips_held_cars():
+    assert not claimable(raw_car(status=RAW_STATUS_PROCESSING, lease_until=NOW + timedelta(minutes=5), attempts=1))
+    assert not claimable(raw_car(extracted=True))
+    assert not claimable(raw_car(batch_id="batch_1"))
+    assert not claimable(raw_car(status=RAW_STATUS_DEAD))
+    assert not claimable(raw_car(attempts=3))
+    assert matches(raw_car(attempts=3), AutoDataBaseCRUD._claimable_filter(NOW))
+
+
+def release(document, worker_id="worker", max_attempts=3, count_attempt=True):
+    crud = AutoDataBaseCRUD.__new__(AutoDataBaseCRUD)
+    crud.autos_raw_collection = FakeRawCollection([document])
+    asyncio.run(crud.release_raw_car(str(document["_id"]), worker_id, "boom", max_attempts, count_attempt))
+    return document
+
+
+def claimed(attempts):
+    return raw_car(
+        _id=ObjectId(), status=RAW_STATUS_PROCESSING, claimed_by="worker", lease_until=NOW, attempts=attempts
+    )
+
+
+def test_release_requeues_until_the_last_attempt():
+    document = release(claimed(1))
+    assert document["status"] == RAW_STATUS_PENDING
+    assert document["attempts"] == 1
+    assert document["lease_until"] is None
+    assert document["last_error"] == "boom"
+
+    assert release(claimed(3))["status"] == RAW_STATUS_DEAD
+
+
+def test_release_without_counting_the_attempt():
+    document = release(claimed(3), count_attempt=False)
+    assert document["status"] == RAW_STATUS_PENDING
+    assert document["attempts"] == 2
+
+
+def test_release_ignores_cars_claimed_by_another_worker():
+    document = release(claimed(1), worker_id="other")
+    assert document["status"] == RAW_STATUS_PROCESSING
+    assert "last_error" not in document
@@ -0,0 +1,86 @@
+import asyncio
+from collections import Counter
+
+from infoparser.facets import (
+    FACETS_COLLECTION,
+    FACETS_VERSION_ID,
+    METADATA_COLLECTION,
+    FacetCatalog,
+    apply_facet_deltas,
+    facet_deltas,
+)
+from infoparser.crud_auto import AutoDataBaseCRUD
+from tests.fakes import FakeDatabase, make_car
+
+
+def version(db: FakeDatabase):
+    metadata = asyncio.run(db[METADATA_COLLECTION].find_one({"_id": FACETS_VERSION_ID}))
+    return metadata["version"] if metadata else None
+
+
+def counts(db: FakeDatabase) -> dict:
+    return {(facet["field"], facet["value"]): facet["count"] for facet in db[FACETS_COLLECTION].documents}
+
+
+def test_facet_deltas_of_an_insert_an_update_and_a_delete():
+    car = {"marca": "Ford", "modelo": "Ka", "color": None, "other_info": "ignored"}
+    assert facet_deltas(None, car) == Counter({("marca", "Ford"): 1, ("modelo", "Ka"): 1})
+    assert facet_deltas(car, {**car, "modelo": "Fiesta", "color": "Rojo"}) == Counter(
+        {("modelo", "Ka"): -1, ("modelo", "Fiesta"): 1, ("color", "Rojo"): 1}
+    )
+    assert facet_deltas(car, car) == Counter()
+    assert facet_deltas(car, None) == Counter({("marca", "Ford"): -1, ("modelo", "Ka"): -1})
+
+
+def test_version_only_changes_when_a_value_appears_or_disappears():
+    db = FakeDatabase()
+    asyncio.run(apply_facet_deltas(db, facet_deltas(None, {"marca": "Ford"})))
+    assert version(db) == 1
+
+    # Another Ford only changes a count
+    asyncio.run(apply_facet_deltas(db, facet_deltas(None, {"marca": "Ford"})))
+    assert version(db) == 1 and counts(db) == {("marca", "Ford"): 2}
+
+    asyncio.run(apply_facet_deltas(db, facet_deltas({"marca": "Ford"}, None)))
+    assert version(db) == 1 and counts(db) == {("marca", "Ford"): 1}
+
+    asyncio.run(apply_facet_deltas(db, facet_deltas({"marca": "Ford"}, {"marca": "Fiat"})))
+    assert version(db) == 2 and counts(db) == {("marca", "Fiat"): 1}
+
+    asyncio.run(apply_facet_deltas(db, Counter({("marca", "Fiat"): 0})))
+    assert version(db) == 2
+
+
+def test_insert_car_counts_from_the_version_it_replaced():
+    db = FakeDatabase()
+    crud = AutoDataBaseCRUD(db)
+    first = asyncio.run(crud.insert_car(make_car(marca="Ford"), "6530f0c0a1b2c3d4e5f60718"))
+    second = asyncio.run(crud.insert_car(make_car(marca="Fiat"), "6530f0c0a1b2c3d4e5f60718"))
+    assert first.id == second.id and second.created_at == first.created_at
+    assert {key: count for key, count in counts(db).items() if key[0] == "marca"} == {("marca", "Fiat"): 1}
+
+
+def test_catalog_is_cached_until_the_version_changes():
+    db = FakeDatabase()
+    catalog = FacetCatalog()
+    for marca in ["Ford", "Fiat", "Ford"]:
+        asyncio.run(apply_facet_deltas(db, facet_deltas(None, {"marca": marca, "color": "Rojo"})))
+
+    assert asyncio.run(catalog.get_values(db, ["marca", "color"])) == {"marca": ["Ford", "Fiat"], "color": ["Rojo"]}
+    assert (catalog.hits, catalog.misses) == (0, 2)
+    assert asyncio.run(catalog.get_values(db, ["marca"])) == {"marca": ["Ford", "Fiat"]}
+    assert (catalog.hits, catalog.misses) == (1, 2)
+
+    asyncio.run(apply_facet_deltas(db, facet_deltas(None, {"marca": "Renault"})))
+    assert asyncio.run(catalog.get_values(db, ["marca"])) == {"marca": ["Ford", "Fiat", "Renault"]}
+    assert (catalog.hits, catalog.misses) == (1, 3)
+
+
+def test_catalog_is_not_rolled_back_by_an_older_version():
+    db = FakeDatabase()
+    catalog = FacetCatalog()
+    asyncio.run(apply_facet_deltas(db, facet_deltas(None, {"marca": "Ford"})))
+    catalog.version = 5
+    catalog.values = {"marca": ["Ford", "Fiat"]}
+    assert asyncio.run(catalog.get_values(db, ["marca"])) == {"marca": ["Ford", "Fiat"]}
+    assert catalog.version == 5
@@ -0,0 +1,66 @@
+import asyncio
+
+from bson import ObjectId
+
+from infoparser.crud_auto import AutoDataBaseCRUD
+from infoparser.ingest import CarIngestSink
+from tests.fakes import FakeCollection, FakeDatabase, make_car
+
+
+def raw_cars(db: FakeDatabase, count: int) -> list:
+    ids = [ObjectId() for _ in range(count)]
+    db["autos_raw"].documents.extend({"_id": car_id, "extracted": False} for car_id in ids)
+    return [str(car_id) for car_id in ids]
+
+
+def test_sink_flushes_by_size_and_on_exit():
+    async def run():
+        db = FakeDatabase()
+        crud = AutoDataBaseCRUD(db)
+        raw_ids = raw_cars(db, 5)
+        async with CarIngestSink(crud, flush_size=2, flush_interval=60) as sink:
+            for index, raw_id in enumerate(raw_ids):
+                await sink.add(make_car(external_id=str(index)), raw_id)
+        assert sink.flushes == 3
+        assert sink.inserted == 5 and sink.new_listings == 5 and sink.failed == 0
+        assert len(db["autos"].documents) == 5
+        assert all(raw["extracted"] for raw in db["autos_raw"].documents)
+
+    asyncio.run(run())
+
+
+def test_sink_flushes_after_the_interval():
+    async def run():
+        db = FakeDatabase()
+        raw_id, = raw_cars(db, 1)
+        async with CarIngestSink(AutoDataBaseCRUD(db), flush_size=50, flush_interval=0.01) as sink:
+            await sink.add(make_car(), raw_id)
+            await asyncio.sleep(0.1)
+            assert sink.flushes == 1
+
+    asyncio.run(run())
+
+
+class RacingCollection(FakeCollection):
+    """Another writer inserts the listing right before the upsert and deletes it right after."""
+
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.documents.append({"_id": ObjectId(), **request._filter})
+        result = await super().bulk_write(requests, ordered)
+        self.documents = []
+        return result
+
+
+def test_insert_cars_stores_again_a_listing_deleted_meanwhile():
+    async def run():
+        db = FakeDatabase()
+        db["autos"] = RacingCollection()
+        raw_id, = raw_cars(db, 1)
+        new_listings = await AutoDataBaseCRUD(db).insert_cars([(make_car(), raw_id, None)])
+        assert new_listings == 0
+        stored, = db["autos"].documents
+        assert stored["marca"] == "Ford"
+        assert db["autos_raw"].documents[0]["extracted_car_id"] == str(stored["_id"])
+
+    asyncio.run(run())
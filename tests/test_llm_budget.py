@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from infoparser.llm_budget import LLMBudget, call_with_budget, parse_reset, retry_after_seconds
+
+
+def rate_limit_error(headers: dict) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class RawResponse:
+    def __init__(self, total_tokens=None, headers=None, parse_error=None):
+        self.headers = httpx.Headers(headers or {})
+        self.total_tokens = total_tokens
+        self.parse_error = parse_error
+
+    def parse(self):
+        if self.parse_error is not None:
+            raise self.parse_error
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=self.total_tokens) if self.total_tokens else None)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("1s", 1.0), ("6m0s", 360.0), ("20ms", 0.02), ("1h2m3s", 3723.0), ("0.5s", 0.5), (None, None), ("", None), ("soon", None)],
+)
+def test_parse_reset(value, expected):
+    assert parse_reset(value) == (pytest.approx(expected) if expected is not None else None)
+
+
+def test_retry_after_seconds_prefers_milliseconds_then_seconds_then_resets():
+    assert retry_after_seconds(rate_limit_error({"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+    assert retry_after_seconds(rate_limit_error({"retry-after": "9"})) == 9.0
+    error = rate_limit_error({"x-ratelimit-reset-requests": "2s", "x-ratelimit-reset-tokens": "1m"})
+    assert retry_after_seconds(error) == 60.0
+    assert retry_after_seconds(rate_limit_error({})) is None
+
+
+def test_release_gives_back_what_acquire_reserved():
+    async def run():
+        budget = LLMBudget(requests_per_minute=600, tokens_per_minute=10_000, headroom=1.0)
+        # Skip the cold start, a new budget only holds a tenth of the quota
+        budget._token_budget = budget._token_capacity
+        # Bigger than the whole budget, reserved as the whole budget
+        reserved = await budget.acquire(50_000)
+        assert reserved == 10_000
+        assert budget._in_flight == 1 and budget._in_flight_tokens == 10_000
+        await budget.release(reserved, used_tokens=4_000)
+        assert budget._in_flight == 0 and budget._in_flight_tokens == 0
+        assert budget.estimated_tokens == 10_000 and budget.used_tokens == 4_000
+        # The overbooked 6000 tokens come back
+        assert budget._token_budget == pytest.approx(6_000, abs=10)
+
+    asyncio.run(run())
+
+
+def test_headers_set_the_limits_and_the_remaining_budget():
+    async def run():
+        budget = LLMBudget(requests_per_minute=100, tokens_per_minute=1_000, headroom=0.5)
+        reserved = await budget.acquire(10)
+        headers = httpx.Headers({
+            "x-ratelimit-limit-requests": "5000",
+            "x-ratelimit-limit-tokens": "2000000",
+            "x-ratelimit-remaining-requests": "4000",
+            "x-ratelimit-remaining-tokens": "1500000",
+        })
+        await budget.release(reserved, headers=headers)
+        assert budget.requests_per_minute == 5000 and budget.tokens_per_minute == 2_000_000
+        assert budget._limits_known
+        assert budget._request_budget == pytest.approx(4000 - 2500)
+        assert budget._token_budget == pytest.approx(1_500_000 - 1_000_000)
+
+    asyncio.run(run())
+
+
+def test_call_with_budget_releases_the_slot_when_parse_fails():
+    async def request():
+        return RawResponse(parse_error=ValueError("bad json"))
+
+    async def run():
+        budget = LLMBudget()
+        with pytest.raises(ValueError):
+            await call_with_budget(budget, 100, request)
+        assert budget._in_flight == 0 and budget._in_flight_tokens == 0
+        assert budget.requests == 1
+
+    asyncio.run(run())
+
+
+def test_call_with_budget_retries_rate_limits():
+    responses = [rate_limit_error({"retry-after-ms": "1"}), RawResponse(total_tokens=80)]
+
+    async def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def run():
+        budget = LLMBudget(requests_per_minute=6000, tokens_per_minute=1_000_000)
+        response = await call_with_budget(budget, 100, request, backoff=0.0)
+        assert response.usage.total_tokens == 80
+        assert budget.requests == 2 and budget.throttled == 1
+        assert budget.used_tokens == 80
+        assert budget._in_flight == 0 and budget._in_flight_tokens == 0
+
+    asyncio.run(run())
+
+
+def test_call_with_budget_raises_after_the_last_attempt():
+    async def request():
+        raise rate_limit_error({"retry-after-ms": "1"})
+
+    async def run():
+        budget = LLMBudget(requests_per_minute=6000, tokens_per_minute=1_000_000)
+        with pytest.raises(openai.RateLimitError):
+            await call_with_budget(budget, 100, request, max_attempts=2, backoff=0.0)
+        assert budget.requests == 2 and budget._in_flight == 0
+
+    asyncio.run(run())
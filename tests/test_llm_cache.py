@@ -0,0 +1,48 @@
+import asyncio
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from infoparser.llm_cache import ExtractionCache
+
+
+class Car(BaseModel):
+    marca: str
+
+
+class CarWithModel(BaseModel):
+    marca: str
+    modelo: Optional[str] = None
+
+
+class CarDescribed(BaseModel):
+    marca: str = Field(description="Marca del auto")
+
+
+class FakeCollection:
+    def __init__(self, documents=None):
+        self.documents = documents or {}
+
+    async def find_one_and_update(self, query, update, projection=None):
+        return self.documents.get(query["_id"])
+
+
+def test_key_ignores_whitespace_only_changes():
+    key = ExtractionCache.key("Ford  Ka\n 2010", "prompt", "gpt-4o-mini", Car)
+    assert key == ExtractionCache.key(" Ford Ka 2010 ", "prompt", "gpt-4o-mini", Car)
+
+
+def test_key_changes_with_content_prompt_model_and_schema():
+    key = ExtractionCache.key("Ford Ka", "prompt", "gpt-4o-mini", Car)
+    assert key != ExtractionCache.key("Ford Fiesta", "prompt", "gpt-4o-mini", Car)
+    assert key != ExtractionCache.key("Ford Ka", "other prompt", "gpt-4o-mini", Car)
+    assert key != ExtractionCache.key("Ford Ka", "prompt", "gpt-4o", Car)
+    assert key != ExtractionCache.key("Ford Ka", "prompt", "gpt-4o-mini", CarWithModel)
+    assert key != ExtractionCache.key("Ford Ka", "prompt", "gpt-4o-mini", CarDescribed)
+
+
+def test_get_counts_hits_and_misses():
+    cache = ExtractionCache(FakeCollection({"known": {"_id": "known", "value": {"marca": "Ford"}}}))
+    assert asyncio.run(cache.get("known")) == {"marca": "Ford"}
+    assert asyncio.run(cache.get("unknown")) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
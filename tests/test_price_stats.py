@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from infoparser.facets import FacetCatalog, apply_facet_deltas, facet_deltas
+from infoparser.price_stats import (
+    PRICE_STATS_COLLECTION,
+    _cell_updates,
+    apply_price_stats_updates,
+    bucket,
+    bucket_value,
+    cell_id,
+    claim_rebuild,
+    expand_spellings,
+    get_price_cells,
+    price_stats_updates,
+    summarize_cells,
+)
+from tests.fakes import FakeDatabase
+
+NOW = datetime(2024, 10, 1, 12, tzinfo=timezone.utc)
+
+
+def car(precio, moneda="ARS", **fields):
+    return {
+        "_id": ObjectId(), "marca": "Ford", "modelo": "Ka", "year": "2018", "version": "1.5 S",
+        "precio": precio, "moneda": moneda, "url": f"https://example.com/{precio}", "ignore": False, **fields,
+    }
+
+
+def store(db: FakeDatabase, *cars) -> None:
+    for stored in cars:
+        asyncio.run(apply_price_stats_updates(db, price_stats_updates(None, stored)))
+
+
+def cell(db: FakeDatabase, values) -> dict:
+    return asyncio.run(db[PRICE_STATS_COLLECTION].find_one({"_id": cell_id(values)}))
+
+
+def test_cell_id_normalizes_and_pads_the_prefix():
+    assert cell_id([" Ford ", "KA"]) == "ford|ka|*|*"
+    assert cell_id(["Ford", "Ka", 2018, None]) == "ford|ka|2018|"
+    assert cell_id([]) == "*|*|*|*"
+
+
+def test_bucket_value_falls_inside_its_bucket():
+    for price in (1, 999.5, 15_000_000):
+        assert bucket(bucket_value(bucket(price))) == bucket(price)
+        assert bucket_value(bucket(price)) == pytest.approx(price, rel=0.02)
+
+
+def test_cell_updates_cover_every_level():
+    stored = car(100)
+    updates = _cell_updates(stored, 1, NOW)
+    assert [update._filter["_id"] for update in updates] == [
+        "ford|*|*|*", "ford|ka|*|*", "ford|ka|2018|*", "ford|ka|2018|1.5 s",
+    ]
+    last = updates[-1]._doc
+    assert last["$inc"] == {
+        "currencies.ARS.count": 1, "currencies.ARS.sum": 100.0, f"currencies.ARS.hist.{bucket(100)}": 1,
+    }
+    assert last["$setOnInsert"] == {"marca": "ford", "modelo": "ka", "year": "2018", "version": "1.5 s"}
+    assert last["$min"]["currencies.ARS.min"] == {"value": 100.0, "id": str(stored["_id"]), "url": stored["url"]}
+    # Min/max are only fixed by a rebuild
+    assert "$min" not in _cell_updates(stored, -1, NOW)[0]._doc
+
+
+def test_price_stats_updates_only_for_counted_changes():
+    stored = car(100)
+    assert price_stats_updates(stored, {**stored, "color": "Rojo"}) == []
+    assert price_stats_updates(None, car(100, ignore=True)) == []
+    assert price_stats_updates(None, car(100, moneda="EUR")) == []
+    assert price_stats_updates(None, car(0)) == []
+    assert len(price_stats_updates(stored, {**stored, "precio": 90})) == 8
+    assert len(price_stats_updates(stored, None)) == 4
+
+
+def test_summarize_cells_merges_currencies():
+    db = FakeDatabase()
+    store(db, car(100), car(300), car(2, moneda="USD"))
+    summary = summarize_cells([cell(db, ["Ford"])], usd_rate=1000, percentiles=[0.25, 1.0])
+    assert summary["count"] == 3
+    assert summary["mean"] == pytest.approx((100 + 300 + 2000) / 3)
+    assert summary["min"]["precio"] == 100 and summary["min"]["moneda"] == "ARS"
+    assert summary["max"]["precio"] == 2 and summary["max"]["moneda"] == "USD"
+    assert summary["max"]["value"] == 2000
+    assert summary["median"] == pytest.approx(300, rel=0.02)
+    assert summary["percentiles"][0.25] == pytest.approx(100, rel=0.02)
+    assert summary["percentiles"][1.0] == pytest.approx(2000, rel=0.02)
+
+
+def test_removed_cars_leave_the_counts():
+    db = FakeDatabase()
+    first, second = car(100), car(300)
+    store(db, first, second)
+    asyncio.run(apply_price_stats_updates(db, price_stats_updates(second, None)))
+    summary = summarize_cells([cell(db, ["Ford", "Ka"])], usd_rate=1000, percentiles=[])
+    assert summary["count"] == 1 and summary["mean"] == pytest.approx(100)
+    assert summarize_cells([], usd_rate=1000, percentiles=[]) is None
+
+
+def test_removing_a_car_without_cells_creates_none():
+    db = FakeDatabase()
+    # Stored before the cells were built
+    asyncio.run(apply_price_stats_updates(db, price_stats_updates(car(100), None)))
+    assert db[PRICE_STATS_COLLECTION].documents == []
+
+
+def test_get_price_cells_skips_emptied_cells():
+    db = FakeDatabase()
+    first = car(100)
+    store(db, first, car(200, modelo="Fiesta"))
+    asyncio.run(apply_price_stats_updates(db, price_stats_updates(first, None)))
+    cells = asyncio.run(get_price_cells(db, {"marca": ["Ford"], "modelo": ["Ka", "Fiesta"]}))
+    assert [found["_id"] for found in cells] == ["ford|fiesta|*|*"]
+
+
+def test_get_price_cells_only_answers_key_prefixes():
+    db = FakeDatabase()
+    store(db, car(100), car(200, modelo="Fiesta"))
+    cells = asyncio.run(get_price_cells(db, {"marca": ["FORD"], "modelo": ["ka", "Fiesta "]}))
+    assert sorted(found["_id"] for found in cells) == ["ford|fiesta|*|*", "ford|ka|*|*"]
+    with pytest.raises(LookupError):
+        asyncio.run(get_price_cells(db, {"modelo": ["Ka"]}))
+    with pytest.raises(LookupError):
+        asyncio.run(get_price_cells(db, {"marca": ["Ford"], "color": ["Rojo"]}))
+
+
+def test_expand_spellings_adds_stored_spellings(monkeypatch):
+    monkeypatch.setattr("infoparser.price_stats.facet_catalog", FacetCatalog())
+    db = FakeDatabase()
+    for marca in ["Ford", "FORD ", "Fiat"]:
+        asyncio.run(apply_facet_deltas(db, facet_deltas(None, {"marca": marca})))
+    expanded = asyncio.run(expand_spellings(db, {"marca": ["ford"], "color": ["Rojo"]}))
+    assert sorted(expanded["marca"]) == ["FORD ", "Ford", "ford"]
+    assert expanded["color"] == ["Rojo"]
+
+
+def test_only_one_process_claims_a_due_rebuild():
+    db = FakeDatabase()
+    assert asyncio.run(claim_rebuild(db, 3600))
+    assert not asyncio.run(claim_rebuild(db, 3600))
+    # Due again once the interval passed
+    db["autos_metadata"].documents[0]["next_rebuild_at"] = NOW
+    assert asyncio.run(claim_rebuild(db, 3600))
+    assert not asyncio.run(claim_rebuild(db, 3600))
@@ -0,0 +1,16 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from scraper.ratelimit import parse_retry_after
+
+
+@pytest.mark.parametrize("value, expected", [("120", 120.0), ("1.5", 1.5), ("-3", 0.0), (None, None), ("", None), ("soon", None)])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    assert parse_retry_after(formatdate(time.time() + 60, usegmt=True)) == pytest.approx(60, abs=2)
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0.0